@@ -21,7 +21,9 @@ class UserAdmin(BaseUserAdmin):
             'fields': ('is_active', 'is_verified', 'is_staff', 'is_superuser', 'groups', 'user_permissions'),
         }),
         (_('Important dates'), {'fields': ('last_login', 'date_joined')}),
+        (_('Stats'), {'fields': User.STATS_FIELDS}),
     )
+    readonly_fields = User.STATS_FIELDS
 
     add_fieldsets = (
         (None, {
@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand
+
+from accounts.models import User
+
+
+class Command(BaseCommand):
+    help = 'Recompute denormalized per-user counters and repair drifted rows.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report drifted users without writing.',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Users per batch (default: 500).',
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        batch_size = options['batch_size']
+
+        checked = 0
+        drifted = []
+        user_ids = list(User.objects.order_by('pk').values_list('pk', flat=True))
+
+        for start in range(0, len(user_ids), batch_size):
+            chunk = user_ids[start:start + batch_size]
+            stats = User.objects.compute_stats(chunk)
+            users = User.objects.filter(pk__in=chunk).only('pk', 'email', *User.STATS_FIELDS)
+
+            to_update = []
+            for user in users:
+                checked += 1
+                real = stats[user.pk]
+                if all(getattr(user, f) == real[f] for f in User.STATS_FIELDS):
+                    continue
+                for field, value in real.items():
+                    setattr(user, field, value)
+                to_update.append(user)
+                drifted.append(user.email)
+
+            if to_update and not dry_run:
+                User.objects.bulk_update(to_update, User.STATS_FIELDS)
+
+        for email in drifted:
+            self.stdout.write(f'  {email}')
+
+        prefix = '[DRY RUN] ' if dry_run else ''
+        verb = 'would be repaired' if dry_run else 'repaired'
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefix}Checked {checked} user(s), {len(drifted)} {verb}.'
+        ))
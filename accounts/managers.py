@@ -26,4 +26,67 @@ class UserManager(BaseUserManager):
         if extra_fields.get('is_superuser') is not True:
             raise ValueError(_('Superuser must have is_superuser=True.'))
 
-        return self.create_user(email, password, **extra_fields)
\ No newline at end of file
+        return self.create_user(email, password, **extra_fields)
+
+    def compute_stats(self, user_ids=None, visits=True):
+        """Посчитать агрегаты по bookings/visits из первоисточника.
+
+        Возвращает {user_id: {bookings_count, active_bookings_count,
+        lifetime_paid_aed[, last_visit_at]}}. Если передан user_ids — ключ есть
+        для каждого id (с нулями, если броней нет), иначе только для юзеров
+        с бронями/визитами. visits=False — только счётчики броней.
+        Используется User.refresh_stats() и командой reconcile_user_stats.
+
+        last_visit_at не бывает меньше сохранённого: archive_visits удаляет
+        старые визиты, и Max по оставшимся строкам его бы обнулил.
+        """
+        from decimal import Decimal
+        from django.db.models import Count, Max, Q, Sum
+        from bookings.models import Booking
+        from visits.models import Visit
+
+        bookings = Booking.objects.all()
+        if user_ids is not None:
+            bookings = bookings.filter(user_id__in=user_ids)
+
+        empty = {
+            'bookings_count': 0,
+            'active_bookings_count': 0,
+            'lifetime_paid_aed': Decimal('0'),
+        }
+        if visits:
+            empty['last_visit_at'] = None
+        stats = {pk: dict(empty) for pk in (user_ids or [])}
+
+        rows = bookings.values('user_id').annotate(
+            total=Count('id'),
+            active=Count('id', filter=Q(
+                status=Booking.Status.PAID, parent_booking__isnull=True,
+            )),
+            paid=Sum('payment_amount_collected', filter=Q(paid_at__isnull=False)),
+        ).order_by()
+        for row in rows:
+            stats.setdefault(row['user_id'], dict(empty)).update(
+                bookings_count=row['total'],
+                active_bookings_count=row['active'],
+                lifetime_paid_aed=row['paid'] or Decimal('0'),
+            )
+
+        if not visits:
+            return stats
+
+        # Visit.user — копия владельца брони с индексом (user, visited_at)
+        raw = Visit.objects.filter(user__isnull=False)
+        stored = self.filter(last_visit_at__isnull=False)
+        if user_ids is not None:
+            raw = raw.filter(user_id__in=user_ids)
+            stored = stored.filter(pk__in=user_ids)
+
+        for user_id, last in raw.values_list('user_id').annotate(last=Max('visited_at')).order_by():
+            stats.setdefault(user_id, dict(empty))['last_visit_at'] = last
+        for user_id, last in stored.values_list('pk', 'last_visit_at'):
+            row = stats.setdefault(user_id, dict(empty))
+            if row['last_visit_at'] is None or row['last_visit_at'] < last:
+                row['last_visit_at'] = last
+
+        return stats
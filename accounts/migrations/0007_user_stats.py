@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0006_alter_user_id_card_alter_user_phone'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='active_bookings_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='active bookings'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='bookings_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='bookings count'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='last_visit_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='last visit'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='lifetime_paid_aed',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='lifetime paid (AED)'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['bookings_count'], name='idx_user_bookings_count'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['lifetime_paid_aed'], name='idx_user_lifetime_paid'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['last_visit_at'], name='idx_user_last_visit'),
+        ),
+    ]
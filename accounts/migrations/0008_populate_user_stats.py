@@ -0,0 +1,37 @@
+from django.db import migrations
+from django.db.models import Count, Max, Q, Sum
+
+
+def populate_user_stats(apps, schema_editor):
+    User = apps.get_model('accounts', 'User')
+    Booking = apps.get_model('bookings', 'Booking')
+    Visit = apps.get_model('visits', 'Visit')
+
+    rows = Booking.objects.values('user_id').annotate(
+        total=Count('id'),
+        active=Count('id', filter=Q(status='paid', parent_booking__isnull=True)),
+        paid=Sum('payment_amount_collected', filter=Q(paid_at__isnull=False)),
+    ).order_by()
+    for row in rows:
+        User.objects.filter(pk=row['user_id']).update(
+            bookings_count=row['total'],
+            active_bookings_count=row['active'],
+            lifetime_paid_aed=row['paid'] or 0,
+        )
+
+    rows = Visit.objects.values('booking__user_id').annotate(last=Max('visited_at')).order_by()
+    for row in rows:
+        User.objects.filter(pk=row['booking__user_id']).update(last_visit_at=row['last'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0007_user_stats'),
+        ('bookings', '0013_remove_active_expired_status'),
+        ('visits', '0007_populate_visit_daily_stats'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_user_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0008_populate_user_stats'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='telegramlinktoken',
+            index=models.Index(fields=['expires_at'], name='idx_tg_token_expires'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0009_token_expiry_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='cabinet_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
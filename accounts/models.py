@@ -82,18 +82,84 @@ class User(AbstractBaseUser, PermissionsMixin):
         ]
     )
 
+    # Денормализованные агрегаты для backoffice — обновляются из событий
+    # бронирований (refresh_stats) и визитов (note_visit), дрейф чинит
+    # reconcile_user_stats.
+    bookings_count = models.PositiveIntegerField(_('bookings count'), default=0)
+    active_bookings_count = models.PositiveIntegerField(_('active bookings'), default=0)
+    lifetime_paid_aed = models.DecimalField(
+        _('lifetime paid (AED)'),
+        max_digits=12,
+        decimal_places=2,
+        default=0,
+    )
+    last_visit_at = models.DateTimeField(_('last visit'), null=True, blank=True)
+
+    # Версия снепшота кабинета (dashboard.services): сдвигается UPDATE'ом
+    # F()+1 на каждое событие брони, оплаты или визита.
+    cabinet_version = models.PositiveIntegerField(default=0, editable=False)
+
     objects = UserManager()
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['first_name', 'last_name', 'phone', 'id_card']
 
+    BOOKING_STATS_FIELDS = ['bookings_count', 'active_bookings_count', 'lifetime_paid_aed']
+    STATS_FIELDS = BOOKING_STATS_FIELDS + ['last_visit_at']
+
     class Meta:
         verbose_name = _('user')
         verbose_name_plural = _('users')
+        indexes = [
+            models.Index(fields=['bookings_count'], name='idx_user_bookings_count'),
+            models.Index(fields=['lifetime_paid_aed'], name='idx_user_lifetime_paid'),
+            models.Index(fields=['last_visit_at'], name='idx_user_last_visit'),
+        ]
 
     def __str__(self):
         return self.email
 
+    def save(self, *args, **kwargs):
+        # Полное сохранение (смена пароля, профиль, админка) не пишет
+        # денормализованные счётчики и cabinet_version — их двигают UPDATE'ы
+        # из событий броней и визитов. Устаревший экземпляр иначе откатил бы
+        # параллельно записанные счётчики, а откат версии вернул бы старый
+        # снепшот кабинета из кэша.
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            skipped = {*self.STATS_FIELDS, 'cabinet_version'}
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in skipped
+            ]
+        super().save(*args, **kwargs)
+
+    def refresh_stats(self):
+        """Пересчитать счётчики по бронированиям.
+
+        last_visit_at не трогает — его сдвигает note_visit() при каждом визите.
+        Пишет через UPDATE только stats-поля — не затирает профиль, если
+        экземпляр в памяти устарел.
+        """
+        stats = User.objects.compute_stats([self.pk], visits=False)[self.pk]
+        User.objects.filter(pk=self.pk).update(**stats)
+        for field, value in stats.items():
+            setattr(self, field, value)
+
+    @classmethod
+    def refresh_stats_many(cls, user_ids):
+        """refresh_stats() для набора пользователей: один расчёт, один bulk UPDATE."""
+        stats = cls.objects.compute_stats(list(user_ids), visits=False)
+        cls.objects.bulk_update(
+            [cls(pk=pk, **values) for pk, values in stats.items()], cls.BOOKING_STATS_FIELDS,
+        )
+
+    @classmethod
+    def note_visit(cls, user_id, visited_at):
+        """Сдвинуть last_visit_at вперёд (без пересчёта остальных агрегатов)."""
+        cls.objects.filter(pk=user_id).filter(
+            models.Q(last_visit_at__isnull=True) | models.Q(last_visit_at__lt=visited_at)
+        ).update(last_visit_at=visited_at)
+
     def get_full_name(self):
         full_name = f'{self.first_name} {self.last_name}'.strip()
         return full_name or self.email
@@ -110,6 +176,11 @@ class TelegramLinkToken(models.Model):
     expires_at = models.DateTimeField()
     is_used = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['expires_at'], name='idx_tg_token_expires'),
+        ]
+
     @classmethod
     def create_for_user(cls, user):
         import secrets
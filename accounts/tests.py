@@ -567,3 +567,35 @@ class LoginViewTests(TestCase):
         )
         self.assertEqual(response.status_code, 200)
         self.assertNotIn('_auth_user_id', self.client.session)
+
+
+class TelegramWebhookDedupTests(TestCase):
+
+    @patch('accounts.views.send_telegram_message')
+    def test_repeated_update_is_processed_once(self, mock_send):
+        body = {'update_id': 1001, 'message': {'text': '/start', 'chat': {'id': 555}}}
+        for _ in range(2):
+            resp = self.client.post(
+                reverse('telegram_webhook'), data=body, content_type='application/json',
+            )
+            self.assertEqual(resp.status_code, 200)
+        self.assertEqual(mock_send.call_count, 1)
+
+    @patch('accounts.views.send_telegram_message')
+    def test_failed_update_is_processed_on_redelivery(self, mock_send):
+        from django.test import Client
+
+        from core.models import IdempotencyKey
+
+        mock_send.side_effect = [RuntimeError('telegram down'), None]
+        client = Client(raise_request_exception=False)
+        body = {'update_id': 1002, 'message': {'text': '/start', 'chat': {'id': 555}}}
+
+        resp = client.post(reverse('telegram_webhook'), data=body, content_type='application/json')
+        self.assertEqual(resp.status_code, 500)
+        # Ключ откатился вместе с упавшей обработкой
+        self.assertFalse(IdempotencyKey.objects.filter(scope='telegram', key='1002').exists())
+
+        resp = client.post(reverse('telegram_webhook'), data=body, content_type='application/json')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(mock_send.call_count, 2)
@@ -3,6 +3,7 @@ from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
 from django.conf import settings
+from django.db import transaction
 
 import json
 
@@ -13,6 +14,8 @@ from django.utils.translation import gettext_lazy as _
 from django.contrib import messages
 from django.urls import reverse
 
+from core.idempotency import first_delivery
+from core.profiling import external_call
 from .forms import RegisterForm, LoginForm, ForgotPasswordForm, ResetPasswordForm
 from .tokens import password_reset_token, email_verification_token
 from .services import send_verification_email, send_password_reset_email
@@ -300,13 +303,26 @@ def telegram_webhook(request):
     except json.JSONDecodeError:
         return JsonResponse({'error': 'Invalid JSON'}, status=400)
 
-    message = data.get('message', {})
+    # Telegram повторяет update при таймауте — второй раз не обрабатываем.
+    # Ключ и обработка — одна транзакция: если обработка упала, ключ
+    # откатывается и повтор от Telegram обрабатывается заново.
+    update_id = data.get('update_id')
+    with transaction.atomic():
+        if update_id is not None and not first_delivery('telegram', update_id):
+            return JsonResponse({'ok': True})
+        _handle_telegram_message(data.get('message', {}))
+
+    return JsonResponse({'ok': True})
+
+
+def _handle_telegram_message(message):
+    """Команды бота: /start <токен> (привязка), /start, /disconnect."""
     text = message.get('text', '')
     chat = message.get('chat', {})
     chat_id = chat.get('id')
 
     if not chat_id:
-        return JsonResponse({'ok': True})
+        return
 
     # Обработка команды /start с токеном
     if text.startswith('/start '):
@@ -356,7 +372,6 @@ def telegram_webhook(request):
         except User.DoesNotExist:
             send_telegram_message(chat_id, "You don't have a connected account.")
 
-    return JsonResponse({'ok': True})
 
 
 def send_telegram_message(chat_id, text):
@@ -368,10 +383,11 @@ def send_telegram_message(chat_id, text):
         return
 
     try:
-        requests.post(
-            f'https://api.telegram.org/bot{bot_token}/sendMessage',
-            json={'chat_id': chat_id, 'text': text},
-            timeout=10
-        )
+        with external_call('telegram'):
+            requests.post(
+                f'https://api.telegram.org/bot{bot_token}/sendMessage',
+                json={'chat_id': chat_id, 'text': text},
+                timeout=10
+            )
     except Exception:
         pass
\ No newline at end of file
@@ -875,3 +875,260 @@ class ActivateExternallyPaidTest(ManagerFlowTestMixin, TestCase):
         booking.cancel()
         result = booking.activate_externally_paid(Decimal('500.00'))
         self.assertFalse(result)
+
+
+class UserStatsTest(ManagerFlowTestMixin, TestCase):
+    """Денормализованные счётчики User обновляются из событий броней/визитов."""
+
+    def setUp(self):
+        self.create_base()
+        self.customer = User.objects.create_user(
+            email='stats@example.com', password='p123456789',
+            first_name='S', last_name='C',
+        )
+
+    def _make_booking(self, user=None):
+        return Booking.objects.create(
+            user=user or self.customer,
+            tariff=self.tariff,
+            period=self.period,
+            start_date=timezone.now().date(),
+            quantity=1,
+            unit_price_aed=Decimal('500.00'),
+            price_aed=Decimal('500.00'),
+            addons_aed=Decimal('0'),
+            deposit_aed=Decimal('0'),
+            total_aed=Decimal('500.00'),
+            payment_method=Booking.PaymentMethod.CASH,
+        )
+
+    def test_create_pay_complete_updates_counters(self):
+        booking = self._make_booking()
+        self.customer.refresh_from_db()
+        self.assertEqual(self.customer.bookings_count, 1)
+        self.assertEqual(self.customer.active_bookings_count, 0)
+
+        booking.activate_externally_paid(Decimal('450.00'))
+        self.customer.refresh_from_db()
+        self.assertEqual(self.customer.active_bookings_count, 1)
+        self.assertEqual(self.customer.lifetime_paid_aed, Decimal('450.00'))
+
+        booking.refresh_from_db()
+        booking.complete()
+        self.customer.refresh_from_db()
+        self.assertEqual(self.customer.bookings_count, 1)
+        self.assertEqual(self.customer.active_bookings_count, 0)
+        self.assertEqual(self.customer.lifetime_paid_aed, Decimal('450.00'))
+
+    def test_save_without_stats_changes_skips_recount(self):
+        booking = self._make_booking()
+        booking = Booking.objects.get(pk=booking.pk)
+        booking.manager_notes = 'called the customer'
+        # UPDATE брони и версии кабинета — без агрегатов по броням и визитам владельца
+        with self.assertNumQueries(2):
+            booking.save()
+
+        booking.status = Booking.Status.PAID
+        booking.save()
+        self.customer.refresh_from_db()
+        self.assertEqual(self.customer.active_bookings_count, 1)
+
+    def test_cancel_keeps_paid_amount_zero(self):
+        booking = self._make_booking()
+        booking.cancel()
+        self.customer.refresh_from_db()
+        self.assertEqual(self.customer.bookings_count, 1)
+        self.assertEqual(self.customer.active_bookings_count, 0)
+        self.assertEqual(self.customer.lifetime_paid_aed, Decimal('0'))
+
+    def test_visit_sets_last_visit(self):
+        from visits.models import Visit
+        booking = self._make_booking()
+        booking.activate_externally_paid(Decimal('500.00'))
+        visit = Visit.objects.create(booking=booking, scanned_by=self.manager)
+        self.customer.refresh_from_db()
+        self.assertEqual(self.customer.last_visit_at, visit.visited_at)
+
+    def test_reconcile_repairs_drift(self):
+        from io import StringIO
+        from django.core.management import call_command
+
+        booking = self._make_booking()
+        booking.activate_externally_paid(Decimal('500.00'))
+        User.objects.filter(pk=self.customer.pk).update(
+            bookings_count=9, active_bookings_count=0, lifetime_paid_aed=0,
+        )
+
+        out = StringIO()
+        call_command('reconcile_user_stats', '--dry-run', stdout=out)
+        self.assertIn('1 would be repaired', out.getvalue())
+        self.customer.refresh_from_db()
+        self.assertEqual(self.customer.bookings_count, 9)
+
+        out = StringIO()
+        call_command('reconcile_user_stats', stdout=out)
+        self.assertIn('1 repaired', out.getvalue())
+        self.customer.refresh_from_db()
+        self.assertEqual(self.customer.bookings_count, 1)
+        self.assertEqual(self.customer.active_bookings_count, 1)
+        self.assertEqual(self.customer.lifetime_paid_aed, Decimal('500.00'))
+
+    def test_user_list_sorts_and_filters_by_counters(self):
+        other = User.objects.create_user(
+            email='other@example.com', password='p123456789',
+            first_name='O', last_name='C',
+        )
+        self._make_booking().activate_externally_paid(Decimal('500.00'))
+        self._make_booking()
+
+        resp = self.client.get(reverse('backoffice:user_list'), {'sort': 'bookings'})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(list(resp.context['users'])[0], self.customer)
+
+        resp = self.client.get(reverse('backoffice:user_list'), {'segment': 'active'})
+        self.assertEqual(list(resp.context['users']), [self.customer])
+
+        resp = self.client.get(reverse('backoffice:user_list'), {'segment': 'no_bookings'})
+        self.assertIn(other, list(resp.context['users']))
+        self.assertNotIn(self.customer, list(resp.context['users']))
+
+
+class ListProjectionTest(ManagerFlowTestMixin, TestCase):
+    """Списки грузят только нужные колонки и не догружают их построчно."""
+
+    def setUp(self):
+        self.create_base()
+        self.customer = User.objects.create_user(
+            email='wide@example.com', password='p123456789',
+            first_name='W', last_name='R',
+        )
+
+    def _paid_booking(self):
+        booking = Booking.objects.create(
+            user=self.customer,
+            tariff=self.tariff,
+            period=self.period,
+            start_date=timezone.now().date(),
+            quantity=1,
+            unit_price_aed=Decimal('500.00'),
+            price_aed=Decimal('500.00'),
+            addons_aed=Decimal('0'),
+            deposit_aed=Decimal('0'),
+            total_aed=Decimal('500.00'),
+            payment_method=Booking.PaymentMethod.CASH,
+            manager_notes='x' * 20000,
+            created_by_manager=self.manager,
+        )
+        booking.activate_externally_paid(Decimal('500.00'))
+        return booking
+
+    def _query_count(self, client, url):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        with CaptureQueriesContext(connection) as ctx:
+            resp = client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_booking_and_payment_lists_defer_wide_columns(self):
+        self._paid_booking()
+        for url_name, key in (
+            ('backoffice:booking_list', 'bookings'),
+            ('backoffice:payment_list', 'payments'),
+        ):
+            resp = self.client.get(reverse(url_name))
+            booking = list(resp.context[key])[0]
+            deferred = booking.get_deferred_fields()
+            self.assertIn('manager_notes', deferred)
+            self.assertIn('stripe_session_id', deferred)
+            self.assertIn('password', booking.user.get_deferred_fields())
+
+    def test_lists_render_without_per_row_queries(self):
+        from dashboard.services import bump_cabinet_version
+
+        customer_client = Client()
+        customer_client.force_login(self.customer)
+        urls = [
+            (self.client, reverse('backoffice:booking_list')),
+            (self.client, reverse('backoffice:payment_list')),
+            (customer_client, reverse('cabinet-dashboard')),
+            (customer_client, reverse('cabinet-billing')),
+        ]
+
+        self._paid_booking()
+        for client, url in urls:
+            client.get(url)  # прогрев сессии/кэшей
+
+        def counts():
+            # Кабинет каждый раз собирает снепшот заново — сравниваем холодные сборки
+            result = []
+            for client, url in urls:
+                bump_cabinet_version(self.customer.pk)
+                result.append(self._query_count(client, url))
+            return result
+
+        baseline = counts()
+        self._paid_booking()
+        self._paid_booking()
+        self.assertEqual(counts(), baseline)
+
+    def test_unit_pages_prefetch_current_booking(self):
+        """Жилец юнита подгружается одним запросом на страницу, а не на строку."""
+        self._paid_booking()
+        url = reverse('backoffice:unit_list')
+        self.client.get(url)
+        baseline = self._query_count(self.client, url)
+
+        extra = StorageUnit.objects.bulk_create([
+            StorageUnit(section=self.section, unit_number=f'P{i:02d}') for i in range(5)
+        ])
+        StorageUnit.refresh_codes()
+        for _i in extra:
+            self._paid_booking()
+        self.assertEqual(self._query_count(self.client, url), baseline)
+
+        resp = self.client.get(url)
+        occupied = [u for u in resp.context['units'] if u.current_booking]
+        self.assertEqual(len(occupied), 6)
+        with self.assertNumQueries(0):
+            for unit in occupied:
+                self.assertEqual(unit.current_booking.user.email, 'wide@example.com')
+                self.assertFalse(unit.current_booking.is_overdue)
+
+        resp = self.client.get(reverse('backoffice:unit_detail', args=[occupied[0].pk]))
+        self.assertEqual(resp.context['current_booking'], occupied[0].current_booking)
+
+    def test_unit_list_reads_denormalized_code(self):
+        resp = self.client.get(reverse('backoffice:unit_list'))
+        unit = list(resp.context['units'])[0]
+        # Код и имя локации — колонки юнита, локация не подгружается
+        with self.assertNumQueries(0):
+            self.assertEqual(unit.full_code, 'DUB-A-01')
+            self.assertEqual(unit.location_name, 'Dubai')
+            self.assertEqual(unit.section.name, 'A')
+        self.assertFalse(unit.section._state.fields_cache.get('location'))
+
+    def test_page_memory_footprint_shrinks(self):
+        """Бенчмарк: страница из 20 броней в проекции занимает меньше памяти."""
+        import tracemalloc
+
+        StorageUnit.objects.bulk_create([
+            StorageUnit(section=self.section, unit_number=f'B{i:02d}') for i in range(15)
+        ])
+        for _ in range(20):
+            self._paid_booking()
+
+        def peak(qs):
+            tracemalloc.start()
+            rows = list(qs[:20])
+            _, peak_bytes = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            self.assertEqual(len(rows), 20)
+            return peak_bytes
+
+        full = peak(Booking.objects.select_related(
+            'user', 'tariff', 'tariff__location', 'period', 'storage_unit',
+        ).order_by('-created_at'))
+        narrow = peak(Booking.objects.for_payment_list().order_by('-created_at'))
+        self.assertLess(narrow, full / 2)
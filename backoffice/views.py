@@ -2,17 +2,16 @@ from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.admin.views.decorators import staff_member_required
 from django.utils.decorators import method_decorator
 from django.views.generic import TemplateView, ListView, DetailView
-from django.db.models import Count, Q, Case, When, Value, IntegerField, Subquery, OuterRef, CharField, Min, Sum
-from django.db.models.functions import TruncDate
+from django.db.models import F, Q, Case, When, Value, IntegerField, Subquery, OuterRef, Min, Sum
 import json
 from django.utils import timezone
 from django.http import JsonResponse
 from django.contrib import messages
 from datetime import timedelta
 
-from bookings.models import Booking
+from bookings.models import Booking, expiry_priority
 from accounts.models import User
-from visits.models import Visit
+from visits.models import Visit, VisitDailyStat
 from feedback.models import FeedbackRequest
 from services.models import StorageUnit, Section
 from locations.models import Location
@@ -36,27 +35,17 @@ class DashboardView(TemplateView):
 
         # Статистика бронирований
         context['stats'] = {
-            'active_bookings': Booking.objects.filter(
-                status=Booking.Status.PAID,
-                parent_booking__isnull=True,
-            ).count(),
+            'active_bookings': Booking.objects.occupying().count(),
             'pending_bookings': Booking.objects.filter(
                 status=Booking.Status.PENDING,
                 expires_at__gt=timezone.now(),
             ).count(),
-            'today_visits': Visit.objects.filter(
-                visited_at__date=today
-            ).count(),
+            'today_visits': VisitDailyStat.totals(today, today)['total'],
             'new_feedback': FeedbackRequest.objects.filter(
                 status=FeedbackRequest.Status.NEW
             ).count(),
-            'expired_unreleased': Booking.overdue_qs(today).count(),
-            'expiring_soon': Booking.objects.filter(
-                status=Booking.Status.PAID,
-                parent_booking__isnull=True,
-                end_date__lte=today + timedelta(days=7),
-                end_date__gte=today
-            ).count(),
+            'expired_unreleased': Booking.objects.overdue(today).count(),
+            'expiring_soon': Booking.objects.expiring(today, days=7).count(),
         }
 
         # Статистика юнитов для donut chart
@@ -95,17 +84,7 @@ class DashboardView(TemplateView):
 
         # Визиты за 7 дней (для bar chart)
         week_ago = today - timedelta(days=6)
-        visits_by_day = dict(
-            Visit.objects.filter(
-                visited_at__date__gte=week_ago,
-            ).annotate(
-                day=TruncDate('visited_at')
-            ).values('day').annotate(
-                total=Count('id'),
-                owners=Count('id', filter=Q(visitor_type=Visit.VisitorType.OWNER)),
-                guests=Count('id', filter=Q(visitor_type=Visit.VisitorType.GUEST)),
-            ).values_list('day', 'total')
-        )
+        visits_by_day = VisitDailyStat.counts_by_day(week_ago, today)
         # Build 7-day array with all days filled
         visit_chart = []
         for i in range(7):
@@ -126,26 +105,23 @@ class DashboardView(TemplateView):
         ).select_related('user').order_by('-created_at')[:5]
 
         # Expired (unreleased) — требуют внимания менеджера
-        context['expired_bookings'] = Booking.overdue_qs(today).select_related(
-            'user'
-        ).order_by('end_date')
+        context['expired_bookings'] = Booking.objects.overdue(today).with_display_status(
+            today
+        ).select_related('user').order_by('end_date')
 
         # Expiring soon (14 дней)
-        context['expiring_bookings'] = Booking.objects.filter(
-            status=Booking.Status.PAID,
-            parent_booking__isnull=True,
-            end_date__gte=today,
-            end_date__lte=today + timedelta(days=14),
+        context['expiring_bookings'] = Booking.objects.expiring(today).with_display_status(
+            today
         ).select_related('user').order_by('end_date')
 
         # Последние бронирования
-        context['recent_bookings'] = Booking.objects.select_related(
-            'user'
-        ).order_by('-created_at')[:5]
+        context['recent_bookings'] = Booking.objects.with_display_status(
+            today
+        ).select_related('user').order_by('-created_at')[:5]
 
         # Сегодняшние посещения
-        context['today_visits_list'] = Visit.objects.filter(
-            visited_at__date=today
+        context['today_visits_list'] = Visit.objects.between(
+            today, today
         ).order_by('-visited_at')[:10]
 
         return context
@@ -164,36 +140,23 @@ class BookingListView(ListView):
 
         status = self.request.GET.get('status')
 
+        # derived_status / days_* / expiry_priority считаются в SQL на одну дату
+        qs = Booking.objects.with_display_status(today)
+
         if status == 'expired':
             # Просрочено — PAID + end_date в прошлом
-            qs = Booking.overdue_qs(today).order_by('end_date')
+            qs = qs.overdue(today).order_by('end_date')
         elif status == 'expiring_soon':
-            qs = Booking.objects.filter(
-                status=Booking.Status.PAID,
-                parent_booking__isnull=True,
-                end_date__gte=today,
-                end_date__lte=today + timedelta(days=14),
-            ).order_by('end_date')
+            qs = qs.expiring(today).order_by('end_date')
         elif status == 'active':
             # В работе сейчас — PAID + start_date наступил + end_date ещё не прошёл
-            qs = Booking.active_qs(today).order_by('end_date')
+            qs = qs.active(today).order_by('end_date')
         else:
             # По умолчанию: всё PAID + parent_booking__isnull, с приоритетной
             # сортировкой (overdue → expiring_soon → expiring_2w → rest)
-            qs = Booking.objects.filter(
-                status=Booking.Status.PAID,
-                parent_booking__isnull=True,
-            ).annotate(
-                sort_priority=Case(
-                    When(end_date__lt=today, then=Value(0)),  # overdue
-                    When(end_date__lte=today + timedelta(days=7), then=Value(1)),
-                    When(end_date__lte=today + timedelta(days=14), then=Value(2)),
-                    default=Value(3),
-                    output_field=IntegerField(),
-                ),
-            ).order_by('sort_priority', 'end_date')
-
-        qs = qs.select_related('user', 'tariff', 'tariff__location', 'period', 'storage_unit')
+            qs = qs.occupying().order_by('expiry_priority', 'end_date')
+
+        qs = qs.for_booking_list()
 
         search = self.request.GET.get('search')
         if search:
@@ -216,18 +179,10 @@ class BookingListView(ListView):
         context['search'] = self.request.GET.get('search', '')
 
         # Счётчики для фильтров (всё считается из PAID-брони, разница в датах)
-        base = Booking.objects.filter(
-            status=Booking.Status.PAID, parent_booking__isnull=True,
-        )
         context['stats'] = {
-            'active': base.filter(
-                start_date__lte=today, end_date__gte=today,
-            ).count(),
-            'expired': base.filter(end_date__lt=today).count(),
-            'expiring_soon': base.filter(
-                end_date__gte=today,
-                end_date__lte=today + timedelta(days=14),
-            ).count(),
+            'active': Booking.objects.active(today).count(),
+            'expired': Booking.objects.overdue(today).count(),
+            'expiring_soon': Booking.objects.expiring(today).count(),
         }
 
         return context
@@ -255,9 +210,7 @@ class PaymentListView(ListView):
     paginate_by = 20
 
     def get_queryset(self):
-        qs = Booking.objects.select_related(
-            'user', 'tariff', 'tariff__location', 'period', 'storage_unit'
-        ).order_by('-created_at')
+        qs = Booking.objects.with_display_status().for_payment_list().order_by('-created_at')
 
         # Фильтр по статусу оплаты
         payment_status = self.request.GET.get('status')
@@ -338,10 +291,26 @@ class UserListView(ListView):
     context_object_name = 'users'
     paginate_by = 20
 
+    # Сортировки по денормализованным счётчикам User — без join на bookings
+    SORT_OPTIONS = {
+        'joined': [F('date_joined').desc()],
+        'bookings': [F('bookings_count').desc(), F('date_joined').desc()],
+        'active': [F('active_bookings_count').desc(), F('date_joined').desc()],
+        'paid': [F('lifetime_paid_aed').desc(), F('date_joined').desc()],
+        'last_visit': [F('last_visit_at').desc(nulls_last=True), F('date_joined').desc()],
+    }
+
     def get_queryset(self):
-        qs = User.objects.annotate(
-            bookings_count=Count('bookings')
-        ).order_by('-date_joined')
+        sort = self.request.GET.get('sort')
+        qs = User.objects.order_by(*self.SORT_OPTIONS.get(sort, self.SORT_OPTIONS['joined']))
+
+        segment = self.request.GET.get('segment')
+        if segment == 'active':
+            qs = qs.filter(active_bookings_count__gt=0)
+        elif segment == 'paying':
+            qs = qs.filter(lifetime_paid_aed__gt=0)
+        elif segment == 'no_bookings':
+            qs = qs.filter(bookings_count=0)
 
         search = self.request.GET.get('search')
         if search:
@@ -357,6 +326,8 @@ class UserListView(ListView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['search'] = self.request.GET.get('search', '')
+        context['current_sort'] = self.request.GET.get('sort', '')
+        context['current_segment'] = self.request.GET.get('segment', '')
         return context
 
 
@@ -369,7 +340,7 @@ class UserDetailView(DetailView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['bookings'] = self.object.bookings.select_related(
+        context['bookings'] = self.object.bookings.with_display_status().select_related(
             'tariff', 'tariff__location', 'period', 'storage_unit'
         ).order_by('-created_at')[:10]
         return context
@@ -475,14 +446,11 @@ class VisitListView(ListView):
 
     def get_queryset(self):
         qs = Visit.objects.select_related(
-            'booking__user', 'booking__storage_unit__section__location'
+            'booking__user', 'booking__storage_unit'
         ).order_by('-visited_at')
 
         date_from, date_to = self._get_date_range()
-        if date_from:
-            qs = qs.filter(visited_at__date__gte=date_from)
-        if date_to:
-            qs = qs.filter(visited_at__date__lte=date_to)
+        qs = qs.between(date_from, date_to)
 
         search = self.request.GET.get('search')
         if search:
@@ -510,29 +478,20 @@ class VisitListView(ListView):
         context['date_to'] = date_to.isoformat() if date_to else ''
 
         # Stats/chart always use a concrete range
+        # (читаем из дневных счётчиков VisitDailyStat, а не из сырых Visit)
         chart_from, chart_to = self._get_chart_range()
-        period_qs = Visit.objects.filter(
-            visited_at__date__gte=chart_from,
-            visited_at__date__lte=chart_to,
-        )
+        totals = VisitDailyStat.totals(chart_from, chart_to)
         total_days = max((chart_to - chart_from).days + 1, 1)
-        total_visits = period_qs.count()
         context['visit_stats'] = {
-            'total': total_visits,
-            'avg_per_day': round(total_visits / total_days, 1),
-            'owners': period_qs.filter(visitor_type=Visit.VisitorType.OWNER).count(),
-            'guests': period_qs.filter(visitor_type=Visit.VisitorType.GUEST).count(),
+            'total': totals['total'],
+            'avg_per_day': round(totals['total'] / total_days, 1),
+            'owners': totals['owners'],
+            'guests': totals['guests'],
             'days': total_days,
         }
 
         # Daily chart data
-        visits_by_day = dict(
-            period_qs.annotate(
-                day=TruncDate('visited_at')
-            ).values('day').annotate(
-                count=Count('id')
-            ).values_list('day', 'count')
-        )
+        visits_by_day = VisitDailyStat.counts_by_day(chart_from, chart_to)
         today = timezone.now().date()
         chart_data = []
         for i in range(total_days):
@@ -655,32 +614,15 @@ class UnitListView(ListView):
 
         qs = StorageUnit.objects.filter(
             section__location__location_type__in=self.STORAGE_LOCATION_TYPES,
-        ).select_related(
-            'section', 'section__location', 'section__service'
-        ).annotate(
+        ).select_related('section').only(
+            'unit_number', 'is_available', 'is_active', 'full_code', 'location_name',
+            'section', 'section__name',
+        ).with_current_booking(today).annotate(
             booking_end_date=Subquery(current_booking_end),
+            # Та же шкала срочности, что и у списка бронирований; свободные юниты — в конец
             sort_priority=Case(
-                # Overdue — end_date в прошлом → самый высокий приоритет
-                When(
-                    is_available=False,
-                    booking_end_date__lt=today,
-                    then=Value(0),
-                ),
-                # Expiring <= 7 days
-                When(
-                    is_available=False,
-                    booking_end_date__gte=today,
-                    booking_end_date__lte=today + timedelta(days=7),
-                    then=Value(1),
-                ),
-                # Expiring 8-14 days
-                When(
-                    is_available=False,
-                    booking_end_date__gt=today + timedelta(days=7),
-                    booking_end_date__lte=today + timedelta(days=14),
-                    then=Value(2),
-                ),
-                default=Value(9),
+                When(is_available=True, then=Value(9)),
+                default=expiry_priority(today, field='booking_end_date', default=9),
                 output_field=IntegerField(),
             ),
         ).order_by('sort_priority', 'booking_end_date', 'section__location', 'section__sort_order', 'unit_number')
@@ -701,23 +643,19 @@ class UnitListView(ListView):
         elif status == 'expiring_soon':
             qs = qs.filter(
                 is_available=False,
-                bookings__status=Booking.Status.PAID,
-                bookings__parent_booking__isnull=True,
-                bookings__end_date__gte=today,
-                bookings__end_date__lte=today + timedelta(days=14),
-            ).distinct()
+                pk__in=Booking.objects.expiring(today).values('storage_unit'),
+            )
         elif status == 'expired':
             qs = qs.filter(
                 is_available=False,
-                bookings__status=Booking.Status.PAID,
-                bookings__parent_booking__isnull=True,
-                bookings__end_date__lt=today,
-            ).distinct()
+                pk__in=Booking.objects.overdue(today).values('storage_unit'),
+            )
 
         # Поиск
         search = self.request.GET.get('search')
         if search:
-            qs = qs.filter(unit_number__icontains=search)
+            # full_code покрывает и номер, и секцию, и локацию
+            qs = qs.filter(full_code__icontains=search)
 
         return qs
 
@@ -742,17 +680,12 @@ class UnitListView(ListView):
             'occupied': storage_units.filter(is_active=True, is_available=False).count(),
             'expiring_soon': storage_units.filter(
                 is_available=False,
-                bookings__status=Booking.Status.PAID,
-                bookings__parent_booking__isnull=True,
-                bookings__end_date__gte=today,
-                bookings__end_date__lte=today + timedelta(days=14),
-            ).distinct().count(),
+                pk__in=Booking.objects.expiring(today).values('storage_unit'),
+            ).count(),
             'expired': storage_units.filter(
                 is_available=False,
-                bookings__status=Booking.Status.PAID,
-                bookings__parent_booking__isnull=True,
-                bookings__end_date__lt=today,
-            ).distinct().count(),
+                pk__in=Booking.objects.overdue(today).values('storage_unit'),
+            ).count(),
         }
 
         return context
@@ -768,26 +701,24 @@ class UnitDetailView(DetailView):
     def get_queryset(self):
         return StorageUnit.objects.select_related(
             'section', 'section__location', 'section__service'
-        )
+        ).with_current_booking(related=('tariff', 'tariff__location', 'period'))
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
 
         # Текущее активное бронирование
-        context['current_booking'] = Booking.objects.filter(
-            storage_unit=self.object,
-            status=Booking.Status.PAID,
-        ).select_related('user', 'tariff', 'tariff__location', 'period').first()
+        today = timezone.now().date()
+        context['current_booking'] = self.object.current_booking
 
         # История бронирований
-        context['booking_history'] = Booking.objects.filter(
+        context['booking_history'] = Booking.objects.with_display_status(today).filter(
             storage_unit=self.object
         ).select_related('user', 'tariff', 'tariff__location', 'period').order_by('-created_at')[:10]
 
         # История посещений
         context['recent_visits'] = Visit.objects.filter(
             booking__storage_unit=self.object
-        ).select_related('booking__user', 'booking__storage_unit__section__location').order_by('-visited_at')[:10]
+        ).select_related('booking__user', 'booking__storage_unit').order_by('-visited_at')[:10]
 
         return context
 
@@ -901,7 +832,7 @@ def booking_reassign_unit(request, pk):
     # GET — показать форму
     current_units = [
         bu.storage_unit for bu in
-        booking.booking_units.select_related('storage_unit__section__location').all()
+        booking.booking_units.select_related('storage_unit__section').all()
     ]
 
     return render(request, 'backoffice/bookings/reassign.html', {
@@ -945,17 +876,12 @@ def payment_fetch_receipt(request, pk):
         return JsonResponse({'success': True, 'receipt_url': booking.stripe_receipt_url})
 
     import stripe
-    from django.conf import settings
-
-    stripe.api_key = settings.STRIPE_SECRET_KEY
+    from bookings import payments
 
     try:
-        pi = stripe.PaymentIntent.retrieve(booking.stripe_payment_id)
-        if pi.latest_charge:
-            charge = stripe.Charge.retrieve(pi.latest_charge)
-            receipt_url = charge.receipt_url or ''
-        else:
-            receipt_url = ''
+        _, receipt_url = payments.payment_details(
+            payments.retrieve_payment_intent(booking.stripe_payment_id)
+        )
 
         if receipt_url:
             booking.stripe_receipt_url = receipt_url
@@ -1129,7 +1055,7 @@ def api_user_active_booking(request, pk):
             parent_booking__isnull=True,
             storage_unit__isnull=False,
         )
-        .select_related('storage_unit__section__location', 'tariff', 'period')
+        .select_related('storage_unit', 'tariff', 'period')
         .order_by('-end_date')
         .first()
     )
@@ -2,7 +2,7 @@ from django.contrib import admin
 from django.utils.html import format_html
 from django.utils.translation import gettext_lazy as _
 
-from .models import Booking, BookingAddon, BookingUnit
+from .models import Booking, BookingAddon, BookingUnit, StripeEvent
 
 
 class BookingAddonInline(admin.TabularInline):
@@ -118,3 +118,23 @@ class BookingAddonAdmin(admin.ModelAdmin):
     search_fields = ('booking__user__email', 'addon__name')
     ordering = ('-booking__created_at',)
     autocomplete_fields = ('booking', 'addon')
+
+
+@admin.register(StripeEvent)
+class StripeEventAdmin(admin.ModelAdmin):
+    list_display = ('event_id', 'event_type', 'booking_ref', 'status', 'attempts', 'duration_ms', 'received_at')
+    list_filter = ('status', 'event_type')
+    search_fields = ('event_id', 'booking_ref')
+    readonly_fields = (
+        'event_id', 'event_type', 'booking_ref', 'payload', 'status', 'attempts',
+        'next_attempt_at', 'error', 'received_at', 'started_at', 'processed_at', 'duration_ms',
+    )
+    actions = ['requeue']
+
+    @admin.action(description=_('Requeue selected events'))
+    def requeue(self, request, queryset):
+        from django.utils import timezone
+        queryset.exclude(status=StripeEvent.Status.IGNORED).update(
+            status=StripeEvent.Status.PENDING, attempts=0, next_attempt_at=timezone.now(),
+        )
+        self.message_user(request, _('Selected events have been requeued.'))
@@ -1,5 +1,7 @@
+import time
+
 from django.core.management.base import BaseCommand
-from django.db import transaction
+from django.db import close_old_connections
 from django.utils import timezone
 
 from bookings.models import Booking
@@ -14,35 +16,75 @@ class Command(BaseCommand):
             action='store_true',
             help='Preview which bookings would be cancelled without making changes.',
         )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Bookings claimed per transaction (default: 500).',
+        )
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Keep running: drain the backlog, sleep --interval seconds, repeat.',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=60.0,
+            help='Seconds between passes in --loop mode (default: 60).',
+        )
 
     def handle(self, *args, **options):
-        now = timezone.now()
-        dry_run = options['dry_run']
+        if options['dry_run']:
+            self.preview()
+            return
+
+        if not options['loop']:
+            self.drain(options['batch_size'])
+            return
 
+        try:
+            while True:
+                # БД могла перезапуститься или закрыть простаивающее соединение
+                close_old_connections()
+                self.drain(options['batch_size'], quiet=True)
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            self.stdout.write('Stopped.')
+
+    def preview(self):
         expired_pending = Booking.objects.filter(
             status=Booking.Status.PENDING,
-            expires_at__lt=now,
+            expires_at__lt=timezone.now(),
         )
-
         count = expired_pending.count()
-
         if count == 0:
             self.stdout.write('No expired pending bookings found.')
             return
 
-        if dry_run:
-            self.stdout.write(f'[DRY RUN] Would cancel {count} expired pending booking(s):')
-            for b in expired_pending.select_related('user', 'tariff'):
-                self.stdout.write(f'  #{b.number} — {b.user.email} — {b.tariff_name or b.tariff.name} (expired {b.expires_at})')
-            return
+        self.stdout.write(f'[DRY RUN] Would cancel {count} expired pending booking(s):')
+        for b in expired_pending.select_related('user', 'tariff'):
+            self.stdout.write(f'  #{b.number} — {b.user.email} — {b.tariff_name or b.tariff.name} (expired {b.expires_at})')
 
-        cancelled = 0
-        for booking in expired_pending:
-            try:
-                with transaction.atomic():
-                    booking.cancel()
-                cancelled += 1
-            except Exception as e:
-                self.stdout.write(self.style.ERROR(f'Error cancelling #{booking.number}: {e}'))
+    def drain(self, batch_size, quiet=False):
+        """Отменять пачками, пока просроченные не кончатся. Возвращает их число."""
+        started = time.perf_counter()
+        now = timezone.now()
+        total = 0
+        batches = 0
+        while True:
+            cancelled = Booking.cancel_expired(now=now, batch_size=batch_size)
+            if not cancelled:
+                break
+            total += cancelled
+            batches += 1
 
-        self.stdout.write(self.style.SUCCESS(f'Cancelled {cancelled} expired pending booking(s).'))
+        elapsed = time.perf_counter() - started
+        if total:
+            self.stdout.write(self.style.SUCCESS(
+                f'Cancelled {total} expired pending booking(s) in {batches} batch(es), '
+                f'{elapsed:.2f}s ({total / elapsed if elapsed else total:.0f}/s).'
+            ))
+        elif not quiet:
+            self.stdout.write('No expired pending bookings found.')
+        return total
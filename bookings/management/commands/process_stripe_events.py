@@ -0,0 +1,53 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from bookings.models import StripeEvent
+from bookings.services import process_pending_events
+
+
+class Command(BaseCommand):
+    help = 'Process queued Stripe webhook events (retries and events missed by the webhook pool).'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=20,
+            help='Events claimed per transaction (default: 20).',
+        )
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Keep polling the queue every --interval seconds.',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=5.0,
+            help='Seconds between polls in --loop mode (default: 5).',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                processed = process_pending_events(options['batch_size'])
+                if processed or not options['loop']:
+                    self.report(processed)
+                if not options['loop']:
+                    return
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            self.stdout.write('Stopped.')
+
+    def report(self, processed):
+        counts = dict(
+            StripeEvent.objects.filter(
+                status__in=[StripeEvent.Status.PENDING, StripeEvent.Status.FAILED],
+            ).values('status').annotate(total=Count('id')).values_list('status', 'total')
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Processed {processed} Stripe event(s); '
+            f"{counts.get('pending', 0)} pending, {counts.get('failed', 0)} failed."
+        ))
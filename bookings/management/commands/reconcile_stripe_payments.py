@@ -0,0 +1,65 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from bookings.services import reconcile_stripe_payments
+from bookings.views import is_stripe_configured
+
+
+class Command(BaseCommand):
+    help = 'Match Stripe Checkout Sessions and PaymentIntents to bookings: mark missed payments, backfill receipts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--since',
+            type=date.fromisoformat,
+            help='First day to reconcile, YYYY-MM-DD (default: --days ago).',
+        )
+        parser.add_argument(
+            '--until',
+            type=date.fromisoformat,
+            help='Last day to reconcile, YYYY-MM-DD (default: today).',
+        )
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=3,
+            help='Look-back window when --since is omitted (default: 3, as long as Stripe retries webhooks).',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='Days fetched from Stripe in parallel (default: 4).',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report what would change without writing.',
+        )
+
+    def handle(self, *args, **options):
+        if not is_stripe_configured():
+            self.stdout.write('Stripe is not configured, nothing to reconcile.')
+            return
+
+        until = options['until'] or timezone.localdate()
+        since = options['since'] or until - timedelta(days=options['days'])
+        if since > until:
+            raise CommandError('--since must not be after --until.')
+
+        stats = reconcile_stripe_payments(
+            since, until, workers=max(1, options['workers']), dry_run=options['dry_run'],
+        )
+
+        prefix = '[DRY RUN] ' if options['dry_run'] else ''
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix}{since}..{until}: {stats['sessions']} session(s), {stats['payment_intents']} payment intent(s); "
+            f"marked paid {stats['marked_paid']}, receipts backfilled {stats['receipts']}, "
+            f"unmatched {stats['unmatched']}."
+        ))
+        if stats['paid_but_cancelled']:
+            self.stdout.write(self.style.WARNING(
+                f"{stats['paid_but_cancelled']} paid session(s) belong to cancelled bookings — check refunds."
+            ))
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:37
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0013_remove_active_expired_status'),
+        ('services', '0013_populate_storageunit_full_code'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['status', 'expires_at'], name='idx_booking_status_expires'),
+        ),
+    ]
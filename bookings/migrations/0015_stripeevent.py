@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:45
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0014_booking_status_expires_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StripeEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_id', models.CharField(max_length=255, unique=True, verbose_name='Event ID')),
+                ('event_type', models.CharField(max_length=100, verbose_name='Event type')),
+                ('booking_ref', models.BigIntegerField(blank=True, null=True, verbose_name='Booking ID')),
+                ('payload', models.JSONField(verbose_name='Payload')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('done', 'Done'), ('failed', 'Failed'), ('ignored', 'Ignored')], default='pending', max_length=20, verbose_name='Status')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='Attempts')),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Next attempt at')),
+                ('error', models.TextField(blank=True, verbose_name='Last error')),
+                ('received_at', models.DateTimeField(auto_now_add=True, verbose_name='Received at')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='Started at')),
+                ('processed_at', models.DateTimeField(blank=True, null=True, verbose_name='Processed at')),
+                ('duration_ms', models.PositiveIntegerField(blank=True, null=True, verbose_name='Duration (ms)')),
+            ],
+            options={
+                'verbose_name': 'Stripe event',
+                'verbose_name_plural': 'Stripe events',
+                'ordering': ['-received_at'],
+                'indexes': [models.Index(fields=['status', 'next_attempt_at'], name='idx_stripe_event_queue'), models.Index(fields=['booking_ref', 'received_at'], name='idx_stripe_event_booking')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0016_booking_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='booking',
+            name='last_payment_check_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
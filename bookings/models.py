@@ -1,8 +1,161 @@
 from django.db import models, transaction
+from django.db.models import Case, CharField, F, IntegerField, Q, Value, When
 from django.utils import timezone
-from django.utils.translation import gettext_lazy as _
+from django.utils.translation import get_language, gettext_lazy as _
 from datetime import timedelta
 
+from modeltranslation.utils import build_localized_fieldname, resolution_order
+
+
+class DaysBetween(models.Func):
+    """Целое число дней между двумя датами (lhs - rhs), вычисляется в БД."""
+
+    output_field = IntegerField()
+    arg_joiner = ' - '
+    template = '(%(expressions)s)'  # PostgreSQL: date - date = integer
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return self.as_sql(
+            compiler, connection,
+            template='CAST(julianday(%(expressions)s) AS INTEGER)',
+            arg_joiner=') - julianday(',
+            **extra_context,
+        )
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        return self.as_sql(
+            compiler, connection,
+            function='DATEDIFF', template='%(function)s(%(expressions)s)', arg_joiner=', ',
+            **extra_context,
+        )
+
+
+def expiry_priority(today, field='end_date', default=3):
+    """Case для сортировки по срочности: 0 — просрочено, 1 — ≤7 дней, 2 — ≤14 дней."""
+    return Case(
+        When(**{f'{field}__lt': today}, then=Value(0)),
+        When(**{f'{field}__lte': today + timedelta(days=7)}, then=Value(1)),
+        When(**{f'{field}__lte': today + timedelta(days=14)}, then=Value(2)),
+        default=Value(default),
+        output_field=IntegerField(),
+    )
+
+
+def localized_columns(path, *fields):
+    """Пути для only(): переводимые поля связанной модели только на текущем
+    языке и его fallback-языках.
+
+    Дескриптор modeltranslation читает name_<lang>, а не name, — если такой
+    колонки нет в only(), каждая строка догружает её отдельным запросом.
+    """
+    langs = resolution_order(get_language() or 'en')
+    return [
+        f'{path}__{build_localized_fieldname(field, lang)}'
+        for field in fields for lang in langs
+    ]
+
+
+USER_LIST_COLUMNS = ('email', 'first_name', 'last_name')
+
+
+class BookingQuerySet(models.QuerySet):
+    """Производные статусы брони (active/overdue/…) как фильтры и аннотации в SQL."""
+
+    # Колонки, которые рендерят списки. manager_notes, Stripe session id,
+    # service_name и прочее широкое остаётся в БД.
+    LIST_COLUMNS = (
+        'number', 'status', 'start_date', 'end_date', 'parent_booking',
+        'tariff', 'tariff_name', 'location_name', 'period_label', 'unit_codes',
+    )
+    PAYMENT_COLUMNS = LIST_COLUMNS + (
+        'created_at', 'expires_at', 'paid_at', 'total_aed', 'deposit_aed',
+        'payment_method', 'payment_amount_collected',
+        'stripe_payment_id', 'stripe_receipt_url',
+    )
+
+    def occupying(self):
+        """PAID-брони, которые сейчас держат за собой юнит (без extensions)."""
+        return self.filter(status=Booking.Status.PAID, parent_booking__isnull=True)
+
+    def active(self, today=None):
+        """PAID + start_date наступил + end_date ещё не прошёл."""
+        today = today or timezone.now().date()
+        return self.occupying().filter(start_date__lte=today, end_date__gte=today)
+
+    def overdue(self, today=None):
+        """PAID + end_date в прошлом — юнит держится, нужна реакция менеджера."""
+        today = today or timezone.now().date()
+        return self.occupying().filter(end_date__lt=today)
+
+    def expiring(self, today=None, days=14):
+        """PAID, end_date в ближайшие `days` дней (включая сегодня)."""
+        today = today or timezone.now().date()
+        return self.occupying().filter(
+            end_date__gte=today, end_date__lte=today + timedelta(days=days),
+        )
+
+    def with_display_status(self, today=None):
+        """Аннотировать derived_status, derived_days_remaining, derived_days_overdue
+        и expiry_priority — то же, что properties display_status / days_remaining /
+        days_overdue, но посчитанное в БД на одну дату `today`.
+
+        Properties модели читают аннотации, если они есть, поэтому списки
+        могут и фильтровать/сортировать по ним, и рендерить без timezone.now()
+        на каждую строку.
+        """
+        today = today or timezone.now().date()
+        days_left = DaysBetween(F('end_date'), Value(today, output_field=models.DateField()))
+        return self.annotate(
+            derived_status=Case(
+                When(~Q(status=Booking.Status.PAID), then=F('status')),
+                When(end_date__lt=today, then=Value('overdue')),
+                When(start_date__gt=today, then=Value('paid')),
+                default=Value('active'),
+                output_field=CharField(),
+            ),
+            derived_days_remaining=Case(
+                When(end_date__gte=today, then=days_left),
+                default=Value(0),
+                output_field=IntegerField(),
+            ),
+            derived_days_overdue=Case(
+                When(end_date__lt=today, then=-days_left),
+                default=Value(0),
+                output_field=IntegerField(),
+            ),
+            expiry_priority=expiry_priority(today),
+        )
+
+    def for_booking_list(self):
+        """Проекция для списка бронирований в бэкофисе: снепшоты + имя клиента."""
+        return self.select_related('user').only(
+            *self.LIST_COLUMNS,
+            'user', *(f'user__{f}' for f in USER_LIST_COLUMNS),
+        )
+
+    def for_payment_list(self):
+        """Проекция для списка платежей: финансовые поля без manager_notes."""
+        return self.select_related('user', 'created_by_manager').only(
+            *self.PAYMENT_COLUMNS,
+            'user', *(f'user__{f}' for f in USER_LIST_COLUMNS),
+            'created_by_manager', *(f'created_by_manager__{f}' for f in USER_LIST_COLUMNS),
+        )
+
+    def for_cabinet(self):
+        """Проекция для страниц кабинета: тариф/локация/юнит на текущем языке."""
+        return self.select_related(
+            'tariff', 'tariff__location', 'tariff__service', 'period',
+            'storage_unit',
+        ).only(
+            'status', 'start_date', 'end_date', 'parent_booking',
+            'created_at', 'expires_at', 'paid_at', 'total_aed',
+            'tariff', *localized_columns('tariff', 'name'),
+            'tariff__location', *localized_columns('tariff__location', 'name', 'street', 'building'),
+            'tariff__service', 'tariff__service__service_type',
+            'period', *localized_columns('period', 'name'),
+            'storage_unit', 'storage_unit__full_code',
+        )
+
 
 class Booking(models.Model):
     """Бронирование"""
@@ -171,6 +324,15 @@ class Booking(models.Model):
         verbose_name=_('Stripe receipt URL')
     )
 
+    # Токен формы бронирования: повторная отправка той же формы (двойной клик,
+    # ретрай браузера) не создаёт вторую бронь. Уникален в паре с user.
+    idempotency_key = models.CharField(
+        max_length=64,
+        blank=True,
+        editable=False,
+        verbose_name=_('Idempotency key')
+    )
+
     # Manager notes
     manager_notes = models.TextField(
         blank=True,
@@ -216,6 +378,9 @@ class Booking(models.Model):
         blank=True,
         verbose_name=_('Paid at')
     )
+    # Последняя запасная сверка с Stripe (check_payment_once) — общий для
+    # всех процессов ограничитель частоты.
+    last_payment_check_at = models.DateTimeField(null=True, blank=True, editable=False)
 
     class Meta:
         ordering = ['-created_at']
@@ -230,7 +395,60 @@ class Booking(models.Model):
                 fields=['status', 'parent_booking'],
                 name='idx_booking_status_parent',
             ),
+            models.Index(
+                fields=['status', 'expires_at'],
+                name='idx_booking_status_expires',
+            ),
         ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'idempotency_key'],
+                condition=~Q(idempotency_key=''),
+                name='uniq_booking_idempotency_key',
+            ),
+        ]
+
+    objects = BookingQuerySet.as_manager()
+
+    # Поля, от которых зависят денормализованные счётчики User (refresh_stats)
+    STATS_FIELDS = frozenset({'status', 'paid_at', 'payment_amount_collected', 'parent_booking'})
+    _NOT_LOADED = object()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Значения stats-полей при загрузке — save() пересчитывает счётчики, только если они изменились
+        instance._loaded_stats = instance._stats_values()
+        return instance
+
+    def _stats_values(self):
+        return {
+            name: self.__dict__.get(self._meta.get_field(name).attname, self._NOT_LOADED)
+            for name in self.STATS_FIELDS
+        }
+
+    def _stats_changed(self, adding, update_fields):
+        """Изменилось ли что-то, от чего зависят счётчики владельца."""
+        if adding:
+            return True
+        loaded = getattr(self, '_loaded_stats', None)
+        if loaded is None:
+            changed = set(self.STATS_FIELDS)
+        else:
+            changed = {name for name, value in self._stats_values().items() if loaded[name] != value}
+        if update_fields is not None:
+            changed &= set(update_fields)
+        return bool(changed)
+
+    def _remember_saved_stats(self, update_fields):
+        # Частичный save() запоминает только записанные поля — остальные изменения ещё впереди
+        current = self._stats_values()
+        loaded = getattr(self, '_loaded_stats', None)
+        if update_fields is None:
+            self._loaded_stats = current
+        elif loaded is not None:
+            for name in self.STATS_FIELDS.intersection(update_fields):
+                loaded[name] = current[name]
 
     def __str__(self):
         name = self.tariff_name or (self.tariff.name if self.tariff_id else '—')
@@ -247,13 +465,7 @@ class Booking(models.Model):
         PAID + start_date наступил + end_date ещё не прошёл.
         Не включает extensions (они только обновляют end_date родителя).
         """
-        today = today or timezone.now().date()
-        return cls.objects.filter(
-            status=cls.Status.PAID,
-            parent_booking__isnull=True,
-            start_date__lte=today,
-            end_date__gte=today,
-        )
+        return cls.objects.active(today)
 
     @classmethod
     def overdue_qs(cls, today=None):
@@ -262,12 +474,7 @@ class Booking(models.Model):
         PAID + end_date в прошлом. Менеджер должен сделать Force Release
         или продлить (extension).
         """
-        today = today or timezone.now().date()
-        return cls.objects.filter(
-            status=cls.Status.PAID,
-            parent_booking__isnull=True,
-            end_date__lt=today,
-        )
+        return cls.objects.overdue(today)
 
     @classmethod
     def occupies_unit_qs(cls):
@@ -276,29 +483,27 @@ class Booking(models.Model):
         Эквивалент старого `status__in=[PAID, ACTIVE, EXPIRED]` —
         пока booking не COMPLETED/CANCELLED, юнит за ним.
         """
-        return cls.objects.filter(
-            status=cls.Status.PAID,
-            parent_booking__isnull=True,
-        )
+        return cls.objects.occupying()
 
     @property
     def is_active(self):
         """Сейчас в активном использовании."""
-        if self.status != self.Status.PAID:
-            return False
-        today = timezone.now().date()
-        return self.start_date <= today <= self.end_date
+        return self.display_status == 'active'
 
     @property
     def is_overdue(self):
         """PAID, но end_date в прошлом — юнит держится, нужна реакция менеджера."""
-        if self.status != self.Status.PAID:
-            return False
-        return self.end_date < timezone.now().date()
+        return self.display_status == 'overdue'
 
     @property
     def display_status(self):
-        """Производный статус для UI: pending/paid/active/overdue/completed/cancelled."""
+        """Производный статус для UI: pending/paid/active/overdue/completed/cancelled.
+
+        Берёт аннотацию derived_status из with_display_status(), если она есть.
+        """
+        annotated = getattr(self, 'derived_status', None)
+        if annotated is not None:
+            return annotated
         if self.status != self.Status.PAID:
             return self.status
         today = timezone.now().date()
@@ -345,6 +550,8 @@ class Booking(models.Model):
     def save(self, *args, **kwargs):
         from django.db import IntegrityError
 
+        stats_changed = self._stats_changed(self._state.adding, kwargs.get('update_fields'))
+
         # Рассчитать end_date при создании
         if not self.end_date and self.start_date and self.period:
             self.end_date = self.period.calculate_end_date(self.start_date)
@@ -368,13 +575,24 @@ class Booking(models.Model):
                 try:
                     with transaction.atomic():
                         super().save(*args, **kwargs)
-                    return
+                    break
                 except IntegrityError:
                     self.number = ''
-                    if attempt == 4:
+                    # Дубль формы, а не гонка номеров — ретраи не помогут
+                    duplicate = self.idempotency_key and Booking.objects.filter(
+                        user_id=self.user_id, idempotency_key=self.idempotency_key,
+                    ).exists()
+                    if attempt == 4 or duplicate:
                         raise
+        else:
+            super().save(*args, **kwargs)
+
+        if stats_changed:
+            self.user.refresh_stats()
+        self._remember_saved_stats(kwargs.get('update_fields'))
 
-        super().save(*args, **kwargs)
+        from dashboard.services import bump_cabinet_version
+        bump_cabinet_version(self.user_id)
 
     def _fill_snapshots(self):
         """Заполнить снепшот-поля из связанных объектов."""
@@ -392,6 +610,9 @@ class Booking(models.Model):
     @property
     def days_remaining(self):
         """Дней до окончания"""
+        annotated = getattr(self, 'derived_days_remaining', None)
+        if annotated is not None:
+            return annotated
         today = timezone.now().date()
         if self.end_date >= today:
             return (self.end_date - today).days
@@ -400,6 +621,9 @@ class Booking(models.Model):
     @property
     def days_overdue(self):
         """Дней просрочки после end_date"""
+        annotated = getattr(self, 'derived_days_overdue', None)
+        if annotated is not None:
+            return annotated
         today = timezone.now().date()
         if self.end_date < today:
             return (today - self.end_date).days
@@ -459,7 +683,8 @@ class Booking(models.Model):
             return False
 
         if booking.is_expired:
-            booking.cancel()
+            # Сессию только что оплатили — закрывать нечего
+            booking.cancel(expire_session=False)
             return False
 
         booking.paid_at = timezone.now()
@@ -596,18 +821,68 @@ class Booking(models.Model):
         self.status = self.Status.COMPLETED
         self.save(update_fields=['status', 'updated_at'])
 
-    def cancel(self):
+    def cancel(self, expire_session=True):
         """Отменить бронь.
 
         Продление НЕ трогает юниты — они принадлежат родителю.
         Основное бронирование — освобождает юниты.
+        Открытая Checkout Session pending-брони закрывается после коммита.
         """
+        was_pending = self.status == self.Status.PENDING
         if not self.is_extension:
             self._release_units()
 
         self.status = self.Status.CANCELLED
         self.save(update_fields=['status', 'updated_at'])
 
+        if expire_session and was_pending and self.stripe_session_id:
+            from .services import expire_checkout_sessions
+            expire_checkout_sessions([self.stripe_session_id])
+
+    @classmethod
+    def cancel_expired(cls, now=None, batch_size=500):
+        """Отменить пачку просроченных PENDING-броней. Возвращает число отменённых.
+
+        То же, что cancel() по одной, но set-based: пачка забирается
+        SELECT … FOR UPDATE SKIP LOCKED (параллельные воркеры берут разные
+        строки), статус и юниты меняются несколькими UPDATE, счётчики
+        владельцев пересчитываются одним проходом. Checkout Sessions
+        отменённых броней закрываются после коммита.
+        """
+        from accounts.models import User
+        from services.models import StorageUnit
+
+        now = now or timezone.now()
+        with transaction.atomic():
+            claimed = list(
+                cls.objects.filter(status=cls.Status.PENDING, expires_at__lt=now)
+                .order_by('expires_at')
+                .select_for_update(skip_locked=True)
+                .values_list('pk', 'user_id', 'parent_booking_id', 'stripe_session_id')[:batch_size]
+            )
+            if not claimed:
+                return 0
+            ids = [pk for pk, _user, _parent, _session in claimed]
+            # Продления юниты не держат — они принадлежат родителю
+            primary_ids = [pk for pk, _user, parent, _session in claimed if parent is None]
+
+            cancelled = cls.objects.filter(pk__in=ids, status=cls.Status.PENDING).update(
+                status=cls.Status.CANCELLED, updated_at=now,
+            )
+            if primary_ids:
+                StorageUnit.objects.filter(
+                    Q(pk__in=BookingUnit.objects.filter(booking_id__in=primary_ids).values('storage_unit'))
+                    | Q(pk__in=cls.objects.filter(pk__in=primary_ids).values('storage_unit'))
+                ).update(is_available=True)
+            User.refresh_stats_many({user for _pk, user, _parent, _session in claimed})
+
+        from dashboard.services import bump_cabinet_version
+        bump_cabinet_version(*{user for _pk, user, _parent, _session in claimed})
+
+        from .services import expire_checkout_sessions
+        expire_checkout_sessions([session for _pk, _user, _parent, session in claimed])
+        return cancelled
+
     @transaction.atomic
     def reassign_unit(self, old_unit, new_unit):
         """Переселить бронирование с одного юнита на другой.
@@ -642,7 +917,7 @@ class Booking(models.Model):
         # Обновить снепшот unit_codes
         current_units = [
             bu.storage_unit for bu in
-            self.booking_units.select_related('storage_unit__section__location').all()
+            self.booking_units.select_related('storage_unit').all()
         ]
         self.unit_codes = ', '.join(u.full_code for u in current_units)
         self.save(update_fields=['storage_unit', 'unit_codes', 'updated_at'])
@@ -710,3 +985,52 @@ class BookingAddon(models.Model):
 
     def __str__(self):
         return f"{self.booking} — {self.addon.name}"
+
+
+class StripeEvent(models.Model):
+    """Проверенное событие Stripe-вебхука — durable-очередь обработки.
+
+    Вебхук только сохраняет событие и отвечает 200; обработку (запросы
+    к Stripe, mark_as_paid) делают воркеры bookings.services. event_id
+    уникален — повторная доставка того же события не создаёт дубль.
+    """
+
+    class Status(models.TextChoices):
+        PENDING = 'pending', _('Pending')
+        PROCESSING = 'processing', _('Processing')
+        DONE = 'done', _('Done')
+        FAILED = 'failed', _('Failed')
+        IGNORED = 'ignored', _('Ignored')
+
+    event_id = models.CharField(max_length=255, unique=True, verbose_name=_('Event ID'))
+    event_type = models.CharField(max_length=100, verbose_name=_('Event type'))
+    # client_reference_id как есть (без FK): бронь могла быть удалена
+    booking_ref = models.BigIntegerField(null=True, blank=True, verbose_name=_('Booking ID'))
+    payload = models.JSONField(verbose_name=_('Payload'))
+
+    status = models.CharField(
+        max_length=20,
+        choices=Status.choices,
+        default=Status.PENDING,
+        verbose_name=_('Status')
+    )
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name=_('Attempts'))
+    next_attempt_at = models.DateTimeField(default=timezone.now, verbose_name=_('Next attempt at'))
+    error = models.TextField(blank=True, verbose_name=_('Last error'))
+
+    received_at = models.DateTimeField(auto_now_add=True, verbose_name=_('Received at'))
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name=_('Started at'))
+    processed_at = models.DateTimeField(null=True, blank=True, verbose_name=_('Processed at'))
+    duration_ms = models.PositiveIntegerField(null=True, blank=True, verbose_name=_('Duration (ms)'))
+
+    class Meta:
+        ordering = ['-received_at']
+        verbose_name = _('Stripe event')
+        verbose_name_plural = _('Stripe events')
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='idx_stripe_event_queue'),
+            models.Index(fields=['booking_ref', 'received_at'], name='idx_stripe_event_booking'),
+        ]
+
+    def __str__(self):
+        return f"{self.event_type} {self.event_id} — {self.status}"
@@ -0,0 +1,231 @@
+"""Единый клиент Stripe для всех вызовов API.
+
+Один StripeClient на процесс с общим requests.Session (keep-alive, пул
+соединений), явными таймаутами и повторами SDK. PaymentIntent и Charge
+раскрываются через expand= в том же запросе, а не отдельными вызовами.
+Длительность каждого вызова пишется в гистограмму stripe.<name>. Если
+Stripe недоступен, circuit breaker после серии сбоев сразу отвечает
+StripeUnavailable, не дожидаясь таймаутов.
+"""
+import threading
+import time
+from datetime import timedelta
+
+import requests
+import stripe
+from django.conf import settings
+from django.utils import timezone
+from requests.adapters import HTTPAdapter
+
+from core.metrics import histogram
+from core.profiling import external_call
+
+
+class StripeUnavailable(stripe.error.APIConnectionError):
+    """Breaker разомкнут: запрос в Stripe не отправлялся.
+
+    Наследует APIConnectionError, чтобы существующие
+    `except stripe.error.StripeError` обрабатывали его как обычный сбой сети.
+    """
+
+
+class CircuitBreaker:
+    """Размыкается после `threshold` сбоев подряд на `reset_after` секунд.
+
+    По истечении паузы пропускает один пробный запрос (half-open):
+    успех замыкает цепь, сбой — снова размыкает.
+    """
+
+    def __init__(self, threshold, reset_after):
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_after:
+                # Пробный запрос; следующие ждут его исхода
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+
+# Stripe принимает expires_at сессии от 30 минут до 24 часов после создания;
+# минуту сверху — на задержку запроса
+SESSION_MIN_TTL = timedelta(minutes=31)
+SESSION_MAX_TTL = timedelta(hours=24)
+
+# Сбои инфраструктуры Stripe. Ошибки запроса (карта, параметры) — не повод размыкать цепь.
+BREAKER_ERRORS = (stripe.error.APIConnectionError, stripe.error.APIError, stripe.error.RateLimitError)
+
+_lock = threading.Lock()
+_client = None
+_client_key = None
+_breaker = None
+
+
+def is_configured():
+    """Stripe настроен с реальным секретным ключом."""
+    key = settings.STRIPE_SECRET_KEY
+    return bool(key and key.startswith('sk_') and len(key) > 10)
+
+
+def get_client():
+    """StripeClient процесса; пересоздаётся, если сменился STRIPE_SECRET_KEY."""
+    global _client, _client_key
+    with _lock:
+        if _client is None or _client_key != settings.STRIPE_SECRET_KEY:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_maxsize=getattr(settings, 'STRIPE_POOL_SIZE', 10))
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            http_client = stripe.RequestsClient(
+                session=session,
+                timeout=(settings.STRIPE_CONNECT_TIMEOUT, settings.STRIPE_READ_TIMEOUT),
+            )
+            base_addresses = {}
+            if getattr(settings, 'STRIPE_API_BASE', ''):
+                base_addresses['api'] = settings.STRIPE_API_BASE
+            _client = stripe.StripeClient(
+                settings.STRIPE_SECRET_KEY,
+                http_client=http_client,
+                max_network_retries=settings.STRIPE_MAX_NETWORK_RETRIES,
+                base_addresses=base_addresses,
+            )
+            _client_key = settings.STRIPE_SECRET_KEY
+        return _client
+
+
+def get_breaker():
+    global _breaker
+    with _lock:
+        if _breaker is None:
+            _breaker = CircuitBreaker(
+                threshold=settings.STRIPE_BREAKER_THRESHOLD,
+                reset_after=settings.STRIPE_BREAKER_RESET_SECONDS,
+            )
+        return _breaker
+
+
+def reset():
+    """Сбросить клиент и breaker (тесты, смена настроек)."""
+    global _client, _client_key, _breaker
+    with _lock:
+        _client = _client_key = _breaker = None
+
+
+def _call(name, func, *args, **kwargs):
+    breaker = get_breaker()
+    if not breaker.allow():
+        raise StripeUnavailable('Stripe is temporarily unavailable')
+    started = time.perf_counter()
+    try:
+        with external_call('stripe'):
+            result = func(*args, **kwargs)
+    except BREAKER_ERRORS:
+        breaker.record_failure()
+        raise
+    else:
+        breaker.record_success()
+        return result
+    finally:
+        histogram(f'stripe.{name}').observe((time.perf_counter() - started) * 1000)
+
+
+def create_checkout_session(**params):
+    return _call('checkout_session_create', get_client().v1.checkout.sessions.create, params)
+
+
+def retrieve_checkout_session(session_id):
+    """Checkout Session с PaymentIntent и его последним Charge — один запрос."""
+    return _call(
+        'checkout_session_retrieve', get_client().v1.checkout.sessions.retrieve,
+        session_id, {'expand': ['payment_intent.latest_charge']},
+    )
+
+
+def expire_checkout_session(session_id):
+    """Закрыть открытую сессию, чтобы по старой ссылке нельзя было заплатить."""
+    return _call('checkout_session_expire', get_client().v1.checkout.sessions.expire, session_id)
+
+
+def session_expiry(deadline, now=None):
+    """expires_at для Checkout Session: `deadline`, прижатый к допустимому Stripe окну.
+
+    Срок брони под минимум Stripe подгоняет views.session_expires_at —
+    иначе сессия пережила бы бронь.
+    """
+    now = now or timezone.now()
+    return int(min(max(deadline, now + SESSION_MIN_TTL), now + SESSION_MAX_TTL).timestamp())
+
+
+def retrieve_payment_intent(payment_intent_id):
+    """PaymentIntent с раскрытым latest_charge — один запрос вместо двух."""
+    return _call(
+        'payment_intent_retrieve', get_client().v1.payment_intents.retrieve,
+        payment_intent_id, {'expand': ['latest_charge']},
+    )
+
+
+def _created_range(created_from, created_to):
+    return {'gte': int(created_from.timestamp()), 'lt': int(created_to.timestamp())}
+
+
+def list_checkout_sessions(created_from, created_to):
+    """Все Checkout Sessions за [from, to) с раскрытыми PaymentIntent и Charge.
+
+    auto_paging_iter сам листает страницы по 100; результат — список.
+    """
+    params = {
+        'created': _created_range(created_from, created_to),
+        'limit': 100,
+        'expand': ['data.payment_intent.latest_charge'],
+    }
+    return _call(
+        'checkout_session_list',
+        lambda: list(get_client().v1.checkout.sessions.list(params).auto_paging_iter()),
+    )
+
+
+def list_payment_intents(created_from, created_to):
+    """Все PaymentIntent за [from, to) с раскрытым latest_charge."""
+    params = {
+        'created': _created_range(created_from, created_to),
+        'limit': 100,
+        'expand': ['data.latest_charge'],
+    }
+    return _call(
+        'payment_intent_list',
+        lambda: list(get_client().v1.payment_intents.list(params).auto_paging_iter()),
+    )
+
+
+def payment_details(payment_intent):
+    """(payment_intent_id, receipt_url) из раскрытого PaymentIntent или его id."""
+    if not payment_intent:
+        return '', ''
+    if isinstance(payment_intent, str):
+        return payment_intent, ''
+    charge = payment_intent.latest_charge
+    if not charge or isinstance(charge, str):
+        return payment_intent.id, ''
+    return payment_intent.id, charge.receipt_url or ''
@@ -0,0 +1,349 @@
+"""Обработка Stripe-вебхуков вне HTTP-запроса.
+
+StripeWebhookView сохраняет проверенное событие в StripeEvent и сразу
+отвечает 200. Воркеры забирают события пачками (SKIP LOCKED), по одной
+брони — строго по порядку получения, и записывают исход и длительность.
+"""
+import logging
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time, timedelta
+
+import stripe
+from django.conf import settings
+from django.db import IntegrityError, connections, transaction
+from django.db.models import Exists, F, OuterRef, Q
+from django.utils import timezone
+
+from core.metrics import histogram
+from . import payments
+from .models import Booking, StripeEvent
+
+logger = logging.getLogger(__name__)
+
+EVENT_LATENCY = histogram('stripe.event')
+
+MAX_ATTEMPTS = 5
+
+# PROCESSING дольше этого — воркер упал, событие возвращается в очередь
+PROCESSING_TIMEOUT = timedelta(minutes=10)
+
+# Страница успеха опрашивает статус — в Stripe ходим не чаще раза в N секунд на бронь
+PAYMENT_CHECK_INTERVAL = 10
+
+
+def handle_checkout_completed(payload):
+    """checkout.session.completed: оплатить бронь, приложить receipt_url из charge."""
+    session = payload['data']['object']
+    booking_id = session.get('client_reference_id')
+    if not booking_id:
+        return
+
+    booking = Booking.objects.filter(pk=booking_id).first()
+    if booking is None or booking.status != Booking.Status.PENDING:
+        return
+
+    payment_intent_id = session.get('payment_intent') or ''
+    receipt_url = ''
+    if payment_intent_id:
+        try:
+            _, receipt_url = payments.payment_details(payments.retrieve_payment_intent(payment_intent_id))
+        except stripe.error.StripeError:
+            # Квитанция необязательна — оплату это не блокирует
+            pass
+
+    booking.mark_as_paid(payment_intent_id, receipt_url)
+
+
+def sync_checkout_session(booking):
+    """Сверить pending-бронь с её Checkout Session. True — если бронь оплачена сейчас.
+
+    Один запрос: PaymentIntent и Charge раскрыты через expand.
+    """
+    session = payments.retrieve_checkout_session(booking.stripe_session_id)
+    if session.payment_status != 'paid':
+        return False
+    payment_intent_id, receipt_url = payments.payment_details(session.payment_intent)
+    return booking.mark_as_paid(payment_intent_id, receipt_url)
+
+
+def check_payment_once(booking):
+    """Запасная проверка оплаты, если вебхук ещё не дошёл.
+
+    Условный UPDATE last_payment_check_at — одна проверка на бронь за
+    PAYMENT_CHECK_INTERVAL, сколько бы вкладок и процессов ни опрашивали
+    статус. Ошибки Stripe глотаем: дальше бронь оплатит вебхук.
+    """
+    if not booking.stripe_session_id:
+        return
+    now = timezone.now()
+    claimed = Booking.objects.filter(pk=booking.pk).filter(
+        Q(last_payment_check_at__isnull=True)
+        | Q(last_payment_check_at__lte=now - timedelta(seconds=PAYMENT_CHECK_INTERVAL))
+    ).update(last_payment_check_at=now)
+    if not claimed:
+        return
+    try:
+        sync_checkout_session(booking)
+    except stripe.error.StripeError:
+        pass
+
+
+def expire_checkout_sessions(session_ids):
+    """После коммита закрыть Checkout Sessions отменённых броней.
+
+    Иначе по открытой ссылке можно оплатить уже отменённую бронь. Ошибки
+    Stripe (сессия уже истекла или оплачена) не мешают отмене.
+    """
+    session_ids = [session_id for session_id in session_ids if session_id]
+    if not session_ids or not payments.is_configured():
+        return
+
+    def expire():
+        for session_id in session_ids:
+            try:
+                payments.expire_checkout_session(session_id)
+            except stripe.error.StripeError:
+                pass
+
+    transaction.on_commit(expire)
+
+
+def _day_windows(date_from, date_to):
+    """Локальные сутки [date_from, date_to] как пары (начало, конец)."""
+    day = date_from
+    while day <= date_to:
+        start = timezone.make_aware(datetime.combine(day, time.min))
+        day += timedelta(days=1)
+        yield start, timezone.make_aware(datetime.combine(day, time.min))
+
+
+def fetch_stripe_payments(date_from, date_to, workers=4):
+    """Checkout Sessions и PaymentIntent за период: {id: объект}, {id: объект}.
+
+    Период режется на сутки; не больше `workers` окон листаются
+    параллельно. Потоки ходят только в Stripe, не в БД.
+    """
+    windows = list(_day_windows(date_from, date_to))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='stripe-reconcile') as pool:
+        session_pages = list(pool.map(lambda window: payments.list_checkout_sessions(*window), windows))
+        intent_pages = list(pool.map(lambda window: payments.list_payment_intents(*window), windows))
+    sessions = {session.id: session for page in session_pages for session in page}
+    intents = {intent.id: intent for page in intent_pages for intent in page}
+    return sessions, intents
+
+
+def reconcile_stripe_payments(date_from, date_to, workers=4, dry_run=False):
+    """Сверить брони со Stripe за период. Возвращает Counter с итогами.
+
+    - pending-бронь с оплаченной сессией (вебхук потерялся) — mark_as_paid;
+    - оплаченная сессия у отменённой брони — только в отчёт, разбирает менеджер;
+    - пустой stripe_receipt_url при известном PaymentIntent — bulk_update.
+    Брони ищутся одним запросом по stripe_session_id / client_reference_id.
+    """
+    sessions, intents = fetch_stripe_payments(date_from, date_to, workers)
+    stats = Counter(sessions=len(sessions), payment_intents=len(intents))
+
+    receipts = {}
+    for payment_intent in intents.values():
+        payment_intent_id, receipt_url = payments.payment_details(payment_intent)
+        if receipt_url:
+            receipts[payment_intent_id] = receipt_url
+
+    paid_sessions = [session for session in sessions.values() if session.payment_status == 'paid']
+    references = {
+        int(session.client_reference_id) for session in paid_sessions
+        if str(session.client_reference_id or '').isdigit()
+    }
+    bookings = Booking.objects.filter(
+        Q(stripe_session_id__in=[session.id for session in paid_sessions]) | Q(pk__in=references)
+    ).only('pk', 'status', 'stripe_session_id')
+    by_session = {booking.stripe_session_id: booking for booking in bookings if booking.stripe_session_id}
+    by_pk = {booking.pk: booking for booking in bookings}
+
+    for session in paid_sessions:
+        payment_intent_id, receipt_url = payments.payment_details(session.payment_intent)
+        if receipt_url:
+            receipts.setdefault(payment_intent_id, receipt_url)
+
+        booking = by_session.get(session.id)
+        if booking is None and str(session.client_reference_id or '').isdigit():
+            booking = by_pk.get(int(session.client_reference_id))
+        if booking is None:
+            stats['unmatched'] += 1
+        elif booking.status == Booking.Status.PENDING:
+            stats['marked_paid'] += 1
+            if not dry_run and not booking.mark_as_paid(payment_intent_id, receipts.get(payment_intent_id, '')):
+                # mark_as_paid отменил истёкшую бронь — деньги получены, нужен менеджер
+                stats['marked_paid'] -= 1
+                stats['paid_but_cancelled'] += 1
+        elif booking.status == Booking.Status.CANCELLED:
+            stats['paid_but_cancelled'] += 1
+            logger.warning('Booking %s is cancelled but session %s is paid', booking.pk, session.id)
+
+    missing = list(
+        Booking.objects.filter(stripe_receipt_url='', stripe_payment_id__in=list(receipts))
+        .only('pk', 'stripe_payment_id')
+    )
+    stats['receipts'] = len(missing)
+    if missing and not dry_run:
+        now = timezone.now()
+        for booking in missing:
+            booking.stripe_receipt_url = receipts[booking.stripe_payment_id]
+            booking.updated_at = now
+        Booking.objects.bulk_update(missing, ['stripe_receipt_url', 'updated_at'], batch_size=500)
+    return stats
+
+
+HANDLERS = {
+    'checkout.session.completed': handle_checkout_completed,
+}
+
+
+def record_stripe_event(event):
+    """Сохранить проверенное событие (stripe.Event или dict). Возвращает (event, created).
+
+    Неизвестные типы сохраняются сразу как IGNORED — для аудита.
+    """
+    payload = event.to_dict(for_json=True) if hasattr(event, 'to_dict') else dict(event)
+    event_type = payload.get('type', '')
+    booking_ref = None
+    reference = (payload.get('data', {}).get('object') or {}).get('client_reference_id')
+    if reference and str(reference).isdigit():
+        booking_ref = int(reference)
+
+    defaults = {
+        'event_type': event_type,
+        'booking_ref': booking_ref,
+        'payload': payload,
+        'status': StripeEvent.Status.PENDING if event_type in HANDLERS else StripeEvent.Status.IGNORED,
+    }
+    try:
+        with transaction.atomic():
+            return StripeEvent.objects.get_or_create(event_id=payload['id'], defaults=defaults)
+    except IntegrityError:
+        # Параллельная доставка того же события
+        return StripeEvent.objects.get(event_id=payload['id']), False
+
+
+def claim_stripe_events(batch_size=20, now=None):
+    """Забрать готовые события в PROCESSING. Возвращает список StripeEvent.
+
+    Событие брони не берётся, пока у той же брони есть более раннее
+    незавершённое — так события одной брони обрабатываются по порядку,
+    а разных броней — параллельно.
+    """
+    now = now or timezone.now()
+    earlier_open = StripeEvent.objects.filter(
+        booking_ref=OuterRef('booking_ref'),
+        received_at__lt=OuterRef('received_at'),
+        status__in=[StripeEvent.Status.PENDING, StripeEvent.Status.PROCESSING],
+    )
+    with transaction.atomic():
+        ids = list(
+            StripeEvent.objects.filter(
+                status=StripeEvent.Status.PENDING, next_attempt_at__lte=now,
+            )
+            .filter(~Exists(earlier_open))
+            .order_by('received_at', 'pk')
+            .select_for_update(skip_locked=True)
+            .values_list('pk', flat=True)[:batch_size]
+        )
+        if not ids:
+            return []
+        StripeEvent.objects.filter(pk__in=ids, status=StripeEvent.Status.PENDING).update(
+            status=StripeEvent.Status.PROCESSING, started_at=now, attempts=F('attempts') + 1,
+        )
+    return list(StripeEvent.objects.filter(pk__in=ids, status=StripeEvent.Status.PROCESSING).order_by('received_at', 'pk'))
+
+
+def process_stripe_event(event):
+    """Выполнить обработчик события и записать исход. Возвращает итоговый статус."""
+    started = timezone.now()
+    error = ''
+    try:
+        HANDLERS[event.event_type](event.payload)
+    except Exception as e:
+        error = f'{type(e).__name__}: {e}'
+        logger.exception('Stripe event %s failed', event.event_id)
+
+    finished = timezone.now()
+    duration_ms = (finished - started).total_seconds() * 1000
+    EVENT_LATENCY.observe(duration_ms)
+
+    if not error:
+        status = StripeEvent.Status.DONE
+        next_attempt_at = event.next_attempt_at
+    elif event.attempts >= MAX_ATTEMPTS:
+        status = StripeEvent.Status.FAILED
+        next_attempt_at = event.next_attempt_at
+    else:
+        # Повтор с экспоненциальной паузой: 2, 4, 8, 16 минут
+        status = StripeEvent.Status.PENDING
+        next_attempt_at = finished + timedelta(minutes=2 ** event.attempts)
+
+    StripeEvent.objects.filter(pk=event.pk).update(
+        status=status,
+        error=error,
+        next_attempt_at=next_attempt_at,
+        processed_at=finished,
+        duration_ms=int(duration_ms),
+    )
+    event.status = status
+    return status
+
+
+def process_pending_events(batch_size=20):
+    """Разобрать очередь до конца. Возвращает число обработанных событий."""
+    StripeEvent.objects.filter(
+        status=StripeEvent.Status.PROCESSING,
+        started_at__lt=timezone.now() - PROCESSING_TIMEOUT,
+    ).update(status=StripeEvent.Status.PENDING)
+
+    total = 0
+    while True:
+        events = claim_stripe_events(batch_size)
+        if not events:
+            return total
+        for event in events:
+            process_stripe_event(event)
+        total += len(events)
+
+
+# === Фоновый пул ===
+
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'STRIPE_EVENT_WORKERS', 2),
+            thread_name_prefix='stripe-events',
+        )
+    return _executor
+
+
+def dispatch_stripe_events():
+    """Запустить обработку очереди после коммита, вне потока запроса.
+
+    При STRIPE_EVENTS_ASYNC=False (тесты) — синхронно в on_commit.
+    Упавшее или недошедшее до пула событие подберёт задача
+    process_stripe_events в run_scheduler.
+    """
+    def run_in_thread():
+        try:
+            process_pending_events()
+        except Exception as e:
+            logger.error(f'Stripe event worker failed: {e}')
+        finally:
+            connections.close_all()
+
+    def submit():
+        if getattr(settings, 'STRIPE_EVENTS_ASYNC', True):
+            _get_executor().submit(run_in_thread)
+        else:
+            process_pending_events()
+
+    transaction.on_commit(submit)
@@ -1,5 +1,9 @@
+import json
+import threading
 from decimal import Decimal
 from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
 from unittest.mock import patch, MagicMock
 
 from django.db import transaction
@@ -8,6 +12,7 @@ from django.urls import reverse
 from django.utils import timezone
 
 from accounts.models import User
+from core.metrics import histogram
 from bookings.models import Booking, BookingAddon, BookingUnit
 from services.models import (
     Service, Tariff, TariffPeriod, TariffPriceTier,
@@ -490,6 +495,129 @@ class BookingCreateViewTest(BookingTestMixin, TestCase):
         self.assertTemplateUsed(resp, 'bookings/no_availability.html')
 
 
+class BookingCreateIdempotencyTest(BookingTestMixin, TestCase):
+    """Повторная отправка формы с тем же idempotency_key не создаёт вторую бронь."""
+
+    def setUp(self):
+        self.create_base_objects()
+        self.client = Client()
+        self.client.force_login(self.user)
+        self.url = reverse('booking_create', kwargs={
+            'service_type': 'auto',
+            'slug': self.tariff.slug,
+        })
+        self.form = {'period': self.period.id, 'idempotency_key': 'form-token-1'}
+
+    def test_double_submit_returns_original_booking(self):
+        first = self.client.post(self.url, self.form)
+        booking = Booking.objects.get()
+        self.assertEqual(first.url, reverse('booking_mock_payment', args=[booking.pk]))
+
+        second = self.client.post(self.url, self.form)
+        self.assertEqual(second.url, reverse('booking_checkout', args=[booking.pk]))
+        self.assertEqual(Booking.objects.count(), 1)
+
+        # Тот же токен у другого пользователя — своя бронь
+        other = User.objects.create_user(email='other-idem@example.com', password='x')
+        self.client.force_login(other)
+        self.client.post(self.url, self.form)
+        self.assertEqual(Booking.objects.count(), 2)
+
+    def test_concurrent_duplicate_collapses_on_unique_key(self):
+        from bookings.views import BookingCreateView
+
+        original = self.create_booking(idempotency_key='form-token-1')
+        # Проверка до вставки «не увидела» параллельную бронь — спасает индекс
+        real_lookup = BookingCreateView._submitted_booking
+        with patch.object(BookingCreateView, '_submitted_booking', side_effect=[None, original]) as lookup:
+            resp = self.client.post(self.url, self.form)
+
+        self.assertEqual(lookup.call_count, 2)
+        self.assertEqual(resp.url, reverse('booking_checkout', args=[original.pk]))
+        self.assertEqual(Booking.objects.count(), 1)
+        self.assertEqual(real_lookup(self.user, 'form-token-1'), original)
+
+    def test_key_is_released_after_window(self):
+        old = self.create_booking(idempotency_key='form-token-1')
+        Booking.objects.filter(pk=old.pk).update(created_at=timezone.now() - timedelta(hours=1))
+
+        self.client.post(self.url, self.form)
+
+        self.assertEqual(Booking.objects.count(), 2)
+        old.refresh_from_db()
+        self.assertEqual(old.idempotency_key, '')
+        self.assertEqual(Booking.objects.get(idempotency_key='form-token-1').user, self.user)
+
+
+class BookingWriteQueryCountTest(BookingTestMixin, TestCase):
+    """Запись брони — фиксированное число запросов, сколько бы ни было аддонов и политик."""
+
+    # Сессия и пользователь; тариф, период, версия политик, политики и
+    # согласия (кэш холодный: новые политики сменили версию), LIMIT-проверка
+    # мест, тир цены, аддоны; номер, INSERT брони, пересчёт счётчиков броней
+    # пользователя (2), версия кабинета; по одному INSERT на аддоны и
+    # согласия; savepoint'ы (4)
+    CREATE_QUERIES = 21
+    EXTEND_QUERIES = 16
+
+    def setUp(self):
+        from django.core.cache import cache
+
+        # Кэш политик переживает откат транзакции теста
+        self.addCleanup(cache.clear)
+        self.create_base_objects()
+        self.client = Client()
+        self.client.force_login(self.user)
+
+    def _addons(self, count, prefix):
+        return [
+            AddonService.objects.create(service=self.service, name=f'{prefix} {i}', price_aed=Decimal('10.00'))
+            for i in range(count)
+        ]
+
+    def _policies(self, count, prefix):
+        from policies.models import Policy
+
+        return [
+            Policy.objects.create(title=f'{prefix} {i}', slug=f'{prefix}-{i}', content='x', is_required=True)
+            for i in range(count)
+        ]
+
+    def test_create_query_count_is_flat(self):
+        from policies.models import PolicyConsent
+
+        url = reverse('booking_create', kwargs={'service_type': 'auto', 'slug': self.tariff.slug})
+        for count in (1, 5):
+            with self.subTest(count=count):
+                addons = self._addons(count, f'addon-{count}')
+                # Принятые раньше политики не должны мешать: согласия только на новые
+                policies = self._policies(count, f'policy-{count}')
+                with self.assertNumQueries(self.CREATE_QUERIES):
+                    resp = self.client.post(url, {
+                        'period': self.period.id,
+                        'addons': [addon.id for addon in addons],
+                        'accepted_policies': [policy.id for policy in policies],
+                    })
+                self.assertEqual(resp.status_code, 302)
+                booking = Booking.objects.latest('created_at')
+                self.assertEqual(booking.booking_addons.count(), count)
+                self.assertEqual(
+                    PolicyConsent.objects.filter(user=self.user, policy__in=policies).count(), count,
+                )
+
+    def test_extend_query_count_is_flat(self):
+        parent = self.create_booking()
+        parent.mark_as_paid('pi_parent')
+        url = reverse('cabinet-booking-extend', args=[parent.pk])
+        for count in (1, 5):
+            with self.subTest(count=count):
+                addons = self._addons(count, f'extend-{count}')
+                with self.assertNumQueries(self.EXTEND_QUERIES):
+                    resp = self.client.post(url, {'period': self.period.id, 'addons': [a.id for a in addons]})
+                self.assertEqual(resp.status_code, 302)
+                self.assertEqual(Booking.objects.filter(parent_booking=parent).latest('created_at').booking_addons.count(), count)
+
+
 class BookingExpirationTest(BookingTestMixin, TestCase):
     """Tests for 30-minute pending booking expiration."""
 
@@ -692,6 +820,106 @@ class DashboardPendingFilterTest(BookingTestMixin, TestCase):
         self.assertNotIn(expired, pending)
 
 
+class CabinetSnapshotTest(BookingTestMixin, TestCase):
+    """Кабинет читает снепшот из кэша; события брони и визита его обновляют."""
+
+    def setUp(self):
+        from django.core.cache import cache
+
+        # id пользователей повторяются между тестами, а кэш — общий
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.create_base_objects()
+        self.client = Client()
+        self.client.force_login(self.user)
+
+    def test_repeat_pages_do_not_rebuild_snapshot(self):
+        self.create_booking()
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        self.client.get(reverse('cabinet-dashboard'))
+        with CaptureQueriesContext(connection) as ctx:
+            resp = self.client.get(reverse('cabinet-billing'))
+        self.assertEqual(len(resp.context['pending_payments']), 1)
+        self.assertFalse([q for q in ctx.captured_queries if 'bookings_booking' in q['sql']])
+
+    def test_payment_refreshes_snapshot(self):
+        booking = self.create_booking()
+        resp = self.client.get(reverse('cabinet-billing'))
+        self.assertEqual(len(resp.context['pending_payments']), 1)
+
+        booking.mark_as_paid('pi_test')
+        resp = self.client.get(reverse('cabinet-billing'))
+        self.assertEqual(resp.context['pending_payments'], [])
+        self.assertEqual([b.pk for b in resp.context['paid_bookings']], [booking.pk])
+
+    def test_visit_refreshes_history(self):
+        from visits.models import Visit
+
+        booking = self.create_booking()
+        booking.mark_as_paid('pi_test')
+        self.assertEqual(list(self.client.get(reverse('cabinet-history')).context['visits']), [])
+
+        Visit.objects.create(booking=booking)
+        resp = self.client.get(reverse('cabinet-history'))
+        self.assertEqual(len(resp.context['visits']), 1)
+
+    def test_version_bumped_elsewhere_refreshes_snapshot(self):
+        from accounts.models import User
+        from django.db.models import F
+
+        booking = self.create_booking()
+        self.assertEqual(len(self.client.get(reverse('cabinet-billing')).context['pending_payments']), 1)
+
+        # Событие в другом процессе: локальный кэш его не видел, версия — в БД
+        Booking.objects.filter(pk=booking.pk).update(status=Booking.Status.CANCELLED)
+        User.objects.filter(pk=self.user.pk).update(cabinet_version=F('cabinet_version') + 1)
+        self.assertEqual(self.client.get(reverse('cabinet-billing')).context['pending_payments'], [])
+
+    def test_full_user_save_keeps_counters_and_cabinet_version(self):
+        from accounts.models import User
+
+        stale = User.objects.get(pk=self.user.pk)
+        self.create_booking()
+        User.objects.filter(pk=self.user.pk).update(lifetime_paid_aed=Decimal('100.00'))
+        fresh = User.objects.get(pk=self.user.pk)
+        self.assertGreater(fresh.cabinet_version, stale.cabinet_version)
+
+        stale.first_name = 'Renamed'
+        stale.set_password('new-pass-123')
+        stale.save()
+
+        saved = User.objects.get(pk=self.user.pk)
+        self.assertEqual(saved.first_name, 'Renamed')
+        self.assertTrue(saved.check_password('new-pass-123'))
+        self.assertEqual(saved.cabinet_version, fresh.cabinet_version)
+        self.assertEqual(saved.bookings_count, 1)
+        self.assertEqual(saved.lifetime_paid_aed, Decimal('100.00'))
+
+    def test_snapshot_json_supports_etag(self):
+        url = reverse('cabinet-snapshot')
+        booking = self.create_booking()
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual([b['id'] for b in resp.json()['pending_bookings']], [booking.pk])
+        etag = resp['ETag']
+
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        booking.cancel()
+        resp = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotEqual(resp['ETag'], etag)
+        self.assertEqual(resp.json()['pending_bookings'], [])
+
+    def test_detail_hides_other_users_booking(self):
+        other = User.objects.create_user(email='other@example.com', password='x', first_name='O', last_name='U')
+        booking = self.create_booking(user=other)
+        resp = self.client.get(reverse('cabinet-booking-detail', kwargs={'pk': booking.pk}))
+        self.assertEqual(resp.status_code, 404)
+
+
 class CancelExpiredBookingsCommandTest(BookingTestMixin, TestCase):
     """Tests for cancel_expired_bookings management command."""
 
@@ -739,6 +967,92 @@ class CancelExpiredBookingsCommandTest(BookingTestMixin, TestCase):
         self.assertEqual(booking.status, Booking.Status.PAID)
 
 
+class CancelExpiredBatchTest(BookingTestMixin, TestCase):
+    """Booking.cancel_expired: пачкой, с освобождением юнитов одним UPDATE."""
+
+    def setUp(self):
+        self.create_base_objects()
+
+    def _expired(self, quantity=1, **kwargs):
+        booking = self.create_booking(quantity=quantity, **kwargs)
+        booking.assign_storage_units()
+        Booking.objects.filter(pk=booking.pk).update(expires_at=timezone.now() - timedelta(minutes=5))
+        return booking
+
+    def test_cancels_and_releases_units_in_batches(self):
+        bookings = [self._expired(quantity=2) for _ in range(3)]
+        fresh = self.create_booking()
+        fresh.assign_storage_units()
+        self.assertEqual(StorageUnit.objects.filter(is_available=False).count(), 7)
+
+        self.assertEqual(Booking.cancel_expired(batch_size=2), 2)
+        self.assertEqual(Booking.cancel_expired(batch_size=2), 1)
+        self.assertEqual(Booking.cancel_expired(batch_size=2), 0)
+
+        for booking in bookings:
+            booking.refresh_from_db()
+            self.assertEqual(booking.status, Booking.Status.CANCELLED)
+        fresh.refresh_from_db()
+        self.assertEqual(fresh.status, Booking.Status.PENDING)
+        # Заняты только юниты действующей брони
+        self.assertEqual(
+            set(StorageUnit.objects.filter(is_available=False)),
+            {fresh.storage_unit},
+        )
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.bookings_count, 4)
+
+    def test_extension_keeps_parent_units(self):
+        parent = self.create_booking()
+        parent.assign_storage_units()
+        parent.mark_as_paid('pi_parent')
+        parent.refresh_from_db()
+        extension = self._expired(parent_booking=parent, storage_unit=parent.storage_unit)
+
+        Booking.cancel_expired()
+
+        extension.refresh_from_db()
+        self.assertEqual(extension.status, Booking.Status.CANCELLED)
+        self.assertFalse(StorageUnit.objects.get(pk=parent.storage_unit_id).is_available)
+
+    def test_query_count_independent_of_batch_size(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        def run(n):
+            for _ in range(n):
+                self._expired()
+            with CaptureQueriesContext(connection) as ctx:
+                Booking.cancel_expired()
+            return len(ctx.captured_queries)
+
+        self.assertEqual(run(1), run(4))
+
+    def test_loop_mode_drains_then_sleeps(self):
+        from io import StringIO
+        from unittest.mock import patch
+        from django.core.management import call_command
+
+        self._expired()
+        out = StringIO()
+        with patch('bookings.management.commands.cancel_expired_bookings.time.sleep',
+                   side_effect=KeyboardInterrupt):
+            call_command('cancel_expired_bookings', '--loop', '--interval', '1', stdout=out)
+        self.assertIn('Cancelled 1 expired pending booking(s) in 1 batch(es)', out.getvalue())
+        self.assertIn('Stopped.', out.getvalue())
+
+    def test_loop_mode_refreshes_connection_each_pass(self):
+        from io import StringIO
+        from unittest.mock import patch
+        from django.core.management import call_command
+
+        command = 'bookings.management.commands.cancel_expired_bookings'
+        with patch(f'{command}.close_old_connections') as mock_close, \
+                patch(f'{command}.time.sleep', side_effect=[None, KeyboardInterrupt]):
+            call_command('cancel_expired_bookings', '--loop', '--interval', '1', stdout=StringIO())
+        self.assertEqual(mock_close.call_count, 2)
+
+
 class MarkAsPaidAtomicityTest(BookingTestMixin, TestCase):
     """Tests for atomic mark_as_paid and double-payment prevention."""
 
@@ -1012,6 +1326,83 @@ class DisplayStatusTest(BookingTestMixin, TestCase):
         self.assertEqual(overdue_pks, {overdue.pk})
 
 
+class BookingQuerySetDisplayStatusTest(BookingTestMixin, TestCase):
+    """with_display_status() считает в SQL то же, что и properties модели."""
+
+    def setUp(self):
+        self.create_base_objects()
+        self.today = timezone.now().date()
+
+    def _paid(self, start_delta, end_delta):
+        booking = self.create_booking(
+            start_date=self.today + timedelta(days=start_delta),
+            end_date=self.today + timedelta(days=end_delta),
+        )
+        booking.mark_as_paid(f'pi_{booking.pk}')
+        Booking.objects.filter(pk=booking.pk).update(
+            start_date=self.today + timedelta(days=start_delta),
+            end_date=self.today + timedelta(days=end_delta),
+        )
+        return booking
+
+    def test_annotations_match_properties(self):
+        self.create_booking()
+        self._paid(5, 35)     # paid, ещё не начался
+        self._paid(-1, 3)     # active, истекает через 3 дня
+        self._paid(-30, -4)   # overdue 4 дня
+        completed = self._paid(-1, 29)
+        completed.complete()
+
+        annotated = Booking.objects.with_display_status(self.today).order_by('pk')
+        for booking in annotated:
+            plain = Booking.objects.get(pk=booking.pk)
+            self.assertEqual(booking.derived_status, plain.display_status)
+            self.assertEqual(booking.derived_days_remaining, plain.days_remaining)
+            self.assertEqual(booking.derived_days_overdue, plain.days_overdue)
+
+        self.assertEqual(
+            list(annotated.values_list('derived_status', flat=True)),
+            ['pending', 'paid', 'active', 'overdue', 'completed'],
+        )
+
+    def test_filter_and_sort_by_derived_fields(self):
+        later = self._paid(-1, 20)
+        soon = self._paid(-1, 3)
+        overdue = self._paid(-30, -1)
+
+        qs = Booking.objects.with_display_status(self.today)
+        self.assertEqual(
+            set(qs.filter(derived_status='active').values_list('pk', flat=True)),
+            {later.pk, soon.pk},
+        )
+        self.assertEqual(
+            list(qs.occupying().order_by('expiry_priority', 'end_date').values_list('pk', flat=True)),
+            [overdue.pk, soon.pk, later.pk],
+        )
+
+    def test_queryset_filters(self):
+        upcoming = self._paid(5, 35)
+        soon = self._paid(-1, 3)
+        overdue = self._paid(-30, -1)
+
+        self.assertEqual(set(Booking.objects.active(self.today).values_list('pk', flat=True)), {soon.pk})
+        self.assertEqual(set(Booking.objects.overdue(self.today).values_list('pk', flat=True)), {overdue.pk})
+        self.assertEqual(
+            set(Booking.objects.expiring(self.today, days=7).values_list('pk', flat=True)),
+            {soon.pk},
+        )
+        self.assertIn(upcoming.pk, Booking.objects.occupying().values_list('pk', flat=True))
+
+    def test_properties_use_annotation_date(self):
+        booking = self._paid(-1, 3)
+        # Аннотации посчитаны на «завтрашний» день — properties их и вернут
+        annotated = Booking.objects.with_display_status(self.today + timedelta(days=5)).get(pk=booking.pk)
+        self.assertEqual(annotated.display_status, 'overdue')
+        self.assertTrue(annotated.is_overdue)
+        self.assertEqual(annotated.days_overdue, 2)
+        self.assertEqual(annotated.days_remaining, 0)
+
+
 @override_settings(STRIPE_SECRET_KEY='sk_test_1234567890')
 class BookingCreateViewStripeTest(BookingTestMixin, TestCase):
     """BookingCreateView when Stripe is configured (mocked SDK)."""
@@ -1025,7 +1416,7 @@ class BookingCreateViewStripeTest(BookingTestMixin, TestCase):
             'slug': self.tariff.slug,
         })
 
-    @patch('bookings.views.stripe.checkout.Session.create')
+    @patch('bookings.payments.create_checkout_session')
     def test_creates_stripe_session_and_redirects(self, mock_create):
         session_obj = MagicMock()
         session_obj.id = 'cs_test_xyz'
@@ -1053,7 +1444,7 @@ class BookingCreateViewStripeTest(BookingTestMixin, TestCase):
         self.assertEqual(line_item['price_data']['unit_amount'], 70000)
         self.assertEqual(line_item['price_data']['currency'], 'aed')
 
-    @patch('bookings.views.stripe.checkout.Session.create')
+    @patch('bookings.payments.create_checkout_session')
     def test_stripe_error_cancels_booking(self, mock_create):
         import stripe as stripe_lib
         mock_create.side_effect = stripe_lib.error.StripeError('boom')
@@ -1076,7 +1467,7 @@ class BookingCheckoutViewStripeTest(BookingTestMixin, TestCase):
         self.client = Client()
         self.client.force_login(self.user)
 
-    @patch('bookings.views.stripe.checkout.Session.create')
+    @patch('bookings.payments.create_checkout_session')
     def test_checkout_creates_session_and_redirects(self, mock_create):
         booking = self.create_booking()
         session_obj = MagicMock()
@@ -1096,7 +1487,7 @@ class BookingCheckoutViewStripeTest(BookingTestMixin, TestCase):
             mock_create.call_args.kwargs['client_reference_id'], str(booking.pk)
         )
 
-    @patch('bookings.views.stripe.checkout.Session.create')
+    @patch('bookings.payments.create_checkout_session')
     def test_checkout_stripe_error_cancels_booking(self, mock_create):
         import stripe as stripe_lib
         booking = self.create_booking()
@@ -1111,14 +1502,142 @@ class BookingCheckoutViewStripeTest(BookingTestMixin, TestCase):
         self.assertEqual(booking.status, Booking.Status.CANCELLED)
 
 
+    def _open_session(self, booking, **overrides):
+        values = {
+            'id': 'cs_open', 'url': 'https://checkout.stripe.com/pay/cs_open', 'status': 'open',
+            'amount_total': int(booking.total_aed * 100),
+            'expires_at': int((timezone.now() + timedelta(minutes=20)).timestamp()),
+        }
+        values.update(overrides)
+        return MagicMock(**values)
+
+    @patch('bookings.payments.create_checkout_session')
+    @patch('bookings.payments.retrieve_checkout_session')
+    def test_checkout_reuses_open_session(self, mock_retrieve, mock_create):
+        booking = self.create_booking()
+        Booking.objects.filter(pk=booking.pk).update(stripe_session_id='cs_open')
+        mock_retrieve.return_value = self._open_session(booking)
+
+        resp = self.client.get(reverse('booking_checkout', args=[booking.pk]))
+
+        self.assertEqual(resp.url, 'https://checkout.stripe.com/pay/cs_open')
+        mock_retrieve.assert_called_once_with('cs_open')
+        mock_create.assert_not_called()
+
+    @patch('bookings.payments.expire_checkout_session')
+    @patch('bookings.payments.create_checkout_session')
+    @patch('bookings.payments.retrieve_checkout_session')
+    def test_checkout_replaces_stale_session(self, mock_retrieve, mock_create, mock_expire):
+        booking = self.create_booking()
+        Booking.objects.filter(pk=booking.pk).update(stripe_session_id='cs_open')
+        mock_create.return_value = MagicMock(id='cs_new', url='https://checkout.stripe.com/pay/cs_new')
+        url = reverse('booking_checkout', args=[booking.pk])
+
+        # Сумма изменилась — старую сессию закрываем
+        mock_retrieve.return_value = self._open_session(booking, amount_total=1)
+        self.assertEqual(self.client.get(url).url, 'https://checkout.stripe.com/pay/cs_new')
+        mock_expire.assert_called_once_with('cs_open')
+
+        # Сессия уже истекла — закрывать нечего
+        mock_expire.reset_mock()
+        mock_retrieve.return_value = self._open_session(booking, status='expired')
+        self.client.get(url)
+        mock_expire.assert_not_called()
+
+        booking.refresh_from_db()
+        self.assertEqual(booking.stripe_session_id, 'cs_new')
+        # Сессия живёт не дольше, чем позволяет Stripe после истечения брони
+        expires_at = mock_create.call_args.kwargs['expires_at']
+        self.assertLessEqual(expires_at, (timezone.now() + timedelta(minutes=31)).timestamp() + 1)
+        # Stripe не даёт сессию короче 30 минут — бронь дотягивается до неё,
+        # но не дальше предела от создания
+        from .views import CHECKOUT_HOLD_LIMIT
+        self.assertEqual(int(booking.expires_at.timestamp()), expires_at)
+        self.assertLessEqual(booking.expires_at, booking.created_at + CHECKOUT_HOLD_LIMIT)
+
+    @patch('bookings.payments.expire_checkout_session')
+    @patch('bookings.payments.create_checkout_session')
+    @patch('bookings.payments.retrieve_checkout_session')
+    def test_reopening_checkout_does_not_extend_hold(self, mock_retrieve, mock_create, mock_expire):
+        from .views import CHECKOUT_HOLD_LIMIT
+
+        booking = self.create_booking()
+        created_at = timezone.now() - timedelta(minutes=10)
+        expires_at = created_at + CHECKOUT_HOLD_LIMIT
+        Booking.objects.filter(pk=booking.pk).update(
+            created_at=created_at, expires_at=expires_at, stripe_session_id='cs_open',
+        )
+        # Старую сессию не переиспользовать (сумма изменилась), а новая не уместится до конца брони
+        mock_retrieve.return_value = self._open_session(booking, amount_total=1)
+
+        resp = self.client.get(reverse('booking_checkout', args=[booking.pk]))
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertTemplateUsed(resp, 'bookings/cancelled.html')
+        mock_create.assert_not_called()
+        booking.refresh_from_db()
+        self.assertEqual(booking.status, Booking.Status.CANCELLED)
+        self.assertEqual(booking.expires_at, expires_at)
+
+    @patch('bookings.payments.expire_checkout_session')
+    @patch('bookings.payments.create_checkout_session')
+    @patch('bookings.payments.retrieve_checkout_session')
+    def test_checkout_replaces_session_outliving_booking(self, mock_retrieve, mock_create, mock_expire):
+        booking = self.create_booking()
+        Booking.objects.filter(pk=booking.pk).update(stripe_session_id='cs_open')
+        mock_create.return_value = MagicMock(id='cs_new', url='https://checkout.stripe.com/pay/cs_new')
+        mock_retrieve.return_value = self._open_session(
+            booking, expires_at=int((booking.expires_at + timedelta(minutes=5)).timestamp()),
+        )
+
+        resp = self.client.get(reverse('booking_checkout', args=[booking.pk]))
+
+        self.assertEqual(resp.url, 'https://checkout.stripe.com/pay/cs_new')
+        mock_expire.assert_called_once_with('cs_open')
+
+    @patch('bookings.payments.expire_checkout_session')
+    def test_cancel_pending_booking_expires_session(self, mock_expire):
+        booking = self.create_booking(stripe_session_id='cs_open')
+        with self.captureOnCommitCallbacks(execute=True):
+            booking.cancel()
+        mock_expire.assert_called_once_with('cs_open')
+
+        # Отмена уже отменённой брони в Stripe не ходит
+        mock_expire.reset_mock()
+        with self.captureOnCommitCallbacks(execute=True):
+            booking.cancel()
+        mock_expire.assert_not_called()
+
+    @patch('bookings.payments.expire_checkout_session')
+    def test_cancel_expired_expires_sessions(self, mock_expire):
+        import stripe as stripe_lib
+        mock_expire.side_effect = stripe_lib.error.InvalidRequestError('already expired', None)
+        booking = self.create_booking(stripe_session_id='cs_stale')
+        Booking.objects.filter(pk=booking.pk).update(expires_at=timezone.now() - timedelta(minutes=1))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(Booking.cancel_expired(), 1)
+
+        mock_expire.assert_called_once_with('cs_stale')
+        booking.refresh_from_db()
+        self.assertEqual(booking.status, Booking.Status.CANCELLED)
+
 @override_settings(STRIPE_SECRET_KEY='sk_test_1234567890')
 class BookingSuccessViewTest(BookingTestMixin, TestCase):
-    """Fallback: success view marks paid via session_id when webhook hasn't fired."""
+    """Success page renders from local state; status polling reconciles once per interval."""
 
     def setUp(self):
         self.create_base_objects()
         self.client = Client()
         self.client.force_login(self.user)
+        from django.core.cache import cache
+        cache.clear()
+
+    def _pending_with_session(self):
+        booking = self.create_booking()
+        Booking.objects.filter(pk=booking.pk).update(stripe_session_id='cs_111')
+        booking.refresh_from_db()
+        return booking
 
     def test_success_renders_for_already_paid_booking(self):
         booking = self.create_booking()
@@ -1130,54 +1649,84 @@ class BookingSuccessViewTest(BookingTestMixin, TestCase):
         self.assertEqual(resp.status_code, 200)
         self.assertTemplateUsed(resp, 'bookings/success.html')
 
-    @patch('bookings.views.stripe.Charge.retrieve')
-    @patch('bookings.views.stripe.PaymentIntent.retrieve')
-    @patch('bookings.views.stripe.checkout.Session.retrieve')
-    def test_success_marks_pending_as_paid_via_session_id(
-        self, mock_session, mock_pi, mock_charge,
-    ):
-        booking = self.create_booking()
-        mock_session.return_value = MagicMock(
-            payment_status='paid', payment_intent='pi_xyz',
-        )
-        mock_pi.return_value = MagicMock(latest_charge='ch_xyz')
-        mock_charge.return_value = MagicMock(receipt_url='https://receipt/xyz')
+    @patch('bookings.payments.retrieve_checkout_session')
+    def test_success_page_does_not_call_stripe(self, mock_session):
+        booking = self._pending_with_session()
 
         url = reverse('booking_success', args=[booking.pk]) + '?session_id=cs_111'
         resp = self.client.get(url)
+
         self.assertEqual(resp.status_code, 200)
+        self.assertContains(resp, reverse('booking_status', args=[booking.pk]))
+        mock_session.assert_not_called()
+
+    @patch('bookings.payments.retrieve_checkout_session')
+    def test_status_marks_pending_as_paid_via_session(self, mock_session):
+        booking = self._pending_with_session()
+        # payment_intent.latest_charge раскрыты через expand
+        mock_session.return_value = MagicMock(
+            payment_status='paid',
+            payment_intent=MagicMock(id='pi_xyz', latest_charge=MagicMock(receipt_url='https://receipt/xyz')),
+        )
+
+        resp = self.client.get(reverse('booking_status', args=[booking.pk]))
+        self.assertEqual(resp.json(), {'status': 'paid'})
+        mock_session.assert_called_once_with('cs_111')
 
         booking.refresh_from_db()
         self.assertEqual(booking.status, Booking.Status.PAID)
         self.assertEqual(booking.stripe_payment_id, 'pi_xyz')
         self.assertEqual(booking.stripe_receipt_url, 'https://receipt/xyz')
 
-    @patch('bookings.views.stripe.checkout.Session.retrieve')
-    def test_success_does_not_pay_when_session_unpaid(self, mock_session):
-        booking = self.create_booking()
-        mock_session.return_value = MagicMock(
-            payment_status='unpaid', payment_intent=None,
-        )
+    @patch('bookings.payments.retrieve_checkout_session')
+    def test_status_checks_stripe_once_per_interval(self, mock_session):
+        booking = self._pending_with_session()
+        mock_session.return_value = MagicMock(payment_status='unpaid', payment_intent=None)
 
-        url = reverse('booking_success', args=[booking.pk]) + '?session_id=cs_222'
-        resp = self.client.get(url)
-        self.assertEqual(resp.status_code, 200)
+        url = reverse('booking_status', args=[booking.pk])
+        for _ in range(3):
+            self.assertEqual(self.client.get(url).json(), {'status': 'pending'})
 
+        self.assertEqual(mock_session.call_count, 1)
         booking.refresh_from_db()
         self.assertEqual(booking.status, Booking.Status.PENDING)
 
-    @patch('bookings.views.stripe.checkout.Session.retrieve')
-    def test_success_handles_stripe_error_gracefully(self, mock_session):
+    @patch('bookings.payments.retrieve_checkout_session')
+    def test_status_check_throttle_is_shared_between_processes(self, mock_session):
+        from django.core.cache import cache
+        from .services import PAYMENT_CHECK_INTERVAL
+
+        booking = self._pending_with_session()
+        mock_session.return_value = MagicMock(payment_status='unpaid', payment_intent=None)
+        url = reverse('booking_status', args=[booking.pk])
+
+        self.client.get(url)
+        # Другой процесс — свой кэш, но отметка о проверке общая, в БД
+        cache.clear()
+        self.client.get(url)
+        self.assertEqual(mock_session.call_count, 1)
+
+        Booking.objects.filter(pk=booking.pk).update(
+            last_payment_check_at=timezone.now() - timedelta(seconds=PAYMENT_CHECK_INTERVAL + 1),
+        )
+        self.client.get(url)
+        self.assertEqual(mock_session.call_count, 2)
+
+    @patch('bookings.payments.retrieve_checkout_session')
+    def test_status_handles_stripe_error_gracefully(self, mock_session):
         import stripe as stripe_lib
-        booking = self.create_booking()
+        booking = self._pending_with_session()
         mock_session.side_effect = stripe_lib.error.StripeError('down')
 
-        url = reverse('booking_success', args=[booking.pk]) + '?session_id=cs_err'
-        resp = self.client.get(url)
+        resp = self.client.get(reverse('booking_status', args=[booking.pk]))
         self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json(), {'status': 'pending'})
 
-        booking.refresh_from_db()
-        self.assertEqual(booking.status, Booking.Status.PENDING)
+    def test_status_is_private_to_owner(self):
+        booking = self.create_booking()
+        other = User.objects.create_user(email='other-status@example.com', password='x')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(reverse('booking_status', args=[booking.pk])).status_code, 404)
 
 
 class BookingNotificationTest(BookingTestMixin, TestCase):
@@ -1249,10 +1798,9 @@ class StripeWebhookTest(BookingTestMixin, TestCase):
         )
         self.assertEqual(resp.status_code, 400)
 
-    @patch('bookings.views.stripe.Charge.retrieve')
-    @patch('bookings.views.stripe.PaymentIntent.retrieve')
+    @patch('bookings.payments.retrieve_payment_intent')
     @patch('bookings.views.stripe.Webhook.construct_event')
-    def test_marks_booking_as_paid(self, mock_construct, mock_pi, mock_charge):
+    def test_marks_booking_as_paid(self, mock_construct, mock_pi):
         booking = self.create_booking()
         mock_construct.return_value = {
             'id': 'evt_paid_1',
@@ -1262,13 +1810,14 @@ class StripeWebhookTest(BookingTestMixin, TestCase):
                 'payment_intent': 'pi_webhook_1',
             }},
         }
-        mock_pi.return_value = MagicMock(latest_charge='ch_w_1')
-        mock_charge.return_value = MagicMock(receipt_url='https://receipt/w1')
+        mock_pi.return_value = MagicMock(id='pi_webhook_1', latest_charge=MagicMock(receipt_url='https://receipt/w1'))
 
-        resp = self.client.post(
-            self.url, data=b'{}', content_type='application/json',
-            HTTP_STRIPE_SIGNATURE='t=1,v1=ok',
-        )
+        # Обработка идёт из очереди после коммита
+        with self.captureOnCommitCallbacks(execute=True):
+            resp = self.client.post(
+                self.url, data=b'{}', content_type='application/json',
+                HTTP_STRIPE_SIGNATURE='t=1,v1=ok',
+            )
         self.assertEqual(resp.status_code, 200)
         self.assertEqual(resp.json()['status'], 'ok')
 
@@ -1277,10 +1826,9 @@ class StripeWebhookTest(BookingTestMixin, TestCase):
         self.assertEqual(booking.stripe_payment_id, 'pi_webhook_1')
         self.assertEqual(booking.stripe_receipt_url, 'https://receipt/w1')
 
-    @patch('bookings.views.stripe.Charge.retrieve')
-    @patch('bookings.views.stripe.PaymentIntent.retrieve')
+    @patch('bookings.payments.retrieve_payment_intent')
     @patch('bookings.views.stripe.Webhook.construct_event')
-    def test_idempotent_same_event_id(self, mock_construct, mock_pi, mock_charge):
+    def test_idempotent_same_event_id(self, mock_construct, mock_pi):
         booking = self.create_booking()
         mock_construct.return_value = {
             'id': 'evt_same_id',
@@ -1290,13 +1838,13 @@ class StripeWebhookTest(BookingTestMixin, TestCase):
                 'payment_intent': 'pi_idem_1',
             }},
         }
-        mock_pi.return_value = MagicMock(latest_charge='ch_i_1')
-        mock_charge.return_value = MagicMock(receipt_url='https://receipt/i1')
+        mock_pi.return_value = MagicMock(id='pi_idem_1', latest_charge=MagicMock(receipt_url='https://receipt/i1'))
 
-        resp1 = self.client.post(
-            self.url, data=b'{}', content_type='application/json',
-            HTTP_STRIPE_SIGNATURE='t=1,v1=ok',
-        )
+        with self.captureOnCommitCallbacks(execute=True):
+            resp1 = self.client.post(
+                self.url, data=b'{}', content_type='application/json',
+                HTTP_STRIPE_SIGNATURE='t=1,v1=ok',
+            )
         self.assertEqual(resp1.status_code, 200)
         booking.refresh_from_db()
         self.assertEqual(booking.status, Booking.Status.PAID)
@@ -1306,7 +1854,7 @@ class StripeWebhookTest(BookingTestMixin, TestCase):
             HTTP_STRIPE_SIGNATURE='t=1,v1=ok',
         )
         self.assertEqual(resp2.status_code, 200)
-        self.assertEqual(resp2.json()['status'], 'already processed')
+        self.assertEqual(resp2.json()['status'], 'already received')
 
     @patch('bookings.views.stripe.Webhook.construct_event')
     def test_handles_unknown_booking_id(self, mock_construct):
@@ -1341,10 +1889,9 @@ class StripeWebhookTest(BookingTestMixin, TestCase):
         booking.refresh_from_db()
         self.assertEqual(booking.status, Booking.Status.PENDING)
 
-    @patch('bookings.views.stripe.Charge.retrieve')
-    @patch('bookings.views.stripe.PaymentIntent.retrieve')
+    @patch('bookings.payments.retrieve_payment_intent')
     @patch('bookings.views.stripe.Webhook.construct_event')
-    def test_does_not_repay_already_paid_booking(self, mock_construct, mock_pi, mock_charge):
+    def test_does_not_repay_already_paid_booking(self, mock_construct, mock_pi):
         booking = self.create_booking()
         booking.mark_as_paid('pi_first')
         booking.refresh_from_db()
@@ -1357,13 +1904,13 @@ class StripeWebhookTest(BookingTestMixin, TestCase):
                 'payment_intent': 'pi_second',
             }},
         }
-        mock_pi.return_value = MagicMock(latest_charge='ch_x')
-        mock_charge.return_value = MagicMock(receipt_url='https://receipt/x')
+        mock_pi.return_value = MagicMock(id='pi_second', latest_charge=MagicMock(receipt_url='https://receipt/x'))
 
-        resp = self.client.post(
-            self.url, data=b'{}', content_type='application/json',
-            HTTP_STRIPE_SIGNATURE='t=1,v1=ok',
-        )
+        with self.captureOnCommitCallbacks(execute=True):
+            resp = self.client.post(
+                self.url, data=b'{}', content_type='application/json',
+                HTTP_STRIPE_SIGNATURE='t=1,v1=ok',
+            )
         self.assertEqual(resp.status_code, 200)
         booking.refresh_from_db()
         self.assertEqual(booking.stripe_payment_id, 'pi_first')
@@ -1533,3 +2080,263 @@ class BookingNumberTest(BookingTestMixin, TestCase):
     def test_str_includes_number(self):
         booking = self.create_booking()
         self.assertIn(f'#{booking.number}', str(booking))
+
+
+@override_settings(STRIPE_SECRET_KEY='sk_test_1234567890', STRIPE_WEBHOOK_SECRET='whsec_test')
+class StripeWebhookQueueTest(BookingTestMixin, TestCase):
+    """Вебхук сохраняет событие и отвечает сразу; обработка — из очереди StripeEvent."""
+
+    def setUp(self):
+        self.create_base_objects()
+        self.booking = self.create_booking()
+        self.booking.assign_storage_units()
+
+    def _event(self, event_id='evt_1', booking=None, event_type='checkout.session.completed'):
+        booking = booking or self.booking
+        return {
+            'id': event_id,
+            'type': event_type,
+            'data': {'object': {
+                'client_reference_id': str(booking.pk),
+                'payment_intent': 'pi_hook',
+            }},
+        }
+
+    def _post(self, event):
+        with patch('bookings.views.stripe.Webhook.construct_event', return_value=event):
+            return self.client.post(
+                reverse('stripe_webhook'), data=json.dumps(event),
+                content_type='application/json', HTTP_STRIPE_SIGNATURE='t=1,v1=x',
+            )
+
+    @patch('bookings.payments.retrieve_payment_intent')
+    def test_webhook_queues_and_worker_pays(self, mock_pi):
+        from bookings.models import StripeEvent
+
+        mock_pi.return_value = MagicMock(id='pi_hook', latest_charge=MagicMock(receipt_url='https://receipt/hook'))
+
+        # Запрос вебхука не ходит в Stripe и не платит бронь
+        with patch('bookings.views.dispatch_stripe_events') as dispatch:
+            resp = self._post(self._event())
+        self.assertEqual(resp.json(), {'status': 'ok'})
+        dispatch.assert_called_once()
+        mock_pi.assert_not_called()
+        event = StripeEvent.objects.get(event_id='evt_1')
+        self.assertEqual((event.status, event.booking_ref), (StripeEvent.Status.PENDING, self.booking.pk))
+
+        from bookings.services import process_pending_events
+        self.assertEqual(process_pending_events(), 1)
+
+        event.refresh_from_db()
+        self.assertEqual(event.status, StripeEvent.Status.DONE)
+        self.assertEqual(event.attempts, 1)
+        self.assertIsNotNone(event.duration_ms)
+        self.booking.refresh_from_db()
+        self.assertEqual(self.booking.status, Booking.Status.PAID)
+        self.assertEqual(self.booking.stripe_receipt_url, 'https://receipt/hook')
+
+    @patch('bookings.payments.retrieve_payment_intent', return_value=MagicMock(id='pi_hook', latest_charge=None))
+    def test_redelivery_is_not_processed_twice(self, mock_pi):
+        from bookings.models import StripeEvent
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self._post(self._event()).json(), {'status': 'ok'})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self._post(self._event()).json(), {'status': 'already received'})
+        self.assertEqual(StripeEvent.objects.count(), 1)
+        self.assertEqual(mock_pi.call_count, 1)
+
+    def test_unhandled_event_type_is_stored_as_ignored(self):
+        from bookings.models import StripeEvent
+
+        self._post(self._event(event_type='customer.created'))
+        self.assertEqual(StripeEvent.objects.get().status, StripeEvent.Status.IGNORED)
+
+    def test_events_of_one_booking_are_claimed_in_order(self):
+        from bookings.services import claim_stripe_events, record_stripe_event
+
+        other = self.create_booking()
+        first, _ = record_stripe_event(self._event('evt_a'))
+        second, _ = record_stripe_event(self._event('evt_b'))
+        third, _ = record_stripe_event(self._event('evt_c', booking=other))
+
+        claimed = claim_stripe_events()
+        self.assertEqual([e.event_id for e in claimed], ['evt_a', 'evt_c'])
+        # evt_b ждёт, пока evt_a в работе
+        self.assertEqual(claim_stripe_events(), [])
+
+    def test_failed_event_retries_with_backoff(self):
+        from bookings.models import StripeEvent
+        from bookings.services import MAX_ATTEMPTS, claim_stripe_events, process_stripe_event, record_stripe_event
+
+        record_stripe_event(self._event())
+        with patch.object(Booking, 'mark_as_paid', side_effect=RuntimeError('db down')), \
+                patch('bookings.payments.retrieve_payment_intent', return_value=MagicMock(id='pi_hook', latest_charge=None)), \
+                self.assertLogs('bookings.services', 'ERROR'):
+            event = claim_stripe_events()[0]
+            self.assertEqual(process_stripe_event(event), StripeEvent.Status.PENDING)
+            event.refresh_from_db()
+            self.assertIn('db down', event.error)
+            self.assertGreater(event.next_attempt_at, timezone.now())
+            self.assertEqual(claim_stripe_events(), [])
+
+            StripeEvent.objects.filter(pk=event.pk).update(attempts=MAX_ATTEMPTS - 1, next_attempt_at=timezone.now())
+            event = claim_stripe_events()[0]
+            self.assertEqual(process_stripe_event(event), StripeEvent.Status.FAILED)
+
+
+class StubStripeHandler(BaseHTTPRequestHandler):
+    """Локальный stub Stripe API: фиксированные ответы, журнал запросов."""
+
+    protocol_version = 'HTTP/1.1'  # keep-alive — проверяем переиспользование соединения
+
+    def _respond(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self):
+        self.server.requests.append((self.command, self.path, self.client_address[1]))
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+        path = self.path.split('?')[0]
+        if path in self.server.objects and self.command == 'GET':
+            self._respond(200, self._list_page(path))
+        elif path == '/v1/checkout/sessions' and self.command == 'POST':
+            self._respond(200, {'id': 'cs_stub', 'object': 'checkout.session', 'url': 'https://pay/cs_stub'})
+        elif path == '/v1/checkout/sessions/cs_stub':
+            self._respond(200, {
+                'id': 'cs_stub', 'object': 'checkout.session', 'payment_status': 'paid',
+                'payment_intent': {
+                    'id': 'pi_stub', 'object': 'payment_intent',
+                    'latest_charge': {'id': 'ch_stub', 'object': 'charge', 'receipt_url': 'https://receipt/stub'},
+                },
+            })
+        else:
+            self._respond(500, {'error': {'type': 'api_error', 'message': 'stub outage'}})
+
+    def _list_page(self, path):
+        query = parse_qs(urlsplit(self.path).query)
+        gte, lt = int(query['created[gte]'][0]), int(query['created[lt]'][0])
+        objects = [obj for obj in self.server.objects[path] if gte <= obj['created'] < lt]
+        if 'starting_after' in query:
+            ids = [obj['id'] for obj in objects]
+            objects = objects[ids.index(query['starting_after'][0]) + 1:]
+        # Страницы по 2 — проверяем, что клиент листает сам
+        return {'object': 'list', 'url': path, 'data': objects[:2], 'has_more': len(objects) > 2}
+
+    do_GET = do_POST = _handle
+
+    def log_message(self, *args):
+        pass
+
+
+class StripeClientStubServerTest(BookingTestMixin, TestCase):
+    """bookings.payments против локального stub-сервера, без моков SDK."""
+
+    def setUp(self):
+        from bookings import payments
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubStripeHandler)
+        self.server.requests = []
+        self.server.objects = {}
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        self.enterContext(override_settings(
+            STRIPE_SECRET_KEY='sk_test_stub',
+            STRIPE_API_BASE=f'http://127.0.0.1:{self.server.server_port}',
+            STRIPE_MAX_NETWORK_RETRIES=0,
+            STRIPE_BREAKER_THRESHOLD=2,
+            STRIPE_BREAKER_RESET_SECONDS=60,
+        ))
+        payments.reset()
+        self.addCleanup(payments.reset)
+        self.payments = payments
+
+    def test_receipt_in_one_request_over_one_connection(self):
+        session = self.payments.create_checkout_session(mode='payment', client_reference_id='1')
+        self.assertEqual(session.url, 'https://pay/cs_stub')
+
+        session = self.payments.retrieve_checkout_session('cs_stub')
+        self.assertEqual(
+            self.payments.payment_details(session.payment_intent), ('pi_stub', 'https://receipt/stub'),
+        )
+
+        methods = [(method, path.split('?')[0]) for method, path, _port in self.server.requests]
+        self.assertEqual(methods, [('POST', '/v1/checkout/sessions'), ('GET', '/v1/checkout/sessions/cs_stub')])
+        self.assertIn('expand', self.server.requests[1][1])
+        # Оба запроса прошли по одному keep-alive соединению
+        self.assertEqual(len({port for _m, _p, port in self.server.requests}), 1)
+        self.assertGreaterEqual(histogram('stripe.checkout_session_retrieve').snapshot()['count'], 1)
+
+    def test_breaker_opens_after_repeated_outages(self):
+        import stripe as stripe_lib
+
+        for _ in range(2):
+            with self.assertRaises(stripe_lib.error.APIError):
+                self.payments.retrieve_payment_intent('pi_down')
+        self.assertTrue(self.payments.get_breaker().is_open)
+
+        with self.assertRaises(self.payments.StripeUnavailable):
+            self.payments.retrieve_payment_intent('pi_down')
+        # Третий вызов до сервера не дошёл
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_reconcile_marks_missed_payments_and_backfills_receipts(self):
+        from io import StringIO
+
+        from django.core.management import call_command
+
+        self.create_base_objects()
+        missed = self.create_booking()
+        no_receipt = self.create_booking()
+        no_receipt.mark_as_paid('pi_b')
+        cancelled = self.create_booking()
+        cancelled.cancel()
+        Booking.objects.filter(pk=missed.pk).update(stripe_session_id='cs_a')
+
+        created = int(timezone.now().timestamp())
+
+        def charge(charge_id):
+            return {'id': charge_id, 'object': 'charge', 'receipt_url': f'https://receipt/{charge_id}'}
+
+        def session(session_id, booking, status='paid', intent=None):
+            return {
+                'id': session_id, 'object': 'checkout.session', 'created': created,
+                'payment_status': status, 'client_reference_id': str(booking.pk), 'payment_intent': intent,
+            }
+
+        self.server.objects = {
+            '/v1/checkout/sessions': [
+                session('cs_a', missed, intent={'id': 'pi_a', 'object': 'payment_intent', 'latest_charge': charge('ch_a')}),
+                session('cs_c', cancelled, intent='pi_c'),
+                session('cs_open', missed, status='unpaid'),
+            ],
+            '/v1/payment_intents': [
+                {'id': 'pi_b', 'object': 'payment_intent', 'created': created, 'latest_charge': charge('ch_b')},
+            ],
+        }
+
+        out = StringIO()
+        call_command('reconcile_stripe_payments', '--days', '1', '--workers', '2', stdout=out)
+
+        missed.refresh_from_db()
+        self.assertEqual(missed.status, Booking.Status.PAID)
+        self.assertEqual((missed.stripe_payment_id, missed.stripe_receipt_url), ('pi_a', 'https://receipt/ch_a'))
+        no_receipt.refresh_from_db()
+        self.assertEqual(no_receipt.stripe_receipt_url, 'https://receipt/ch_b')
+        cancelled.refresh_from_db()
+        self.assertEqual(cancelled.status, Booking.Status.CANCELLED)
+        self.assertIn('1 paid session(s) belong to cancelled bookings', out.getvalue())
+
+        # 3 сессии при странице в 2 — вторая страница запрошена через starting_after
+        session_pages = [path for method, path, _port in self.server.requests if path.startswith('/v1/checkout/sessions?')]
+        self.assertTrue(any('starting_after=cs_c' in path for path in session_pages))
+        self.assertTrue(all('expand' in path for path in session_pages))
@@ -22,6 +22,11 @@ urlpatterns = [
         views.BookingSuccessView.as_view(),
         name='booking_success'
     ),
+    path(
+        'status/<int:pk>/',
+        views.BookingStatusView.as_view(),
+        name='booking_status'
+    ),
     path(
         'cancel/<int:pk>/',
         views.BookingCancelView.as_view(),
@@ -6,21 +6,50 @@ from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 from django.urls import reverse
 from django.conf import settings
+from django.db import IntegrityError, transaction
 from django.utils import timezone
+from datetime import timedelta
 
-from services.models import Service, Tariff, TariffPeriod, AddonService
-from .models import Booking, BookingAddon
+from services.models import Tariff, TariffPeriod, AddonService
+from .models import Booking, BookingAddon, StripeEvent
+from . import payments
+from .services import check_payment_once, dispatch_stripe_events, record_stripe_event
 
 import stripe
 
 
 def is_stripe_configured():
     """Проверяет, настроен ли Stripe с реальными ключами"""
-    return (
-            settings.STRIPE_SECRET_KEY and
-            settings.STRIPE_SECRET_KEY.startswith('sk_') and
-            len(settings.STRIPE_SECRET_KEY) > 10
+    return payments.is_configured()
+
+
+# Дальше этого от создания бронь под сессию Stripe не продлевается: минимум
+# сессии (с запасом) плюс минута на сам запрос создания
+CHECKOUT_HOLD_LIMIT = payments.SESSION_MIN_TTL + timedelta(minutes=1)
+
+
+def session_expires_at(booking, now=None):
+    """expires_at новой Checkout Session или None, если сессия уже не уместится.
+
+    Stripe не принимает сессию короче 30 минут, а бронь живёт 30 минут от
+    создания, поэтому при создании срок брони дотягивается до сессии — но не
+    дальше created_at + CHECKOUT_HOLD_LIMIT. Повторное открытие оплаты срок
+    не продлевает: иначе бронь держала бы юниты без оплаты бесконечно.
+    Сохраняет вызывающий — вместе с stripe_session_id.
+    """
+    now = now or timezone.now()
+    deadline = max(
+        booking.expires_at,
+        min(now + payments.SESSION_MIN_TTL, booking.created_at + CHECKOUT_HOLD_LIMIT),
     )
+    if deadline < now + payments.SESSION_MIN_TTL:
+        return None
+    booking.expires_at = deadline
+    return payments.session_expiry(deadline, now)
+
+
+# Сколько повторная отправка формы с тем же токеном ведёт на исходную бронь
+IDEMPOTENCY_WINDOW = timedelta(minutes=30)
 
 
 class BookingCreateView(LoginRequiredMixin, View):
@@ -35,9 +64,23 @@ class BookingCreateView(LoginRequiredMixin, View):
         return redirect('tariff_detail', service_type=service_type, slug=slug)
 
     def post(self, request, service_type, slug):
-        # Получить тариф
-        service = get_object_or_404(Service, service_type=service_type, is_active=True)
-        tariff = get_object_or_404(Tariff, service=service, slug=slug, is_active=True)
+        # Повторная отправка той же формы — на исходную бронь, без проверок
+        # доступности: последнее место могла занять как раз она
+        idempotency_key = request.POST.get('idempotency_key', '')[:64]
+        if idempotency_key:
+            existing = self._submitted_booking(request.user, idempotency_key)
+            if existing is not None:
+                return self._redirect_to(existing)
+
+        # Тариф вместе с service и location — снепшоты брони возьмут их без запросов
+        tariff = get_object_or_404(
+            Tariff.objects.select_related('service', 'location'),
+            service__service_type=service_type,
+            service__is_active=True,
+            slug=slug,
+            is_active=True,
+        )
+        service = tariff.service
 
         # Получить данные формы
         period_id = request.POST.get('period')
@@ -58,15 +101,12 @@ class BookingCreateView(LoginRequiredMixin, View):
         # Валидация периода
         period = get_object_or_404(TariffPeriod, id=period_id, tariff=tariff, is_active=True)
 
-        # Валидация обязательных политик (только ещё не принятые)
+        # Валидация обязательных политик (только ещё не принятые) — из кэша согласий
         from policies.models import Policy, PolicyConsent
-        required_policies = Policy.objects.filter(is_active=True, is_required=True)
-        already_accepted_ids = set(
-            PolicyConsent.objects.filter(user=request.user)
-            .values_list('policy_id', flat=True)
-        )
-        unaccepted_policies = required_policies.exclude(id__in=already_accepted_ids)
-        if unaccepted_policies.exists():
+        # Версию читаем один раз — и для проверки, и для сброса кэша согласий
+        policy_version = Policy.version()
+        unaccepted_policies = Policy.unaccepted_by(request.user, policy_version)
+        if unaccepted_policies:
             accepted_ids = set(request.POST.getlist('accepted_policies'))
             required_ids = set(str(p.id) for p in unaccepted_policies)
             if not required_ids.issubset(accepted_ids):
@@ -75,7 +115,7 @@ class BookingCreateView(LoginRequiredMixin, View):
                 return redirect('tariff_detail', service_type=service_type, slug=slug)
 
         # Проверить доступность мест (для N машин)
-        if tariff.available_units < quantity:
+        if not tariff.has_available_units(quantity):
             return render(request, 'bookings/no_availability.html', {
                 'tariff': tariff,
                 'service': service,
@@ -100,46 +140,59 @@ class BookingCreateView(LoginRequiredMixin, View):
         # Дата начала
         start_date = timezone.now().date()
 
-        # Создать бронирование
-        booking = Booking.objects.create(
-            user=request.user,
-            tariff=tariff,
-            period=period,
-            start_date=start_date,
-            quantity=quantity,
-            unit_price_aed=unit_price_aed,
-            price_aed=price_aed,
-            addons_aed=addons_aed,
-            deposit_aed=deposit_aed,
-            total_aed=total_aed,
-        )
-
-        # Записать согласие с политиками
-        if unaccepted_policies.exists():
-            for policy in unaccepted_policies:
-                PolicyConsent.objects.update_or_create(
+        # Бронь, аддоны и согласия — одной транзакцией, пачками.
+        # Уникальный (user, idempotency_key) в БД: параллельный дубль
+        # упрётся в индекс и уйдёт на исходную бронь
+        try:
+            with transaction.atomic():
+                booking = Booking.objects.create(
                     user=request.user,
-                    policy=policy,
-                    defaults={'ip_address': request.META.get('REMOTE_ADDR')}
+                    tariff=tariff,
+                    period=period,
+                    start_date=start_date,
+                    quantity=quantity,
+                    unit_price_aed=unit_price_aed,
+                    price_aed=price_aed,
+                    addons_aed=addons_aed,
+                    deposit_aed=deposit_aed,
+                    total_aed=total_aed,
+                    idempotency_key=idempotency_key,
                 )
-
-        # Сохранить аддоны
-        for addon in selected_addons:
-            BookingAddon.objects.create(
-                booking=booking,
-                addon=addon,
-                price_aed=addon.price_aed
-            )
+                BookingAddon.objects.bulk_create([
+                    BookingAddon(booking=booking, addon=addon, price_aed=addon.price_aed)
+                    for addon in selected_addons
+                ])
+                # Согласие, принятое параллельно в другой вкладке, не дублируем
+                PolicyConsent.objects.bulk_create([
+                    PolicyConsent(
+                        user=request.user,
+                        policy=policy,
+                        ip_address=request.META.get('REMOTE_ADDR'),
+                    )
+                    for policy in unaccepted_policies
+                ], ignore_conflicts=True)
+        except IntegrityError:
+            existing = idempotency_key and self._submitted_booking(request.user, idempotency_key)
+            if not existing:
+                raise
+            return self._redirect_to(existing)
+
+        # bulk_create не вызывает save() — сбросить кэш согласий явно
+        if unaccepted_policies:
+            PolicyConsent.forget(request.user.pk, policy_version)
 
         # Если Stripe не настроен — mock режим
         if not is_stripe_configured():
             return redirect('booking_mock_payment', pk=booking.pk)
 
-        # Создать Stripe Checkout Session
-        stripe.api_key = settings.STRIPE_SECRET_KEY
+        expires_at = session_expires_at(booking)
+        if expires_at is None:
+            booking.cancel()
+            return render(request, 'bookings/cancelled.html', {'booking': booking, 'expired': True})
 
+        # Создать Stripe Checkout Session
         try:
-            checkout_session = stripe.checkout.Session.create(
+            checkout_session = payments.create_checkout_session(
                 payment_method_types=['card'],
                 line_items=[{
                     'price_data': {
@@ -161,6 +214,7 @@ class BookingCreateView(LoginRequiredMixin, View):
                 ),
                 client_reference_id=str(booking.pk),
                 customer_email=request.user.email,
+                expires_at=expires_at,
                 metadata={
                     'booking_id': booking.pk,
                     'booking_number': booking.number,
@@ -168,7 +222,7 @@ class BookingCreateView(LoginRequiredMixin, View):
             )
 
             booking.stripe_session_id = checkout_session.id
-            booking.save(update_fields=['stripe_session_id'])
+            booking.save(update_fields=['stripe_session_id', 'expires_at', 'updated_at'])
 
             return redirect(checkout_session.url)
 
@@ -180,6 +234,28 @@ class BookingCreateView(LoginRequiredMixin, View):
             })
 
 
+    @staticmethod
+    def _submitted_booking(user, idempotency_key):
+        """Бронь, уже созданная этой формой в пределах окна (или None).
+
+        Ключ старше окна освобождается — форма, открытая давно, создаёт новую бронь.
+        """
+        cutoff = timezone.now() - IDEMPOTENCY_WINDOW
+        Booking.objects.filter(
+            user=user, idempotency_key=idempotency_key, created_at__lt=cutoff,
+        ).update(idempotency_key='')
+        return Booking.objects.filter(user=user, idempotency_key=idempotency_key).first()
+
+    @staticmethod
+    def _redirect_to(booking):
+        """Куда вёл бы исходный запрос: оплата (сессия переиспользуется), успех или отмена."""
+        if booking.status == Booking.Status.PENDING:
+            return redirect('booking_checkout', pk=booking.pk)
+        if booking.status == Booking.Status.CANCELLED:
+            return redirect('booking_cancel', pk=booking.pk)
+        return redirect('booking_success', pk=booking.pk)
+
+
 class BookingCheckoutView(LoginRequiredMixin, View):
     """Повторная оплата pending бронирования через Stripe"""
 
@@ -198,11 +274,24 @@ class BookingCheckoutView(LoginRequiredMixin, View):
         if not is_stripe_configured():
             return redirect('booking_mock_payment', pk=booking.pk)
 
-        # Создать новую Stripe Checkout Session
-        stripe.api_key = settings.STRIPE_SECRET_KEY
+        # Открытая сессия на ту же сумму — вернуть клиента в неё, без новой
+        reusable = self._reusable_session(booking)
+        if reusable is not None:
+            return redirect(reusable.url)
 
+        # Новую сессию короче минимума Stripe не создать, а продлевать бронь
+        # ради неё нельзя — бронь истекает
+        expires_at = session_expires_at(booking)
+        if expires_at is None:
+            booking.cancel()
+            return render(request, 'bookings/cancelled.html', {
+                'booking': booking,
+                'expired': True,
+            })
+
+        # Создать новую Stripe Checkout Session
         try:
-            checkout_session = stripe.checkout.Session.create(
+            checkout_session = payments.create_checkout_session(
                 payment_method_types=['card'],
                 line_items=[{
                     'price_data': {
@@ -225,6 +314,7 @@ class BookingCheckoutView(LoginRequiredMixin, View):
                 ),
                 client_reference_id=str(booking.pk),
                 customer_email=request.user.email,
+                expires_at=expires_at,
                 metadata={
                     'booking_id': booking.pk,
                     'booking_number': booking.number,
@@ -232,7 +322,7 @@ class BookingCheckoutView(LoginRequiredMixin, View):
             )
 
             booking.stripe_session_id = checkout_session.id
-            booking.save(update_fields=['stripe_session_id'])
+            booking.save(update_fields=['stripe_session_id', 'expires_at', 'updated_at'])
 
             return redirect(checkout_session.url)
 
@@ -243,6 +333,35 @@ class BookingCheckoutView(LoginRequiredMixin, View):
                 'tariff': booking.tariff,
             })
 
+    @staticmethod
+    def _reusable_session(booking):
+        """Текущая сессия брони, если по ней ещё можно заплатить ту же сумму.
+
+        Устаревшую, но открытую сессию (сумма изменилась или сессия
+        переживает бронь) закрываем, чтобы по старой ссылке нельзя было
+        оплатить параллельно.
+        """
+        if not booking.stripe_session_id:
+            return None
+        try:
+            session = payments.retrieve_checkout_session(booking.stripe_session_id)
+        except stripe.error.StripeError:
+            # Не смогли проверить — безопаснее создать новую
+            return None
+        if session.status != 'open':
+            return None
+        # Минута запаса: клиент не должен попасть на истекающую на глазах страницу.
+        # Сессия, живущая дольше брони, позволила бы оплатить отменённую бронь.
+        fresh = session.expires_at > (timezone.now() + timedelta(minutes=1)).timestamp()
+        within_booking = session.expires_at <= booking.expires_at.timestamp()
+        if fresh and within_booking and session.amount_total == int(booking.total_aed * 100):
+            return session
+        try:
+            payments.expire_checkout_session(session.id)
+        except stripe.error.StripeError:
+            pass
+        return None
+
 
 class BookingMockPaymentView(LoginRequiredMixin, View):
     """Mock страница оплаты — только при выключенном Stripe"""
@@ -287,38 +406,34 @@ class BookingMockPaymentView(LoginRequiredMixin, View):
 
 
 class BookingSuccessView(LoginRequiredMixin, View):
-    """Страница успешной оплаты"""
+    """Страница успешной оплаты.
+
+    Рендерится сразу из локального состояния — без запросов в Stripe.
+    Пока вебхук не дошёл, страница опрашивает BookingStatusView.
+    """
 
     def get(self, request, pk):
         booking = get_object_or_404(Booking, pk=pk, user=request.user)
 
-        # Проверить оплату через Stripe (если webhook ещё не сработал)
-        if booking.status == Booking.Status.PENDING and is_stripe_configured():
-            stripe.api_key = settings.STRIPE_SECRET_KEY
-            session_id = request.GET.get('session_id')
-
-            if session_id:
-                try:
-                    session = stripe.checkout.Session.retrieve(session_id)
-                    if session.payment_status == 'paid':
-                        receipt_url = ''
-                        if session.payment_intent:
-                            try:
-                                pi = stripe.PaymentIntent.retrieve(session.payment_intent)
-                                if pi.latest_charge:
-                                    charge = stripe.Charge.retrieve(pi.latest_charge)
-                                    receipt_url = charge.receipt_url or ''
-                            except stripe.error.StripeError:
-                                pass
-                        booking.mark_as_paid(session.payment_intent, receipt_url)
-                except stripe.error.StripeError:
-                    pass
-
         return render(request, 'bookings/success.html', {
             'booking': booking,
         })
 
 
+class BookingStatusView(LoginRequiredMixin, View):
+    """JSON-статус брони для опроса со страницы успеха"""
+
+    def get(self, request, pk):
+        booking = get_object_or_404(Booking, pk=pk, user=request.user)
+
+        # Вебхук ещё не дошёл — одна проверка сессии на бронь за интервал
+        if booking.status == Booking.Status.PENDING and is_stripe_configured():
+            check_payment_once(booking)
+            booking.refresh_from_db(fields=['status'])
+
+        return JsonResponse({'status': booking.status})
+
+
 class BookingCancelView(LoginRequiredMixin, View):
     """Отмена бронирования"""
 
@@ -344,8 +459,6 @@ class StripeWebhookView(View):
         payload = request.body
         sig_header = request.META.get('HTTP_STRIPE_SIGNATURE')
 
-        stripe.api_key = settings.STRIPE_SECRET_KEY
-
         try:
             event = stripe.Webhook.construct_event(
                 payload, sig_header, settings.STRIPE_WEBHOOK_SECRET
@@ -355,40 +468,12 @@ class StripeWebhookView(View):
         except stripe.error.SignatureVerificationError:
             return HttpResponseBadRequest('Invalid signature')
 
-        # Дедупликация: проверяем event ID через кэш
-        from django.core.cache import cache
-        event_id = event.get('id', '')
-        cache_key = f'stripe_event_{event_id}'
-        if event_id and cache.get(cache_key):
-            return JsonResponse({'status': 'already processed'})
-
-        if event['type'] == 'checkout.session.completed':
-            session = event['data']['object']
-            booking_id = session.get('client_reference_id')
-
-            if booking_id:
-                try:
-                    booking = Booking.objects.get(pk=booking_id)
-                    if booking.status == Booking.Status.PENDING:
-                        payment_intent_id = session.get('payment_intent', '')
-                        receipt_url = ''
-
-                        # Достать receipt_url из charge
-                        if payment_intent_id:
-                            try:
-                                pi = stripe.PaymentIntent.retrieve(payment_intent_id)
-                                if pi.latest_charge:
-                                    charge = stripe.Charge.retrieve(pi.latest_charge)
-                                    receipt_url = charge.receipt_url or ''
-                            except stripe.error.StripeError:
-                                pass
-
-                        booking.mark_as_paid(payment_intent_id, receipt_url)
-                except Booking.DoesNotExist:
-                    pass
-
-        # Сохранить event ID в кэш на 48 часов
-        if event_id:
-            cache.set(cache_key, True, 48 * 3600)
+        # Только сохранить событие — Stripe не ждёт запросов к API и mark_as_paid.
+        # Уникальный event_id заменяет прежнюю дедупликацию через кэш.
+        stripe_event, created = record_stripe_event(event)
+        if not created:
+            return JsonResponse({'status': 'already received'})
+        if stripe_event.status == StripeEvent.Status.PENDING:
+            dispatch_stripe_events()
 
         return JsonResponse({'status': 'ok'})
\ No newline at end of file
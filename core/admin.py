@@ -0,0 +1,20 @@
+from django.contrib import admin
+
+from .models import IdempotencyKey, ScheduledJob
+
+
+@admin.register(ScheduledJob)
+class ScheduledJobAdmin(admin.ModelAdmin):
+    list_display = ['name', 'next_run_at', 'last_finished_at', 'last_duration_ms', 'run_count', 'failure_count', 'locked_by']
+    readonly_fields = [
+        'name', 'last_started_at', 'last_finished_at', 'last_duration_ms',
+        'last_error', 'run_count', 'failure_count', 'locked_by', 'locked_until',
+    ]
+
+
+@admin.register(IdempotencyKey)
+class IdempotencyKeyAdmin(admin.ModelAdmin):
+    list_display = ['scope', 'key', 'processed_at']
+    list_filter = ['scope']
+    search_fields = ['key']
+    readonly_fields = ['scope', 'key', 'processed_at']
@@ -0,0 +1,27 @@
+"""Хелперы для массовых операций с БД короткими транзакциями."""
+import time
+
+from django.db import transaction
+
+
+def delete_in_chunks(queryset, batch_size=1000, pause=0.0):
+    """Удалить строки queryset пачками по PK. Возвращает число удалённых строк.
+
+    Каждая пачка — отдельная короткая транзакция: блокировки держатся
+    недолго, а реплики/autovacuum успевают за удалением. `pause` — сон
+    между пачками (секунды), чтобы не забивать диск на проде.
+    """
+    model = queryset.model
+    total = 0
+    while True:
+        pks = list(queryset.order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            break
+        with transaction.atomic():
+            model._base_manager.filter(pk__in=pks).delete()
+        total += len(pks)
+        if len(pks) < batch_size:
+            break
+        if pause:
+            time.sleep(pause)
+    return total
@@ -0,0 +1,18 @@
+"""Дедупликация входящих сообщений через общий для всех процессов реестр."""
+from django.db import IntegrityError, transaction
+
+
+def first_delivery(scope, key):
+    """Атомарно отметить (scope, key) обработанным. True — если это первая доставка.
+
+    Повторная доставка (в том числе одновременная, в другом воркере)
+    упирается в уникальный индекс и получает False.
+    """
+    from core.models import IdempotencyKey
+
+    try:
+        with transaction.atomic():
+            IdempotencyKey.objects.create(scope=scope, key=str(key))
+    except IntegrityError:
+        return False
+    return True
@@ -0,0 +1,51 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from bookings.models import StripeEvent
+from core.db import delete_in_chunks
+from core.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = 'Delete old idempotency keys and finished Stripe events in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--keep-days',
+            type=int,
+            default=getattr(settings, 'IDEMPOTENCY_RETENTION_DAYS', 14),
+            help='Keep records newer than this many days (default: IDEMPOTENCY_RETENTION_DAYS).',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Rows per delete transaction (default: 1000).',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Count rows that would be deleted without deleting.',
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['keep_days'])
+
+        targets = [
+            ('idempotency key(s)', IdempotencyKey.objects.filter(processed_at__lt=cutoff)),
+            # Незавершённые и FAILED остаются — их ещё разбирают
+            ('Stripe event(s)', StripeEvent.objects.filter(
+                status__in=[StripeEvent.Status.DONE, StripeEvent.Status.IGNORED],
+                received_at__lt=cutoff,
+            )),
+        ]
+
+        for label, queryset in targets:
+            if options['dry_run']:
+                self.stdout.write(f'[DRY RUN] Would delete {queryset.count()} {label}.')
+                continue
+            deleted = delete_in_chunks(queryset, batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} {label}.'))
@@ -0,0 +1,67 @@
+import signal
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.scheduler import registered_jobs, run_due, worker_id
+
+
+class Command(BaseCommand):
+    help = 'Run periodic jobs (settings.SCHEDULER_JOBS) in one long-lived process.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--tick',
+            type=float,
+            default=5.0,
+            help='Seconds between checks for due jobs (default: 5).',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Run the jobs that are due now and exit.',
+        )
+        parser.add_argument(
+            '--only',
+            nargs='+',
+            metavar='JOB',
+            help='Limit the scheduler to these job names.',
+        )
+
+    def handle(self, *args, **options):
+        jobs = registered_jobs()
+        if options['only']:
+            unknown = set(options['only']) - set(jobs)
+            if unknown:
+                raise CommandError(f"Unknown job(s): {', '.join(sorted(unknown))}")
+            jobs = {name: job for name, job in jobs.items() if name in options['only']}
+
+        owner = worker_id()
+        for job in jobs.values():
+            self.stdout.write(f'  {job.name}: {job.trigger}')
+
+        if options['once']:
+            self.report(run_due(jobs, owner=owner))
+            return
+
+        self.stopping = False
+
+        def stop(signum, frame):
+            # Текущую задачу доводим до конца, новых не берём
+            self.stopping = True
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        self.stdout.write(f'Scheduler {owner} started.')
+        while not self.stopping:
+            self.report(run_due(jobs, owner=owner))
+            time.sleep(options['tick'])
+        self.stdout.write('Scheduler stopped.')
+
+    def report(self, results):
+        for name, duration_ms, error in results:
+            if error:
+                self.stdout.write(self.style.ERROR(f'{name} failed after {duration_ms:.0f} ms: {error}'))
+            else:
+                self.stdout.write(self.style.SUCCESS(f'{name} done in {duration_ms:.0f} ms'))
@@ -0,0 +1,97 @@
+"""Лёгкие метрики латентности без внешних зависимостей.
+
+Гистограмма хранит счётчики по фиксированным бакетам в Django cache, так что
+при общем кэше (Redis/Memcached) воркеры пишут в одни и те же ключи, а с
+LocMem — каждый процесс видит свои.
+"""
+import time
+from contextlib import contextmanager
+
+from django.core.cache import cache
+
+# Верхние границы бакетов, мс. Последний бакет — всё, что дольше.
+DEFAULT_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class LatencyHistogram:
+    """Счётчики длительности по бакетам: observe() / snapshot() / quantile()."""
+
+    def __init__(self, name, buckets=DEFAULT_BUCKETS_MS):
+        self.name = name
+        self.buckets = tuple(buckets)
+
+    def _key(self, suffix):
+        return f'metrics:{self.name}:{suffix}'
+
+    def _bucket_for(self, duration_ms):
+        for upper in self.buckets:
+            if duration_ms <= upper:
+                return str(upper)
+        return 'inf'
+
+    @staticmethod
+    def _incr(key, delta=1):
+        # add() создаёт ключ атомарно; incr() — атомарен в Redis/Memcached
+        if not cache.add(key, delta, timeout=None):
+            try:
+                cache.incr(key, delta)
+            except ValueError:
+                cache.set(key, delta, timeout=None)
+
+    def observe(self, duration_ms):
+        self._incr(self._key(self._bucket_for(duration_ms)))
+        self._incr(self._key('count'))
+        self._incr(self._key('sum_us'), int(duration_ms * 1000))
+
+    @contextmanager
+    def time(self):
+        """Замерить блок: `with histogram.time(): ...`."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe((time.perf_counter() - started) * 1000)
+
+    def snapshot(self):
+        labels = [str(b) for b in self.buckets] + ['inf']
+        values = cache.get_many([self._key(label) for label in labels + ['count', 'sum_us']])
+        buckets = {label: values.get(self._key(label), 0) for label in labels}
+        count = values.get(self._key('count'), 0)
+        sum_ms = values.get(self._key('sum_us'), 0) / 1000
+        return {
+            'count': count,
+            'sum_ms': round(sum_ms, 3),
+            'avg_ms': round(sum_ms / count, 3) if count else 0,
+            'buckets': buckets,
+            'p50_ms': self.quantile(0.5, buckets),
+            'p99_ms': self.quantile(0.99, buckets),
+        }
+
+    def quantile(self, q, buckets=None):
+        """Верхняя граница бакета, в который попадает q-квантиль (None — нет данных)."""
+        if buckets is None:
+            buckets = self.snapshot()['buckets']
+        total = sum(buckets.values())
+        if not total:
+            return None
+        threshold = q * total
+        seen = 0
+        for upper in self.buckets:
+            seen += buckets.get(str(upper), 0)
+            if seen >= threshold:
+                return upper
+        return float('inf')
+
+    def reset(self):
+        labels = [str(b) for b in self.buckets] + ['inf', 'count', 'sum_us']
+        cache.delete_many([self._key(label) for label in labels])
+
+
+_registry = {}
+
+
+def histogram(name, buckets=DEFAULT_BUCKETS_MS):
+    """Гистограмма по имени (одна на процесс)."""
+    if name not in _registry:
+        _registry[name] = LatencyHistogram(name, buckets)
+    return _registry[name]
@@ -0,0 +1,110 @@
+import logging
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from core.profiling import RequestProfile, current_profile, profiling
+
+logger = logging.getLogger(__name__)
+
+
+class RequestProfilingMiddleware:
+    """Запросы к БД, время БД, дубли, рендер шаблонов и внешние вызовы на каждый запрос.
+
+    Итог пишется строкой лога `core.middleware` (key=value, поля — в
+    extra['request_profile']); персоналу (и при DEBUG) — ещё и заголовком
+    Server-Timing. Лимиты по маршрутам — settings.REQUEST_BUDGETS:
+    ключ — имя URL (view_name), '*' — для всех; превышение — warning.
+    Время шаблонов учитывается для TemplateResponse (TemplateView и т.п.);
+    render() внутри view попадает во время самого view.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'REQUEST_PROFILING', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        profile = RequestProfile()
+        with profiling(profile), ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(profile))
+            response = self.get_response(request)
+        profile.finish()
+
+        route = request.resolver_match.view_name if request.resolver_match else ''
+        self.report(request, response, route, profile)
+        if self.show_timing(request):
+            response['Server-Timing'] = self.server_timing(profile)
+        return response
+
+    def process_template_response(self, request, response):
+        profile = current_profile()
+        if profile is not None:
+            profile.render_started()
+            response.add_post_render_callback(lambda rendered: profile.render_finished())
+        return response
+
+    @staticmethod
+    def fields(route, response, profile):
+        fields = {
+            'route': route or '-',
+            'status': response.status_code,
+            'total_ms': round(profile.total_ms, 1),
+            'queries': profile.queries,
+            'db_ms': round(profile.db_ms, 1),
+            'duplicate_queries': profile.duplicate_queries,
+            'template_ms': round(profile.template_ms, 1),
+        }
+        for kind, duration_ms in sorted(profile.external_ms.items()):
+            fields[f'{kind}_ms'] = round(duration_ms, 1)
+            fields[f'{kind}_calls'] = profile.external_calls[kind]
+        return fields
+
+    def report(self, request, response, route, profile):
+        fields = self.fields(route, response, profile)
+        logger.info(
+            '%s %s %s', request.method, request.path,
+            ' '.join(f'{key}={value}' for key, value in fields.items()),
+            extra={'request_profile': fields},
+        )
+        if not route:
+            return
+
+        budget = self.budget_for(route)
+        exceeded = [
+            f'{name} {fields[name]} > {limit}'
+            for name, limit in budget.items() if fields.get(name, 0) > limit
+        ]
+        if exceeded:
+            duplicate = profile.top_duplicate()
+            logger.warning(
+                'Request budget exceeded: %s (%s)%s', route, ', '.join(exceeded),
+                f'; most repeated x{duplicate[1]}: {duplicate[0][:200]}' if duplicate else '',
+                extra={'request_profile': fields},
+            )
+
+    @staticmethod
+    def budget_for(route):
+        budgets = getattr(settings, 'REQUEST_BUDGETS', {})
+        return {**budgets.get('*', {}), **budgets.get(route, {})}
+
+    @staticmethod
+    def show_timing(request):
+        if settings.DEBUG:
+            return True
+        user = getattr(request, 'user', None)
+        return bool(user is not None and user.is_authenticated and user.is_staff)
+
+    @staticmethod
+    def server_timing(profile):
+        metrics = [
+            f'db;dur={profile.db_ms:.1f};desc="{profile.queries} queries, {profile.duplicate_queries} duplicate"',
+            f'tpl;dur={profile.template_ms:.1f}',
+        ]
+        for kind, duration_ms in sorted(profile.external_ms.items()):
+            metrics.append(f'{kind};dur={duration_ms:.1f};desc="{profile.external_calls[kind]} calls"')
+        metrics.append(f'total;dur={profile.total_ms:.1f}')
+        return ', '.join(metrics)
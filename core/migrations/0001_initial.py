@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScheduledJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True, verbose_name='Name')),
+                ('next_run_at', models.DateTimeField(verbose_name='Next run at')),
+                ('locked_by', models.CharField(blank=True, max_length=255, verbose_name='Locked by')),
+                ('locked_until', models.DateTimeField(blank=True, null=True, verbose_name='Locked until')),
+                ('last_started_at', models.DateTimeField(blank=True, null=True, verbose_name='Last started at')),
+                ('last_finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Last finished at')),
+                ('last_duration_ms', models.PositiveIntegerField(blank=True, null=True, verbose_name='Last duration (ms)')),
+                ('last_error', models.TextField(blank=True, verbose_name='Last error')),
+                ('run_count', models.PositiveIntegerField(default=0, verbose_name='Runs')),
+                ('failure_count', models.PositiveIntegerField(default=0, verbose_name='Failures')),
+            ],
+            options={
+                'verbose_name': 'Scheduled job',
+                'verbose_name_plural': 'Scheduled jobs',
+                'ordering': ['name'],
+            },
+        ),
+    ]
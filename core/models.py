@@ -0,0 +1,50 @@
+from django.db import models
+from django.utils.translation import gettext_lazy as _
+
+
+class ScheduledJob(models.Model):
+    """Состояние периодической задачи run_scheduler: следующий слот, блокировка, последний прогон."""
+
+    name = models.CharField(max_length=100, unique=True, verbose_name=_('Name'))
+    next_run_at = models.DateTimeField(verbose_name=_('Next run at'))
+
+    # Блокировка: кто выполняет и до какого момента она действует
+    locked_by = models.CharField(max_length=255, blank=True, verbose_name=_('Locked by'))
+    locked_until = models.DateTimeField(null=True, blank=True, verbose_name=_('Locked until'))
+
+    last_started_at = models.DateTimeField(null=True, blank=True, verbose_name=_('Last started at'))
+    last_finished_at = models.DateTimeField(null=True, blank=True, verbose_name=_('Last finished at'))
+    last_duration_ms = models.PositiveIntegerField(null=True, blank=True, verbose_name=_('Last duration (ms)'))
+    last_error = models.TextField(blank=True, verbose_name=_('Last error'))
+    run_count = models.PositiveIntegerField(default=0, verbose_name=_('Runs'))
+    failure_count = models.PositiveIntegerField(default=0, verbose_name=_('Failures'))
+
+    class Meta:
+        ordering = ['name']
+        verbose_name = _('Scheduled job')
+        verbose_name_plural = _('Scheduled jobs')
+
+    def __str__(self):
+        return self.name
+
+
+class IdempotencyKey(models.Model):
+    """Уже обработанное входящее сообщение (Telegram update_id и т.п.).
+
+    Уникальность (scope, key) в БД — общая для всех воркеров, в отличие
+    от per-process LocMemCache. Старые ключи чистит purge_idempotency_keys.
+    """
+
+    scope = models.CharField(max_length=50, verbose_name=_('Scope'))
+    key = models.CharField(max_length=255, verbose_name=_('Key'))
+    processed_at = models.DateTimeField(auto_now_add=True, db_index=True, verbose_name=_('Processed at'))
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['scope', 'key'], name='uniq_idempotency_scope_key'),
+        ]
+        verbose_name = _('Idempotency key')
+        verbose_name_plural = _('Idempotency keys')
+
+    def __str__(self):
+        return f'{self.scope}:{self.key}'
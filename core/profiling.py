@@ -0,0 +1,98 @@
+"""Профиль одного HTTP-запроса: запросы к БД, шаблоны, внешние вызовы.
+
+RequestProfilingMiddleware создаёт RequestProfile на запрос и делает его
+текущим (contextvar). Запросы к БД считаются через execute_wrapper,
+внешние вызовы (Stripe, SMTP, Telegram) оборачиваются в external_call().
+Вне запроса (команды, фоновые потоки) профиля нет и external_call
+ничего не делает.
+"""
+import re
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+_current = ContextVar('request_profile', default=None)
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+class RequestProfile:
+    """Счётчики запроса. Время — в миллисекундах."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.total_ms = None
+        self.queries = 0
+        self.db_ms = 0.0
+        self.signatures = Counter()
+        self.template_ms = 0.0
+        self._render_started = None
+        self.external_ms = defaultdict(float)
+        self.external_calls = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        """execute_wrapper: время и сигнатура каждого запроса к БД."""
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_ms += (time.perf_counter() - started) * 1000
+            self.queries += 1
+            # Параметры отдельно — одинаковый SQL-шаблон и есть сигнатура N+1
+            self.signatures[_WHITESPACE.sub(' ', sql).strip()] += 1
+
+    @property
+    def duplicate_queries(self):
+        """Сколько запросов повторили уже выполненный SQL-шаблон."""
+        return sum(count - 1 for count in self.signatures.values() if count > 1)
+
+    def top_duplicate(self):
+        """(sql, count) самого частого повтора или None."""
+        if not self.signatures:
+            return None
+        sql, count = self.signatures.most_common(1)[0]
+        return (sql, count) if count > 1 else None
+
+    def render_started(self):
+        self._render_started = time.perf_counter()
+
+    def render_finished(self):
+        if self._render_started is not None:
+            self.template_ms += (time.perf_counter() - self._render_started) * 1000
+            self._render_started = None
+
+    def record_external(self, kind, duration_ms):
+        self.external_ms[kind] += duration_ms
+        self.external_calls[kind] += 1
+
+    def finish(self):
+        self.total_ms = (time.perf_counter() - self.started) * 1000
+
+
+def current_profile():
+    return _current.get()
+
+
+@contextmanager
+def profiling(profile):
+    """Сделать профиль текущим на время блока."""
+    token = _current.set(profile)
+    try:
+        yield profile
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def external_call(kind):
+    """Учесть время блока как внешний вызов `kind` текущего запроса."""
+    profile = _current.get()
+    if profile is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.record_external(kind, (time.perf_counter() - started) * 1000)
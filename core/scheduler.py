@@ -0,0 +1,221 @@
+"""Периодические задачи в одном долгоживущем процессе (manage.py run_scheduler).
+
+Задача — management-команда или функция с триггером: интервал (`every`)
+или cron-выражение (`cron`, по TIME_ZONE). Состояние и блокировка — строка
+ScheduledJob на задачу: запуск «забирается» условным UPDATE по next_run_at
+и locked_until, поэтому при нескольких хостах каждый слот выполняется один раз.
+"""
+import logging
+import os
+import socket
+import time
+from datetime import timedelta
+from io import StringIO
+
+from django.conf import settings
+from django.core.management import call_command
+from django.db import close_old_connections
+from django.db.models import F, Q
+from django.utils import timezone
+
+from core.metrics import histogram
+
+logger = logging.getLogger(__name__)
+
+# Сколько держится блокировка, если процесс упал посреди задачи
+DEFAULT_LOCK_TTL = timedelta(minutes=30)
+
+
+class Every:
+    """Интервальный триггер: следующий запуск через `seconds` после текущего."""
+
+    def __init__(self, seconds):
+        self.interval = timedelta(seconds=seconds)
+
+    def next_after(self, moment):
+        return moment + self.interval
+
+    def __str__(self):
+        return f'every {int(self.interval.total_seconds())}s'
+
+
+class Cron:
+    """Cron-триггер из пяти полей: минута час день месяц день-недели.
+
+    Поддерживаются `*`, `*/n`, списки `a,b` и диапазоны `a-b`(/n).
+    День недели 0–6, воскресенье = 0 (7 тоже воскресенье).
+    """
+
+    RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f'Cron expression needs 5 fields: {expression!r}')
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            self._parse(field, low, high) for field, (low, high) in zip(fields, self.RANGES)
+        )
+        self.weekdays = {day % 7 for day in weekdays}
+        self.any_day = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+
+    @staticmethod
+    def _parse(field, low, high):
+        values = set()
+        for part in field.split(','):
+            step = 1
+            if '/' in part:
+                part, step = part.split('/')
+                step = int(step)
+            if part == '*':
+                start, end = low, high
+            elif '-' in part:
+                start, end = (int(v) for v in part.split('-'))
+            else:
+                start = end = int(part)
+            if start < low or end > high or step < 1:
+                raise ValueError(f'Cron field out of range: {field!r}')
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _day_matches(self, moment):
+        in_days = moment.day in self.days
+        in_weekdays = (moment.isoweekday() % 7) in self.weekdays
+        # Как в cron: если заданы оба поля, достаточно любого
+        if self.any_day or self.any_weekday:
+            return in_days and in_weekdays
+        return in_days or in_weekdays
+
+    def next_after(self, moment):
+        local = timezone.localtime(moment).replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = local + timedelta(days=366 * 4)
+        while local < limit:
+            if local.month not in self.months or not self._day_matches(local):
+                local = (local + timedelta(days=1)).replace(hour=0, minute=0)
+            elif local.hour not in self.hours:
+                local = (local + timedelta(hours=1)).replace(minute=0)
+            elif local.minute not in self.minutes:
+                local += timedelta(minutes=1)
+            else:
+                return timezone.make_aware(local.replace(tzinfo=None))
+        raise ValueError(f'Cron expression never fires: {self.expression!r}')
+
+    def __str__(self):
+        return f'cron {self.expression}'
+
+
+class Job:
+    """Зарегистрированная задача: имя, триггер и что вызывать."""
+
+    def __init__(self, name, trigger, func=None, command=None, args=(), lock_ttl=DEFAULT_LOCK_TTL):
+        if (func is None) == (command is None):
+            raise ValueError('Job needs exactly one of func or command')
+        self.name = name
+        self.trigger = trigger
+        self.func = func
+        self.command = command
+        self.args = tuple(args)
+        self.lock_ttl = lock_ttl
+        self.latency = histogram(f'scheduler.{name}')
+
+    def __call__(self):
+        """Выполнить задачу. Возвращает вывод команды (для функций — '')."""
+        if self.func is not None:
+            self.func(*self.args)
+            return ''
+        out = StringIO()
+        call_command(self.command, *self.args, stdout=out, stderr=out)
+        return out.getvalue()
+
+
+_registry = {}
+
+
+def register_job(name, func=None, command=None, every=None, cron=None, args=(), lock_ttl=DEFAULT_LOCK_TTL):
+    """Добавить задачу в реестр. Нужен ровно один триггер: every (секунды) или cron."""
+    if (every is None) == (cron is None):
+        raise ValueError(f'Job {name!r} needs exactly one of every or cron')
+    trigger = Every(every) if every is not None else Cron(cron)
+    _registry[name] = Job(name, trigger, func=func, command=command, args=args, lock_ttl=lock_ttl)
+    return _registry[name]
+
+
+def load_settings_jobs():
+    """Зарегистрировать задачи из settings.SCHEDULER_JOBS (список dict)."""
+    for spec in getattr(settings, 'SCHEDULER_JOBS', []):
+        spec = dict(spec)
+        register_job(spec.pop('name'), **spec)
+
+
+def registered_jobs():
+    if not _registry:
+        load_settings_jobs()
+    return dict(_registry)
+
+
+def worker_id():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def claim(job, now, owner):
+    """Забрать слот задачи, если он наступил и никто не держит блокировку."""
+    from core.models import ScheduledJob
+
+    ScheduledJob.objects.get_or_create(
+        name=job.name, defaults={'next_run_at': job.trigger.next_after(now - timedelta(minutes=1))},
+    )
+    return bool(
+        ScheduledJob.objects.filter(name=job.name, next_run_at__lte=now)
+        .filter(Q(locked_until__isnull=True) | Q(locked_until__lt=now))
+        .update(
+            next_run_at=job.trigger.next_after(now),
+            locked_until=now + job.lock_ttl,
+            locked_by=owner,
+            last_started_at=now,
+        )
+    )
+
+
+def run_job(job, owner):
+    """Выполнить забранную задачу, записать длительность и ошибку, снять блокировку."""
+    from core.models import ScheduledJob
+
+    started = time.perf_counter()
+    error = ''
+    output = ''
+    try:
+        output = job()
+    except Exception as e:
+        error = f'{type(e).__name__}: {e}'
+        logger.exception('Scheduled job %s failed', job.name)
+    duration_ms = (time.perf_counter() - started) * 1000
+    job.latency.observe(duration_ms)
+
+    ScheduledJob.objects.filter(name=job.name, locked_by=owner).update(
+        locked_until=None,
+        locked_by='',
+        last_finished_at=timezone.now(),
+        last_duration_ms=int(duration_ms),
+        last_error=error,
+        run_count=F('run_count') + 1,
+        failure_count=F('failure_count') + (1 if error else 0),
+    )
+    if output.strip():
+        logger.info('%s: %s', job.name, output.strip())
+    return duration_ms, error
+
+
+def run_due(jobs=None, now=None, owner=None):
+    """Один проход: выполнить все наступившие задачи. Возвращает [(name, ms, error)]."""
+    jobs = registered_jobs() if jobs is None else jobs
+    owner = owner or worker_id()
+    results = []
+    for job in jobs.values():
+        # Долгая задача могла пережить таймаут соединения
+        close_old_connections()
+        if not claim(job, now or timezone.now(), owner):
+            continue
+        duration_ms, error = run_job(job, owner)
+        results.append((job.name, duration_ms, error))
+    return results
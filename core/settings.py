@@ -33,6 +33,7 @@ INSTALLED_APPS = [
     'django.contrib.sitemaps',
 
     # Local apps
+    'core',
     'accounts',
     'locations',
     'services',
@@ -69,6 +70,16 @@ STRIPE_PUBLIC_KEY = os.getenv('STRIPE_PUBLIC_KEY', '')
 STRIPE_SECRET_KEY = os.getenv('STRIPE_SECRET_KEY', '')
 STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_WEBHOOK_SECRET', '')
 
+# Клиент Stripe (bookings.payments): пул соединений, таймауты, повторы, breaker.
+# STRIPE_API_BASE — только для локального stub-сервера; пусто = api.stripe.com
+STRIPE_API_BASE = os.getenv('STRIPE_API_BASE', '')
+STRIPE_POOL_SIZE = int(os.getenv('STRIPE_POOL_SIZE', '10'))
+STRIPE_CONNECT_TIMEOUT = float(os.getenv('STRIPE_CONNECT_TIMEOUT', '3'))
+STRIPE_READ_TIMEOUT = float(os.getenv('STRIPE_READ_TIMEOUT', '15'))
+STRIPE_MAX_NETWORK_RETRIES = int(os.getenv('STRIPE_MAX_NETWORK_RETRIES', '2'))
+STRIPE_BREAKER_THRESHOLD = int(os.getenv('STRIPE_BREAKER_THRESHOLD', '5'))
+STRIPE_BREAKER_RESET_SECONDS = float(os.getenv('STRIPE_BREAKER_RESET_SECONDS', '30'))
+
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'django.middleware.gzip.GZipMiddleware',
@@ -79,6 +90,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'core.middleware.RequestProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'core.urls'
@@ -181,6 +193,9 @@ STATIC_ROOT = BASE_DIR / "staticfiles"
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Архив закрытых месяцев визитов (archive_visits) — вне MEDIA_ROOT, не раздаётся
+VISIT_ARCHIVE_DIR = Path(os.getenv('VISIT_ARCHIVE_DIR', BASE_DIR / 'archive' / 'visits'))
+
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -211,4 +226,39 @@ TELEGRAM_WEBHOOK_SECRET = os.getenv('TELEGRAM_WEBHOOK_SECRET', '')
 
 
 # Telegram менеджер (для уведомлений о заявках)
-TELEGRAM_MANAGER_CHAT_ID = os.getenv('TELEGRAM_MANAGER_CHAT_ID', '')
\ No newline at end of file
+TELEGRAM_MANAGER_CHAT_ID = os.getenv('TELEGRAM_MANAGER_CHAT_ID', '')
+
+# Уведомления из запросов (скан QR и т.п.) уходят в фоновый поток после коммита.
+# В тестах — синхронно, чтобы поток не ходил в in-memory БД.
+NOTIFICATIONS_ASYNC = os.getenv('NOTIFICATIONS_ASYNC', 'True') == 'True' and 'test' not in sys.argv
+
+# Stripe-вебхук сохраняет событие и отвечает сразу; обработка — в пуле потоков
+STRIPE_EVENTS_ASYNC = os.getenv('STRIPE_EVENTS_ASYNC', 'True') == 'True' and 'test' not in sys.argv
+STRIPE_EVENT_WORKERS = int(os.getenv('STRIPE_EVENT_WORKERS', '2'))
+
+# Профиль каждого запроса (core.middleware.RequestProfilingMiddleware): строка
+# лога core.middleware и Server-Timing для персонала. Лимиты — по имени URL,
+# '*' — для всех маршрутов; превышение пишется warning'ом.
+REQUEST_PROFILING = os.getenv('REQUEST_PROFILING', 'True') == 'True'
+REQUEST_BUDGETS = {
+    '*': {'queries': 60, 'duplicate_queries': 20, 'total_ms': 2000},
+    'cabinet-snapshot': {'queries': 10, 'total_ms': 200},
+    'stripe_webhook': {'queries': 10, 'total_ms': 500},
+}
+
+# Сколько дней хранить ключи дедупликации (Telegram update_id) и завершённые
+# Stripe-события. Stripe повторяет доставку до 3 дней, Telegram — до суток.
+IDEMPOTENCY_RETENTION_DAYS = int(os.getenv('IDEMPOTENCY_RETENTION_DAYS', '14'))
+
+# Периодические задачи manage.py run_scheduler (вместо отдельных cron-запусков).
+# every — интервал в секундах, cron — выражение по TIME_ZONE.
+SCHEDULER_JOBS = [
+    {'name': 'cancel_expired_bookings', 'command': 'cancel_expired_bookings', 'every': 60},
+    {'name': 'send_expiring_notifications', 'command': 'send_expiring_notifications', 'cron': '0 10 * * *'},
+    {'name': 'purge_expired_tokens', 'command': 'purge_expired_tokens', 'cron': '30 3 * * *'},
+    # Повторы и события, не дошедшие до пула вебхука
+    {'name': 'process_stripe_events', 'command': 'process_stripe_events', 'every': 30},
+    # Страховка от потерянных вебхуков и пустых квитанций
+    {'name': 'reconcile_stripe_payments', 'command': 'reconcile_stripe_payments', 'cron': '15 * * * *'},
+    {'name': 'purge_idempotency_keys', 'command': 'purge_idempotency_keys', 'cron': '45 3 * * *'},
+]
@@ -0,0 +1,168 @@
+from datetime import datetime, timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import User
+from bookings.models import StripeEvent
+from core.idempotency import first_delivery
+from core.models import IdempotencyKey, ScheduledJob
+from core.profiling import RequestProfile, external_call, profiling
+from core.scheduler import Cron, Every, Job, claim, run_due
+
+
+def local(*args):
+    return timezone.make_aware(datetime(*args))
+
+
+class CronTriggerTest(TestCase):
+
+    def test_next_after(self):
+        cases = [
+            ('0 10 * * *', local(2026, 3, 1, 9, 59, 30), local(2026, 3, 1, 10, 0)),
+            ('0 10 * * *', local(2026, 3, 1, 10, 0), local(2026, 3, 2, 10, 0)),
+            ('*/15 * * * *', local(2026, 3, 1, 10, 7), local(2026, 3, 1, 10, 15)),
+            ('30 3 1 * *', local(2026, 1, 31, 12, 0), local(2026, 2, 1, 3, 30)),
+            # 2026-03-01 — воскресенье; 1-5 = пн–пт
+            ('0 9 * * 1-5', local(2026, 2, 27, 10, 0), local(2026, 3, 2, 9, 0)),
+            ('0 0 * * 7', local(2026, 2, 27, 10, 0), local(2026, 3, 1, 0, 0)),
+        ]
+        for expression, moment, expected in cases:
+            with self.subTest(expression=expression, moment=moment):
+                self.assertEqual(Cron(expression).next_after(moment), expected)
+
+    def test_invalid_expressions(self):
+        for expression in ('* * *', '60 * * * *', '0 24 * * *', '*/0 * * * *'):
+            with self.subTest(expression=expression), self.assertRaises(ValueError):
+                Cron(expression)
+
+
+class SchedulerRunTest(TestCase):
+
+    def setUp(self):
+        self.calls = []
+        self.job = Job('test_job', Every(60), func=lambda: self.calls.append(1))
+
+    def test_slot_runs_once_across_workers(self):
+        now = timezone.now()
+        self.assertTrue(claim(self.job, now, 'host-a:1'))
+        # Второй хост в тот же слот — не забирает, даже после снятия блокировки
+        self.assertFalse(claim(self.job, now, 'host-b:2'))
+        ScheduledJob.objects.filter(name='test_job').update(locked_until=None)
+        self.assertFalse(claim(self.job, now + timedelta(seconds=30), 'host-b:2'))
+        self.assertTrue(claim(self.job, now + timedelta(seconds=61), 'host-b:2'))
+
+    def test_stale_lock_expires(self):
+        now = timezone.now()
+        self.assertTrue(claim(self.job, now, 'crashed:1'))
+        self.assertFalse(claim(self.job, now + timedelta(minutes=5), 'host-b:2'))
+        self.assertTrue(claim(self.job, now + timedelta(hours=1), 'host-b:2'))
+
+    def test_run_records_metrics_and_failures(self):
+        def boom():
+            raise RuntimeError('down')
+
+        failing = Job('failing_job', Every(60), func=boom)
+        with self.assertLogs('core.scheduler', 'ERROR'):
+            results = run_due({'test_job': self.job, 'failing_job': failing}, owner='w:1')
+
+        self.assertEqual([name for name, _ms, _error in results], ['test_job', 'failing_job'])
+        self.assertEqual(self.calls, [1])
+        ok = ScheduledJob.objects.get(name='test_job')
+        self.assertEqual((ok.run_count, ok.failure_count, ok.last_error), (1, 0, ''))
+        self.assertIsNone(ok.locked_until)
+        self.assertIsNotNone(ok.last_duration_ms)
+        bad = ScheduledJob.objects.get(name='failing_job')
+        self.assertEqual(bad.failure_count, 1)
+        self.assertIn('RuntimeError: down', bad.last_error)
+        self.assertGreaterEqual(self.job.latency.snapshot()['count'], 1)
+
+        # Следующий проход до наступления слота ничего не запускает
+        self.assertEqual(run_due({'test_job': self.job}, owner='w:1'), [])
+
+    def test_run_scheduler_once_runs_registered_commands(self):
+        out = StringIO()
+        call_command('run_scheduler', '--once', '--only', 'cancel_expired_bookings', stdout=out)
+        self.assertIn('cancel_expired_bookings done', out.getvalue())
+        self.assertEqual(ScheduledJob.objects.get(name='cancel_expired_bookings').run_count, 1)
+
+
+class IdempotencyTest(TestCase):
+
+    def test_first_delivery_per_scope(self):
+        self.assertTrue(first_delivery('telegram', 42))
+        self.assertFalse(first_delivery('telegram', '42'))
+        self.assertTrue(first_delivery('other', 42))
+
+    def test_purge_keeps_recent_and_open_records(self):
+        old = timezone.now() - timedelta(days=30)
+        first_delivery('telegram', 1)
+        first_delivery('telegram', 2)
+        IdempotencyKey.objects.filter(key='1').update(processed_at=old)
+        for event_id, status in (('evt_done', StripeEvent.Status.DONE), ('evt_failed', StripeEvent.Status.FAILED)):
+            StripeEvent.objects.create(event_id=event_id, event_type='x', payload={}, status=status)
+        StripeEvent.objects.update(received_at=old)
+
+        call_command('purge_idempotency_keys', stdout=StringIO())
+
+        self.assertEqual(list(IdempotencyKey.objects.values_list('key', flat=True)), ['2'])
+        self.assertEqual(list(StripeEvent.objects.values_list('event_id', flat=True)), ['evt_failed'])
+
+
+class RequestProfilingTest(TestCase):
+
+    def setUp(self):
+        self.staff = User.objects.create_user(
+            email='staff@example.com', password='pass123', first_name='S', last_name='T', is_staff=True,
+        )
+        self.customer = User.objects.create_user(
+            email='customer@example.com', password='pass123', first_name='C', last_name='U',
+        )
+
+    def test_profile_counts_duplicates_and_external_calls(self):
+        profile = RequestProfile()
+
+        def execute(sql, params, many, context):
+            return None
+
+        for pk in (1, 2, 3):
+            profile(execute, 'SELECT * FROM t\n WHERE id = %s', (pk,), False, {})
+        profile(execute, 'SELECT 1', (), False, {})
+        with profiling(profile), external_call('stripe'):
+            pass
+        # Вне запроса — без профиля и без ошибок
+        with external_call('stripe'):
+            pass
+
+        self.assertEqual(profile.queries, 4)
+        self.assertEqual(profile.duplicate_queries, 2)
+        self.assertEqual(profile.top_duplicate(), ('SELECT * FROM t WHERE id = %s', 3))
+        self.assertEqual(profile.external_calls['stripe'], 1)
+
+    def test_log_line_and_server_timing_for_staff(self):
+        self.client.force_login(self.staff)
+        with self.assertLogs('core.middleware', 'INFO') as logs:
+            resp = self.client.get(reverse('cabinet-dashboard'))
+
+        fields = logs.records[-1].request_profile
+        self.assertEqual(fields['route'], 'cabinet-dashboard')
+        self.assertGreater(fields['queries'], 0)
+        self.assertGreater(fields['template_ms'], 0)
+        self.assertIn('db;dur=', resp['Server-Timing'])
+        self.assertIn('tpl;dur=', resp['Server-Timing'])
+
+    def test_no_server_timing_for_customers(self):
+        self.client.force_login(self.customer)
+        resp = self.client.get(reverse('cabinet-dashboard'))
+        self.assertNotIn('Server-Timing', resp)
+
+    @override_settings(REQUEST_BUDGETS={'*': {'total_ms': 60000}, 'cabinet-dashboard': {'queries': 1}})
+    def test_budget_overrun_logs_warning(self):
+        self.client.force_login(self.customer)
+        with self.assertLogs('core.middleware', 'WARNING') as logs:
+            self.client.get(reverse('cabinet-dashboard'))
+        self.assertIn('Request budget exceeded: cabinet-dashboard (queries', logs.output[0])
+        self.assertNotIn('total_ms', logs.output[0])
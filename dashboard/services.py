@@ -0,0 +1,126 @@
+"""Снепшот кабинета: брони, ожидающие оплаты, платежи и последние визиты.
+
+Страницы кабинета и JSON для обновления на клиенте читают один снепшот
+пользователя из кэша. В ключе — версия пользователя (User.cabinet_version):
+её сдвигает каждое событие брони, оплаты или визита (bump_cabinet_version),
+поэтому после события снепшот собирается заново, а между событиями запрос
+стоит одного чтения версии. Версия хранится в БД и читается на каждый
+запрос — событие в одном процессе сразу видят все остальные, даже с
+LocMem-кэшем.
+"""
+from django.core.cache import cache
+from django.db.models import F
+from django.utils import timezone
+from django.utils.translation import get_language
+
+from accounts.models import User
+from bookings.models import Booking
+
+CABINET_CACHE_TIMEOUT = 300
+
+
+def cabinet_version(user_id):
+    """Текущая версия кабинета пользователя (из БД, не из кэша)."""
+    return User.objects.filter(pk=user_id).values_list('cabinet_version', flat=True).first() or 0
+
+
+def bump_cabinet_version(*user_ids):
+    """Сдвинуть версию кабинета одним UPDATE.
+
+    Новая версия становится видна вместе с данными события — при коммите
+    той же транзакции; снепшот, собранный параллельно по старым данным,
+    остаётся под старой версией.
+    """
+    user_ids = {user_id for user_id in user_ids if user_id}
+    if user_ids:
+        User.objects.filter(pk__in=user_ids).update(cabinet_version=F('cabinet_version') + 1)
+
+
+def _cache_key(user_id, *parts):
+    # Проекция for_cabinet() берёт колонки текущего языка — язык часть ключа
+    return ':'.join(str(part) for part in ('cabinet', user_id, cabinet_version(user_id), get_language(), *parts))
+
+
+def build_cabinet_snapshot(user, today=None):
+    """Собрать снепшот из БД (без кэша)."""
+    from visits.services import visit_history_page
+
+    today = today or timezone.localdate()
+    bookings = Booking.objects.filter(user=user).for_cabinet()
+    visits, next_cursor = visit_history_page(user)
+    return {
+        # Только основные бронирования (не продления)
+        'active_bookings': list(
+            Booking.objects.occupying().with_display_status(today)
+            .filter(user=user, storage_unit__isnull=False)
+            .for_cabinet().order_by('-end_date')
+        ),
+        'pending_bookings': list(
+            bookings.filter(status=Booking.Status.PENDING, expires_at__gt=timezone.now()).order_by('-created_at')
+        ),
+        'paid_bookings': list(bookings.filter(paid_at__isnull=False).order_by('-paid_at')),
+        'visits': visits,
+        'next_visits_cursor': next_cursor,
+    }
+
+
+def cabinet_snapshot(user):
+    """Снепшот кабинета из кэша; собирается заново после событий пользователя или смены дня."""
+    today = timezone.localdate()
+    key = _cache_key(user.pk, today)
+    snapshot = cache.get(key)
+    if snapshot is None:
+        snapshot = build_cabinet_snapshot(user, today)
+        cache.set(key, snapshot, timeout=CABINET_CACHE_TIMEOUT)
+    return snapshot
+
+
+def pending_payments(snapshot, now=None):
+    """Ожидающие оплаты брони снепшота, которые ещё не истекли."""
+    now = now or timezone.now()
+    return [booking for booking in snapshot['pending_bookings'] if booking.expires_at > now]
+
+
+def cabinet_booking(user, pk):
+    """Бронь для страницы управления из кэша (по той же версии). None — не найдена."""
+    key = _cache_key(user.pk, 'booking', pk)
+    booking = cache.get(key)
+    if booking is None:
+        booking = (
+            Booking.objects.select_related(
+                'tariff', 'tariff__location', 'tariff__service',
+                'period', 'storage_unit', 'storage_unit__section',
+            )
+            .prefetch_related('booking_addons__addon')
+            .filter(pk=pk, user=user)
+            .first()
+        )
+        if booking is not None:
+            cache.set(key, booking, timeout=CABINET_CACHE_TIMEOUT)
+    return booking
+
+
+def _booking_payload(booking):
+    return {
+        'id': booking.pk,
+        'status': booking.display_status,
+        'tariff': booking.tariff.name if booking.tariff_id else '',
+        'location': booking.tariff.location.name if booking.tariff_id else '',
+        'unit': booking.storage_unit.full_code if booking.storage_unit_id else '',
+        'start_date': booking.start_date,
+        'end_date': booking.end_date,
+        'total_aed': booking.total_aed,
+        'expires_at': booking.expires_at,
+        'paid_at': booking.paid_at,
+    }
+
+
+def cabinet_payload(snapshot, now=None):
+    """Снепшот в виде JSON-совместимого dict (для CabinetSnapshotView)."""
+    return {
+        'active_bookings': [_booking_payload(booking) for booking in snapshot['active_bookings']],
+        'pending_bookings': [_booking_payload(booking) for booking in pending_payments(snapshot, now)],
+        'paid_bookings': [_booking_payload(booking) for booking in snapshot['paid_bookings']],
+        'visits': snapshot['visits'],
+        'next_visits_cursor': snapshot['next_visits_cursor'],
+    }
@@ -5,6 +5,7 @@ urlpatterns = [
     path('', views.DashboardHomeView.as_view(), name='cabinet-dashboard'),
     path('history/', views.DashboardHistoryView.as_view(), name='cabinet-history'),
     path('billing/', views.DashboardBillingView.as_view(), name='cabinet-billing'),
+    path('snapshot/', views.CabinetSnapshotView.as_view(), name='cabinet-snapshot'),
     path('settings/', views.DashboardSettingsView.as_view(), name='cabinet-settings'),
     path('settings/change-password/', views.ChangePasswordView.as_view(), name='cabinet-change-password'),
     path('settings/deactivate/', views.DeactivateAccountView.as_view(), name='cabinet-deactivate'),
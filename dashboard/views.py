@@ -1,4 +1,4 @@
-from django.http import JsonResponse
+from django.http import Http404, JsonResponse
 from django.contrib.auth import update_session_auth_hash
 from django.contrib.auth.forms import PasswordChangeForm
 from django.shortcuts import get_object_or_404, redirect
@@ -7,9 +7,11 @@ from django.contrib import messages
 from django.utils.translation import gettext_lazy as _
 from django.views.generic import TemplateView
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.utils import timezone
+from django.db import transaction
+from django.utils.cache import get_conditional_response, set_response_etag
 
 from bookings.models import Booking
+from .services import cabinet_booking, cabinet_payload, cabinet_snapshot, pending_payments
 
 
 class DashboardMixin(LoginRequiredMixin):
@@ -23,29 +25,13 @@ class DashboardHomeView(DashboardMixin, TemplateView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        user = self.request.user
-        now = timezone.now()
-
-        # Только основные бронирования (не продления)
-        active_bookings = list(Booking.objects.filter(
-            user=user,
-            status=Booking.Status.PAID,
-            parent_booking__isnull=True,
-            storage_unit__isnull=False,
-        ).select_related(
-            'tariff', 'tariff__location', 'tariff__service',
-            'storage_unit', 'storage_unit__section',
-        ).order_by('-end_date'))
+        snapshot = cabinet_snapshot(self.request.user)
 
-        # Pending бронирования (ожидают оплаты, ещё не истекли)
-        pending_bookings = Booking.objects.filter(
-            user=user,
-            status=Booking.Status.PENDING,
-            expires_at__gt=now,
-        ).select_related('tariff', 'period').order_by('-created_at')[:5]
+        active_bookings = snapshot['active_bookings']
 
         context['active_bookings'] = active_bookings
-        context['pending_bookings'] = pending_bookings
+        # Pending бронирования (ожидают оплаты, ещё не истекли)
+        context['pending_bookings'] = pending_payments(snapshot)[:5]
         context['has_active'] = len(active_bookings) > 0
 
         # Onboarding: show modal if profile is incomplete
@@ -63,14 +49,23 @@ class DashboardHistoryView(DashboardMixin, TemplateView):
         context = super().get_context_data(**kwargs)
         user = self.request.user
 
-        from visits.models import Visit
+        from visits.services import InvalidHistoryCursor, visit_history_page
 
-        # Все посещения пользователя (снепшот-данные в самой модели)
-        visits = Visit.objects.filter(
-            booking__user=user
-        ).select_related('booking').order_by('-visited_at')
+        # Первая страница — из снепшота кабинета, остальные по курсору
+        cursor = self.request.GET.get('cursor') or None
+        visits = next_cursor = None
+        if cursor:
+            try:
+                visits, next_cursor = visit_history_page(user, cursor=cursor)
+            except InvalidHistoryCursor:
+                cursor = None
+        if cursor is None:
+            snapshot = cabinet_snapshot(user)
+            visits, next_cursor = snapshot['visits'], snapshot['next_visits_cursor']
 
         context['visits'] = visits
+        context['next_cursor'] = next_cursor
+        context['is_first_page'] = cursor is None
 
         return context
 
@@ -80,41 +75,41 @@ class DashboardBillingView(DashboardMixin, TemplateView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        user = self.request.user
-        now = timezone.now()
+        snapshot = cabinet_snapshot(self.request.user)
 
         # Оплаченные бронирования
-        context['paid_bookings'] = Booking.objects.filter(
-            user=user,
-            paid_at__isnull=False,
-        ).select_related('tariff', 'period').order_by('-paid_at')
+        context['paid_bookings'] = snapshot['paid_bookings']
 
         # Pending (ожидают оплаты, ещё не истекли)
-        context['pending_payments'] = Booking.objects.filter(
-            user=user,
-            status=Booking.Status.PENDING,
-            expires_at__gt=now,
-        ).select_related('tariff', 'period').order_by('-created_at')
+        context['pending_payments'] = pending_payments(snapshot)
 
         return context
 
 
+class CabinetSnapshotView(DashboardMixin, View):
+    """Снепшот кабинета в JSON для обновления на клиенте.
+
+    ETag — хэш тела: клиент шлёт If-None-Match и получает 304, пока в
+    кабинете ничего не изменилось. Снепшот берётся из кэша, без запросов к БД.
+    """
+
+    def get(self, request):
+        response = JsonResponse(cabinet_payload(cabinet_snapshot(request.user)))
+        response['Cache-Control'] = 'private, no-cache'
+        set_response_etag(response)
+        return get_conditional_response(request, etag=response['ETag'], response=response)
+
+
 class BookingDetailView(DashboardMixin, TemplateView):
     """Детали бронирования + управление"""
     template_name = 'cabinet/dashboard/manage.html'
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        booking_id = kwargs.get('pk')
 
-        booking = get_object_or_404(
-            Booking.objects.select_related(
-                'tariff', 'tariff__location', 'tariff__service',
-                'period', 'storage_unit', 'storage_unit__section'
-            ).prefetch_related('booking_addons__addon'),  # Исправлено
-            pk=booking_id,
-            user=self.request.user
-        )
+        booking = cabinet_booking(self.request.user, kwargs.get('pk'))
+        if booking is None:
+            raise Http404
 
         # Периоды для продления (того же тарифа)
         periods = booking.tariff.periods.filter(is_active=True).order_by('duration_value')
@@ -135,8 +130,9 @@ class ExtendBookingView(DashboardMixin, View):
     def post(self, request, pk):
         from services.models import TariffPeriod, AddonService
 
+        # tariff с service/location и юнит — для снепшотов продления без лишних запросов
         booking = get_object_or_404(
-            Booking,
+            Booking.objects.select_related('tariff__service', 'tariff__location', 'storage_unit'),
             pk=pk,
             user=request.user,
             status=Booking.Status.PAID
@@ -176,29 +172,26 @@ class ExtendBookingView(DashboardMixin, View):
         # Новая дата начала = текущая дата окончания
         new_start_date = booking.end_date
 
-        # Создать новое бронирование (продление)
+        # Создать новое бронирование (продление) и аддоны одной транзакцией
         from bookings.models import BookingAddon
 
-        extension = Booking.objects.create(
-            user=request.user,
-            tariff=booking.tariff,
-            period=period,
-            storage_unit=booking.storage_unit,  # Тот же unit
-            start_date=new_start_date,
-            price_aed=price_aed,
-            addons_aed=addons_aed,
-            deposit_aed=0,  # Депозит уже оплачен
-            total_aed=total_aed,
-            parent_booking=booking,  # Связь с родительским бронированием
-        )
-
-        # Сохранить аддоны
-        for addon in selected_addons:
-            BookingAddon.objects.create(
-                booking=extension,
-                addon=addon,
-                price_aed=addon.price_aed
+        with transaction.atomic():
+            extension = Booking.objects.create(
+                user=request.user,
+                tariff=booking.tariff,
+                period=period,
+                storage_unit=booking.storage_unit,  # Тот же unit
+                start_date=new_start_date,
+                price_aed=price_aed,
+                addons_aed=addons_aed,
+                deposit_aed=0,  # Депозит уже оплачен
+                total_aed=total_aed,
+                parent_booking=booking,  # Связь с родительским бронированием
             )
+            BookingAddon.objects.bulk_create([
+                BookingAddon(booking=extension, addon=addon, price_aed=addon.price_aed)
+                for addon in selected_addons
+            ])
 
         # Редирект на оплату (checkout сам решит: Stripe или mock)
         return redirect('booking_checkout', pk=extension.pk)
@@ -4,6 +4,7 @@ from django.views import View
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 
+from core.profiling import external_call
 from .models import FeedbackRequest
 
 # Rate limit: max 3 submissions per IP per 10 minutes
@@ -112,10 +113,11 @@ Page: {feedback.page_url or '—'}
 Time: {feedback.created_at.strftime('%Y-%m-%d %H:%M')}"""
 
         try:
-            requests.post(
-                f'https://api.telegram.org/bot{bot_token}/sendMessage',
-                json={'chat_id': manager_chat_id, 'text': message},
-                timeout=10
-            )
+            with external_call('telegram'):
+                requests.post(
+                    f'https://api.telegram.org/bot{bot_token}/sendMessage',
+                    json={'chat_id': manager_chat_id, 'text': message},
+                    timeout=10
+                )
         except Exception:
             pass
\ No newline at end of file
@@ -50,6 +50,12 @@ class Location(models.Model):
     def __str__(self):
         return f"{self.get_location_type_display()} - {self.name}"
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # Имя локации входит в full_code юнитов
+        from services.models import StorageUnit
+        StorageUnit.refresh_codes(StorageUnit.objects.filter(section__location=self))
+
     @property
     def coordinates(self):
         """Для data-coordinates в шаблоне"""
@@ -1,12 +1,15 @@
 import logging
 import smtplib
+from concurrent.futures import ThreadPoolExecutor
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
 from django.conf import settings
+from django.db import connections, transaction
 from django.template import Template, Context
 from django.utils import timezone
 
+from core.profiling import external_call
 from .models import NotificationTemplate, NotificationLog
 
 logger = logging.getLogger(__name__)
@@ -32,16 +35,17 @@ class EmailClient:
         msg.attach(MIMEText(text, 'plain', 'utf-8'))
 
         try:
-            if settings.EMAIL_USE_SSL:
-                server = smtplib.SMTP_SSL(smtp_host, smtp_port, timeout=10)
-            else:
-                server = smtplib.SMTP(smtp_host, smtp_port, timeout=10)
-                if settings.EMAIL_USE_TLS:
-                    server.starttls()
-
-            server.login(smtp_user, smtp_password)
-            server.sendmail(from_email, to_email, msg.as_string())
-            server.quit()
+            with external_call('smtp'):
+                if settings.EMAIL_USE_SSL:
+                    server = smtplib.SMTP_SSL(smtp_host, smtp_port, timeout=10)
+                else:
+                    server = smtplib.SMTP(smtp_host, smtp_port, timeout=10)
+                    if settings.EMAIL_USE_TLS:
+                        server.starttls()
+
+                server.login(smtp_user, smtp_password)
+                server.sendmail(from_email, to_email, msg.as_string())
+                server.quit()
             return True
         except Exception as e:
             logger.error(f"SMTP error: {e}")
@@ -142,15 +146,16 @@ class NotificationService:
         )
 
         try:
-            response = requests.post(
-                f"https://api.telegram.org/bot{bot_token}/sendMessage",
-                json={
-                    'chat_id': user.telegram_id,
-                    'text': message,
-                    'parse_mode': 'HTML'
-                },
-                timeout=10
-            )
+            with external_call('telegram'):
+                response = requests.post(
+                    f"https://api.telegram.org/bot{bot_token}/sendMessage",
+                    json={
+                        'chat_id': user.telegram_id,
+                        'text': message,
+                        'parse_mode': 'HTML'
+                    },
+                    timeout=10
+                )
             response.raise_for_status()
 
             log.status = NotificationLog.Status.SENT
@@ -167,6 +172,46 @@ class NotificationService:
             logger.error(f"Telegram failed: {user.telegram_id}: {e}")
 
 
+# === Отложенная отправка ===
+
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='notify')
+    return _executor
+
+
+def send_later(func, *args):
+    """Вызвать func(*args) после коммита текущей транзакции, вне потока запроса.
+
+    SMTP/Telegram не должны держать ответ пользователю. При
+    NOTIFICATIONS_ASYNC=False (тесты) вызов идёт синхронно в on_commit.
+    """
+    def run():
+        try:
+            func(*args)
+        except Exception as e:
+            logger.error(f"Deferred notification failed: {func.__name__}: {e}")
+
+    def run_in_thread():
+        try:
+            run()
+        finally:
+            # У потока свои соединения — не оставлять их висеть
+            connections.close_all()
+
+    def submit():
+        if getattr(settings, 'NOTIFICATIONS_ASYNC', True):
+            _get_executor().submit(run_in_thread)
+        else:
+            run()
+
+    transaction.on_commit(submit)
+
+
 # === Shortcut functions ===
 
 def notify_booking_paid(booking):
@@ -220,6 +265,17 @@ def notify_visit(visit):
     )
 
 
+def notify_visit_by_id(visit_id):
+    """notify_visit() для отложенного вызова: перечитывает визит в своём потоке."""
+    from visits.models import Visit
+
+    visit = Visit.objects.select_related(
+        'booking__user', 'booking__storage_unit',
+    ).filter(pk=visit_id).first()
+    if visit:
+        notify_visit(visit)
+
+
 def notify_welcome(user):
     """Приветственное уведомление"""
     NotificationService.send(
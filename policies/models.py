@@ -1,6 +1,24 @@
+from django.core.cache import cache
 from django.db import models
+from django.db.models import Count, Max
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
+# Кэш «какие обязательные политики ещё не приняты». Ключи содержат версию
+# набора политик — число строк и последний updated_at, которые читаются из
+# БД на каждый запрос. Любая правка или удаление Policy (в т.ч. через
+# QuerySet и admin-действия) меняет версию сразу во всех процессах, так что
+# закэшированный список не пропустит новую обязательную политику.
+POLICY_CACHE_TIMEOUT = 300
+
+
+class PolicyQuerySet(models.QuerySet):
+
+    def update(self, **kwargs):
+        # auto_now не срабатывает на UPDATE — без него версия бы не сменилась
+        kwargs.setdefault('updated_at', timezone.now())
+        return super().update(**kwargs)
+
 
 class Policy(models.Model):
     title = models.CharField(max_length=255, verbose_name=_('Title'))
@@ -21,6 +39,8 @@ class Policy(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = PolicyQuerySet.as_manager()
+
     class Meta:
         ordering = ['sort_order']
         verbose_name = _('Policy')
@@ -29,6 +49,47 @@ class Policy(models.Model):
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        # updated_at — часть версии, пишем его и при частичном сохранении
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'updated_at' not in update_fields:
+            kwargs['update_fields'] = [*update_fields, 'updated_at']
+        super().save(*args, **kwargs)
+
+    @staticmethod
+    def version():
+        """Текущая версия набора политик (часть ключей кэша согласий).
+
+        Удаление меняет число строк, создание и правка — последний updated_at.
+        """
+        stats = Policy.objects.order_by().aggregate(count=Count('pk'), latest=Max('updated_at'))
+        latest = stats['latest']
+        return f"{stats['count']}-{int(latest.timestamp() * 1_000_000) if latest else 0}"
+
+    @classmethod
+    def required(cls, version=None):
+        """Активные обязательные политики — из кэша до следующей правки любой политики."""
+        key = f'policies:required:{version or cls.version()}'
+        policies = cache.get(key)
+        if policies is None:
+            policies = list(cls.objects.filter(is_active=True, is_required=True))
+            cache.set(key, policies, timeout=POLICY_CACHE_TIMEOUT)
+        return policies
+
+    @classmethod
+    def unaccepted_by(cls, user, version=None):
+        """Обязательные политики, которые пользователь ещё не принял.
+
+        Обычно — один запрос (версия политик, если её не передали), списки
+        берутся из кэша.
+        """
+        version = version or cls.version()
+        required = cls.required(version)
+        if not required or not user.is_authenticated:
+            return required
+        accepted = PolicyConsent.accepted_ids(user.pk, version)
+        return [policy for policy in required if policy.pk not in accepted]
+
     def get_absolute_url(self):
         from django.urls import reverse
         return reverse('policy_detail', kwargs={'slug': self.slug})
@@ -63,3 +124,31 @@ class PolicyConsent(models.Model):
 
     def __str__(self):
         return f"{self.user.email} — {self.policy.title}"
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        PolicyConsent.forget(self.user_id)
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        PolicyConsent.forget(self.user_id)
+        return result
+
+    @staticmethod
+    def _cache_key(user_id, version=None):
+        return f'policies:consented:{user_id}:{version or Policy.version()}'
+
+    @classmethod
+    def accepted_ids(cls, user_id, version=None):
+        """id политик, принятых пользователем (кэш по версии политик)."""
+        key = cls._cache_key(user_id, version)
+        accepted = cache.get(key)
+        if accepted is None:
+            accepted = set(cls.objects.filter(user_id=user_id).values_list('policy_id', flat=True))
+            cache.set(key, accepted, timeout=POLICY_CACHE_TIMEOUT)
+        return accepted
+
+    @classmethod
+    def forget(cls, user_id, version=None):
+        """Сбросить кэш согласий пользователя — после любой записи согласий."""
+        cache.delete(cls._cache_key(user_id, version))
@@ -1,4 +1,5 @@
 from decimal import Decimal
+from django.core.cache import cache
 from django.test import TestCase, Client
 from django.urls import reverse
 
@@ -79,6 +80,8 @@ class BookingPolicyValidationTest(TestCase):
     """Integration: BookingCreateView rejects without policy acceptance."""
 
     def setUp(self):
+        # Кэш политик переживает откат транзакции теста
+        self.addCleanup(cache.clear)
         self.user = User.objects.create_user(
             email='test@example.com', password='pass123',
             first_name='Test', last_name='User',
@@ -218,6 +221,80 @@ class BookingPolicyValidationTest(TestCase):
         self.assertContains(resp, f'/policy/{self.policy.slug}/')
 
 
+class PolicyConsentCacheTest(TestCase):
+    """Непринятые обязательные политики — из кэша, сброс по версии и записи согласия."""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = User.objects.create_user(
+            email='test@example.com', password='pass123',
+            first_name='Test', last_name='User',
+        )
+        self.terms = Policy.objects.create(title='Terms', slug='terms', content='', is_required=True)
+        self.privacy = Policy.objects.create(title='Privacy', slug='privacy', content='', is_required=True)
+
+    def test_repeat_lookup_reads_only_version(self):
+        self.assertEqual(Policy.unaccepted_by(self.user), [self.terms, self.privacy])
+        with self.assertNumQueries(1):
+            self.assertEqual(Policy.unaccepted_by(self.user), [self.terms, self.privacy])
+
+    def test_consent_write_invalidates_user_entry(self):
+        Policy.unaccepted_by(self.user)
+        PolicyConsent.objects.create(user=self.user, policy=self.terms)
+        self.assertEqual(Policy.unaccepted_by(self.user), [self.privacy])
+        PolicyConsent.objects.filter(user=self.user).delete()
+        # QuerySet.delete не вызывает delete() модели — сбрасываем явно
+        PolicyConsent.forget(self.user.pk)
+        self.assertEqual(Policy.unaccepted_by(self.user), [self.terms, self.privacy])
+
+    def test_policy_save_bumps_version(self):
+        Policy.unaccepted_by(self.user)
+        version = Policy.version()
+        self.privacy.is_required = False
+        self.privacy.save()
+        self.assertNotEqual(Policy.version(), version)
+        self.assertEqual(Policy.unaccepted_by(self.user), [self.terms])
+
+    def test_caller_supplied_version_saves_queries(self):
+        version = Policy.version()
+        Policy.unaccepted_by(self.user, version)
+        with self.assertNumQueries(0):
+            self.assertEqual(Policy.unaccepted_by(self.user, version), [self.terms, self.privacy])
+            PolicyConsent.forget(self.user.pk, version)
+
+        PolicyConsent.objects.bulk_create([PolicyConsent(user=self.user, policy=self.terms)])
+        PolicyConsent.forget(self.user.pk, version)
+        self.assertEqual(Policy.unaccepted_by(self.user, version), [self.privacy])
+
+    def test_version_is_shared_across_processes(self):
+        # Правка в другом процессе: этот процесс о ней не знает, но версия — из БД
+        self.assertEqual(Policy.unaccepted_by(self.user), [self.terms, self.privacy])
+        cookies = Policy.objects.create(title='Cookies', slug='cookies', content='')
+        self.assertEqual(Policy.unaccepted_by(self.user), [self.terms, self.privacy])
+        Policy.objects.filter(pk=cookies.pk).update(is_required=True)
+        self.assertCountEqual(Policy.unaccepted_by(self.user), [self.terms, self.privacy, cookies])
+
+    def test_bulk_changes_bump_version(self):
+        Policy.unaccepted_by(self.user)
+        Policy.objects.filter(pk=self.privacy.pk).update(is_active=False)
+        self.assertEqual(Policy.unaccepted_by(self.user), [self.terms])
+
+        self.terms.is_required = False
+        self.terms.save(update_fields=['is_required'])
+        self.assertEqual(Policy.unaccepted_by(self.user), [])
+
+        Policy.objects.update(is_active=True, is_required=True)
+        self.assertEqual(Policy.unaccepted_by(self.user), [self.terms, self.privacy])
+        Policy.objects.filter(pk=self.privacy.pk).delete()
+        self.assertEqual(Policy.unaccepted_by(self.user), [self.terms])
+
+    def test_anonymous_user_sees_all_required(self):
+        from django.contrib.auth.models import AnonymousUser
+
+        self.assertEqual(Policy.unaccepted_by(AnonymousUser()), [self.terms, self.privacy])
+
+
 class FooterPoliciesTest(TestCase):
 
     def test_footer_shows_active_policies(self):
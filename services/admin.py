@@ -207,13 +207,23 @@ class SectionAdmin(admin.ModelAdmin):
 
 @admin.register(StorageUnit)
 class StorageUnitAdmin(admin.ModelAdmin):
-    list_display = ('full_code', 'section', 'unit_number', 'is_available', 'is_active')
+    list_display = ('full_code', 'section', 'unit_number', 'occupant', 'is_available', 'is_active')
     list_filter = ('section__location', 'section__service', 'section', 'is_available', 'is_active')
     list_editable = ('is_available', 'is_active')
-    search_fields = ('unit_number', 'section__name', 'section__location__name')
+    list_select_related = ('section__location',)
+    search_fields = ('full_code', 'unit_number', 'section__name', 'location_name')
     ordering = ('section', 'unit_number')
     autocomplete_fields = ('section',)
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_current_booking()
+
+    def occupant(self, obj):
+        booking = obj.current_booking
+        return booking.user.email if booking else '—'
+
+    occupant.short_description = _('Occupant')
+
     fieldsets = (
         (None, {
             'fields': ('section', 'unit_number')
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from services.models import StorageUnit
+
+
+class Command(BaseCommand):
+    help = 'Recompute denormalized StorageUnit.full_code and location_name from section and location.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Rows per read chunk and bulk update (default: 500).',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Count units with a stale code without writing.',
+        )
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            stale = 0
+            units = StorageUnit.objects.select_related('section__location').iterator(
+                chunk_size=options['batch_size'],
+            )
+            for unit in units:
+                before = (unit.full_code, unit.location_name)
+                unit.fill_code()
+                if (unit.full_code, unit.location_name) != before:
+                    stale += 1
+            self.stdout.write(f'[DRY RUN] Would update {stale} unit(s).')
+            return
+
+        updated = StorageUnit.refresh_codes(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Updated {updated} unit(s).'))
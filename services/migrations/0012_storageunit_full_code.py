@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0011_service_addons_label_service_addons_label_ar_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storageunit',
+            name='full_code',
+            field=models.CharField(blank=True, db_index=True, editable=False, help_text='Location-Section-Number', max_length=160, verbose_name='Full code'),
+        ),
+        migrations.AddField(
+            model_name='storageunit',
+            name='location_name',
+            field=models.CharField(blank=True, editable=False, max_length=255, verbose_name='Location'),
+        ),
+    ]
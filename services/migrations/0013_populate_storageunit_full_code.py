@@ -0,0 +1,25 @@
+from django.db import migrations
+
+
+def populate_full_code(apps, schema_editor):
+    # Исторические модели без методов — повторяем StorageUnit.fill_code()
+    StorageUnit = apps.get_model('services', 'StorageUnit')
+    units = []
+    for unit in StorageUnit.objects.select_related('section__location').iterator(chunk_size=500):
+        location = unit.section.location
+        location_name = getattr(location, 'name_en', '') or location.name
+        unit.location_name = location_name
+        unit.full_code = f"{location_name[:3].upper()}-{unit.section.name}-{unit.unit_number}"
+        units.append(unit)
+    StorageUnit.objects.bulk_update(units, ['full_code', 'location_name'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0012_storageunit_full_code'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_full_code, migrations.RunPython.noop),
+    ]
@@ -108,6 +108,17 @@ class Tariff(models.Model):
             is_available=True
         ).count()
 
+    def has_available_units(self, quantity=1):
+        """Есть ли `quantity` свободных мест — LIMIT вместо COUNT по всем юнитам."""
+        free = StorageUnit.objects.filter(
+            section__service_id=self.service_id,
+            section__location_id=self.location_id,
+            section__is_active=True,
+            is_active=True,
+            is_available=True
+        ).values_list('pk', flat=True)[:quantity]
+        return len(free) == quantity
+
     @property
     def availability_percent(self):
         """Процент свободных мест"""
@@ -480,6 +491,28 @@ class Section(models.Model):
     def __str__(self):
         return f"{self.location.name} — {self.name}"
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # Имя секции входит в full_code юнитов
+        StorageUnit.refresh_codes(StorageUnit.objects.filter(section=self))
+
+
+class StorageUnitQuerySet(models.QuerySet):
+
+    def with_current_booking(self, today=None, related=()):
+        """Подгрузить current_booking (с клиентом) всем юнитам одним запросом.
+
+        Брони приходят с аннотациями with_display_status(today), так что
+        is_overdue / days_remaining в шаблоне тоже не ходят в БД.
+        `related` — дополнительные select_related для брони.
+        """
+        from bookings.models import Booking
+
+        bookings = Booking.objects.occupying().with_display_status(today).select_related('user', *related)
+        return self.prefetch_related(
+            models.Prefetch('bookings', queryset=bookings, to_attr='prefetched_current_bookings')
+        )
+
 
 class StorageUnit(models.Model):
     """Место для аренды"""
@@ -494,6 +527,27 @@ class StorageUnit(models.Model):
     is_available = models.BooleanField(default=True, verbose_name=_('Available'), help_text=_('Available for booking'))
     is_active = models.BooleanField(default=True, verbose_name=_('Active'), help_text=_('Active in system'))
 
+    # Денормализация: поддерживается save() юнита/секции/локации,
+    # пересчитывается командой recompute_unit_codes
+    full_code = models.CharField(
+        max_length=160,
+        blank=True,
+        editable=False,
+        db_index=True,
+        verbose_name=_('Full code'),
+        help_text=_('Location-Section-Number')
+    )
+    location_name = models.CharField(
+        max_length=255,
+        blank=True,
+        editable=False,
+        verbose_name=_('Location')
+    )
+
+    CODE_SOURCE_FIELDS = {'section', 'unit_number'}
+
+    objects = StorageUnitQuerySet.as_manager()
+
     class Meta:
         ordering = ['section', 'unit_number']
         verbose_name = _('Storage unit')
@@ -503,14 +557,49 @@ class StorageUnit(models.Model):
     def __str__(self):
         return f"{self.section.name}-{self.unit_number}"
 
-    @property
-    def full_code(self):
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or self.CODE_SOURCE_FIELDS.intersection(update_fields):
+            self.fill_code()
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | {'full_code', 'location_name'}
+        super().save(*args, **kwargs)
+
+    @staticmethod
+    def location_label(location):
+        """Имя локации на языке по умолчанию — код не должен зависеть от языка запроса."""
+        from modeltranslation.settings import DEFAULT_LANGUAGE
+        from modeltranslation.utils import build_localized_fieldname
+
+        return getattr(location, build_localized_fieldname('name', DEFAULT_LANGUAGE), '') or location.name
+
+    def fill_code(self):
         """Полный код места: Location-Section-Number"""
-        return f"{self.section.location.name[:3].upper()}-{self.section.name}-{self.unit_number}"
+        location_name = self.location_label(self.section.location)
+        self.location_name = location_name
+        self.full_code = f"{location_name[:3].upper()}-{self.section.name}-{self.unit_number}"
+
+    @classmethod
+    def refresh_codes(cls, queryset=None, batch_size=500):
+        """Пересчитать full_code/location_name; пишет только изменившиеся. Возвращает их число."""
+        queryset = cls.objects.all() if queryset is None else queryset
+        changed = []
+        for unit in queryset.select_related('section__location').order_by('pk').iterator(chunk_size=batch_size):
+            before = (unit.full_code, unit.location_name)
+            unit.fill_code()
+            if (unit.full_code, unit.location_name) != before:
+                changed.append(unit)
+        cls.objects.bulk_update(changed, ['full_code', 'location_name'], batch_size=batch_size)
+        return len(changed)
 
     @property
     def current_booking(self):
-        """Текущее бронирование (PAID — включая просроченные, пока юнит не освобождён)."""
+        """Текущее бронирование (PAID — включая просроченные, пока юнит не освобождён).
+
+        Списки юнитов берут его из with_current_booking(), без запроса на строку.
+        """
+        if hasattr(self, 'prefetched_current_bookings'):
+            return self.prefetched_current_bookings[0] if self.prefetched_current_bookings else None
         return self.bookings.filter(
             status='paid', parent_booking__isnull=True,
         ).select_related('user').first()
\ No newline at end of file
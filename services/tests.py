@@ -204,3 +204,88 @@ class TariffPriceTierDataMigrationTest(ServiceTestMixin, TestCase):
         self.assertEqual(self.period.get_unit_price(1), Decimal('500.00'))
         self.assertEqual(self.period.get_unit_price(5), Decimal('500.00'))
         self.assertEqual(self.period.get_unit_price(100), Decimal('500.00'))
+
+
+class StorageUnitFullCodeTest(ServiceTestMixin, TestCase):
+    """Денормализованные full_code / location_name юнита."""
+
+    def setUp(self):
+        self.create_base_objects()
+        self.section = Section.objects.create(
+            location=self.location, service=self.service, name='A',
+        )
+        self.unit = StorageUnit.objects.create(section=self.section, unit_number='01')
+
+    def test_code_set_on_create(self):
+        self.unit.refresh_from_db()
+        self.assertEqual(self.unit.full_code, 'DUB-A-01')
+        self.assertEqual(self.unit.location_name, 'Dubai')
+
+    def test_code_independent_of_active_language(self):
+        from django.utils import translation
+
+        self.location.name_ru = 'Дубай'
+        self.location.save()
+        with translation.override('ru'):
+            unit = StorageUnit.objects.create(section=self.section, unit_number='02')
+        self.assertEqual(unit.full_code, 'DUB-A-02')
+
+    def test_admin_search_by_location_and_section_name(self):
+        from django.contrib.admin.sites import site
+        from django.test import RequestFactory
+
+        model_admin = site._registry[StorageUnit]
+        request = RequestFactory().get('/')
+        for term in ('Dubai', 'A', 'DUB-A-01'):
+            with self.subTest(term=term):
+                results, _ = model_admin.get_search_results(request, StorageUnit.objects.all(), term)
+                self.assertIn(self.unit, results)
+
+    def test_section_rename_updates_units(self):
+        self.section.name = 'B'
+        self.section.save()
+        self.unit.refresh_from_db()
+        self.assertEqual(self.unit.full_code, 'DUB-B-01')
+
+    def test_location_rename_updates_units(self):
+        self.location.name = 'Sharjah'
+        self.location.name_en = 'Sharjah'
+        self.location.save()
+        self.unit.refresh_from_db()
+        self.assertEqual(self.unit.full_code, 'SHA-A-01')
+        self.assertEqual(self.unit.location_name, 'Sharjah')
+
+    def test_partial_save_skips_recompute(self):
+        unit = StorageUnit.objects.only('pk', 'is_available').get(pk=self.unit.pk)
+        unit.is_available = False
+        # Без загрузки секции/локации: иначе был бы запрос на section
+        with self.assertNumQueries(1):
+            unit.save(update_fields=['is_available'])
+
+    def test_unit_number_change_recomputes(self):
+        self.unit.unit_number = '07'
+        self.unit.save(update_fields=['unit_number'])
+        self.unit.refresh_from_db()
+        self.assertEqual(self.unit.full_code, 'DUB-A-07')
+
+    def test_recompute_command_repairs_drift(self):
+        from io import StringIO
+        from django.core.management import call_command
+
+        StorageUnit.objects.filter(pk=self.unit.pk).update(full_code='stale', location_name='')
+
+        out = StringIO()
+        call_command('recompute_unit_codes', '--dry-run', stdout=out)
+        self.assertIn('Would update 1 unit(s)', out.getvalue())
+        self.assertEqual(StorageUnit.objects.get(pk=self.unit.pk).full_code, 'stale')
+
+        call_command('recompute_unit_codes', stdout=out)
+        self.unit.refresh_from_db()
+        self.assertEqual(self.unit.full_code, 'DUB-A-01')
+        self.assertEqual(StorageUnit.refresh_codes(), 0)
+
+    def test_search_by_full_code(self):
+        self.assertEqual(
+            list(StorageUnit.objects.filter(full_code__icontains='dub-a')),
+            [self.unit],
+        )
@@ -1,3 +1,5 @@
+import uuid
+
 from django.shortcuts import render, get_object_or_404, redirect
 from django.views import View
 from .models import Service, Tariff
@@ -47,14 +49,9 @@ class TariffDetailView(View):
         # Доп. услуги
         addons = service.addons.filter(is_active=True)
 
-        # Обязательные политики (только ещё не принятые)
-        from policies.models import Policy, PolicyConsent
-        required_policies = Policy.objects.filter(is_active=True, is_required=True)
-        if request.user.is_authenticated:
-            accepted_policy_ids = PolicyConsent.objects.filter(
-                user=request.user
-            ).values_list('policy_id', flat=True)
-            required_policies = required_policies.exclude(id__in=accepted_policy_ids)
+        # Обязательные политики (только ещё не принятые) — из кэша согласий
+        from policies.models import Policy
+        required_policies = Policy.unaccepted_by(request.user)
 
         # Price range for JSON-LD
         prices = [p.base_price for p in periods]
@@ -67,6 +64,8 @@ class TariffDetailView(View):
             'periods': periods,
             'addons': addons,
             'required_policies': required_policies,
+            # Токен формы: повторная отправка не создаст вторую бронь
+            'idempotency_key': uuid.uuid4().hex,
             'min_price': min_price,
             'max_price': max_price,
         })
\ No newline at end of file
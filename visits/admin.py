@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import AccessToken, Visit
+from .models import AccessToken, GuestTokenRedemption, Visit, VisitArchive, VisitDailyStat
 
 
 @admin.register(AccessToken)
@@ -14,9 +14,29 @@ class AccessTokenAdmin(admin.ModelAdmin):
     token_short.short_description = 'Token'
 
 
+@admin.register(GuestTokenRedemption)
+class GuestTokenRedemptionAdmin(admin.ModelAdmin):
+    list_display = ['nonce', 'booking', 'guest_name', 'redeemed_at', 'expires_at']
+    search_fields = ['nonce', 'guest_name', 'booking__user__email']
+    readonly_fields = ['nonce', 'booking', 'guest_name', 'redeemed_at', 'expires_at']
+
+
 @admin.register(Visit)
 class VisitAdmin(admin.ModelAdmin):
     list_display = ['unit_code', 'location_name', 'visitor_type', 'visitor_name', 'scanned_by_name', 'visited_at']
     list_filter = ['visitor_type', 'location_name', 'visited_at']
     search_fields = ['booking__user__email', 'visitor_name', 'unit_code', 'location_name']
-    readonly_fields = ['visited_at', 'unit_code', 'location_name', 'scanned_by_name']
\ No newline at end of file
+    readonly_fields = ['visited_at', 'unit_code', 'location_name', 'scanned_by_name']
+
+
+@admin.register(VisitDailyStat)
+class VisitDailyStatAdmin(admin.ModelAdmin):
+    list_display = ['day', 'location_name', 'visitor_type', 'count']
+    list_filter = ['visitor_type', 'location_name', 'day']
+    readonly_fields = ['day', 'location_name', 'visitor_type', 'count']
+
+
+@admin.register(VisitArchive)
+class VisitArchiveAdmin(admin.ModelAdmin):
+    list_display = ['month', 'visit_count', 'path', 'archived_at']
+    readonly_fields = ['month', 'path', 'visit_count', 'archived_at']
@@ -0,0 +1,84 @@
+import gzip
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from core.db import delete_in_chunks
+from visits.models import Visit, VisitArchive
+
+
+def next_month(month):
+    return (month.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+class Command(BaseCommand):
+    help = 'Move closed months of raw Visit rows to gzipped JSON Lines files and delete them from the DB.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--keep-months',
+            type=int,
+            default=12,
+            help='Full months to keep in the DB before the current one (default: 12).',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Rows per read chunk and delete transaction (default: 1000).',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report months that would be archived without writing.',
+        )
+
+    def handle(self, *args, **options):
+        current = timezone.localdate().replace(day=1)
+        cutoff = current
+        for _ in range(max(options['keep_months'], 0)):
+            cutoff = (cutoff - timedelta(days=1)).replace(day=1)
+
+        oldest = Visit.objects.between(date_to=cutoff - timedelta(days=1)).order_by('visited_at').first()
+        if oldest is None:
+            self.stdout.write('Nothing to archive.')
+            return
+
+        month = timezone.localdate(oldest.visited_at).replace(day=1)
+        while month < cutoff:
+            self.archive_month(month, options)
+            month = next_month(month)
+
+    def archive_month(self, month, options):
+        visits = Visit.objects.between(month, next_month(month) - timedelta(days=1))
+        count = visits.count()
+        if not count:
+            return
+        if options['dry_run']:
+            self.stdout.write(f'[DRY RUN] Would archive {count} visit(s) for {month:%Y-%m}.')
+            return
+
+        archive_dir = settings.VISIT_ARCHIVE_DIR
+        archive_dir.mkdir(parents=True, exist_ok=True)
+        # Повторный прогон по месяцу (поздние визиты) пишет отдельный файл
+        path = archive_dir / f'visits-{month:%Y-%m}-{timezone.now():%Y%m%d%H%M%S}.jsonl.gz'
+        columns = [field.attname for field in Visit._meta.concrete_fields]
+
+        written = 0
+        last_pk = None
+        with gzip.open(path, 'wt', encoding='utf-8') as fh:
+            for row in visits.order_by('pk').values(*columns).iterator(chunk_size=options['batch_size']):
+                fh.write(json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n')
+                written += 1
+                last_pk = row['id']
+
+        VisitArchive.objects.create(month=month, path=str(path), visit_count=written)
+        # Удаляем только то, что попало в файл
+        deleted = delete_in_chunks(visits.filter(pk__lte=last_pk), batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Archived {written} visit(s) for {month:%Y-%m} to {path} (deleted {deleted}).'
+        ))
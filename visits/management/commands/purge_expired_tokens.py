@@ -0,0 +1,62 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from accounts.models import TelegramLinkToken
+from core.db import delete_in_chunks
+from visits.models import AccessToken, GuestTokenRedemption
+from visits.services import MAX_OFFLINE_AGE
+
+
+class Command(BaseCommand):
+    help = 'Delete expired QR access tokens, guest redemptions and Telegram link tokens in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--keep-hours',
+            type=int,
+            default=24,
+            help='Keep tokens that expired less than this many hours ago (default: 24).',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Rows per delete transaction (default: 1000).',
+        )
+        parser.add_argument(
+            '--pause',
+            type=float,
+            default=0.0,
+            help='Seconds to sleep between batches (default: 0).',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Count rows that would be deleted without deleting.',
+        )
+
+    def handle(self, *args, **options):
+        keep = timedelta(hours=options['keep_hours'])
+        if keep <= MAX_OFFLINE_AGE:
+            # Отложенный скан гостевого кода должен ещё застать запись о погашении
+            raise CommandError(f'--keep-hours must exceed the offline scan window ({MAX_OFFLINE_AGE}).')
+        cutoff = timezone.now() - keep
+
+        targets = [
+            ('access token(s)', AccessToken.objects.filter(expires_at__lt=cutoff)),
+            # Гостевой токен после истечения не пройдёт проверку подписи —
+            # запись о погашении больше не нужна
+            ('guest redemption(s)', GuestTokenRedemption.objects.filter(expires_at__lt=cutoff)),
+            ('Telegram link token(s)', TelegramLinkToken.objects.filter(expires_at__lt=cutoff)),
+        ]
+
+        for label, queryset in targets:
+            if options['dry_run']:
+                self.stdout.write(f'[DRY RUN] Would delete {queryset.count()} {label}.')
+                continue
+            deleted = delete_in_chunks(
+                queryset, batch_size=options['batch_size'], pause=options['pause'],
+            )
+            self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} {label}.'))
@@ -0,0 +1,25 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from visits.models import VisitDailyStat
+
+
+class Command(BaseCommand):
+    help = 'Rebuild daily visit counters (VisitDailyStat) from raw Visit rows.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date-from', type=str, help='First day to rebuild (YYYY-MM-DD).')
+        parser.add_argument('--date-to', type=str, help='Last day to rebuild (YYYY-MM-DD).')
+
+    def handle(self, *args, **options):
+        try:
+            date_from = date.fromisoformat(options['date_from']) if options['date_from'] else None
+            date_to = date.fromisoformat(options['date_to']) if options['date_to'] else None
+        except ValueError as e:
+            raise CommandError(f'Invalid date: {e}')
+
+        rows = VisitDailyStat.rebuild(date_from, date_to)
+
+        scope = f"{date_from or '…'} — {date_to or '…'}"
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {rows} daily visit counter(s) for {scope}.'))
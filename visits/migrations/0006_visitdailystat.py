@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('visits', '0005_populate_visit_snapshots'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VisitDailyStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='Day')),
+                ('location_name', models.CharField(blank=True, help_text='Location name snapshot, as stored on Visit', max_length=255, verbose_name='Location')),
+                ('visitor_type', models.CharField(choices=[('owner', 'Owner'), ('guest', 'Guest')], max_length=10, verbose_name='Visitor type')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='Visits')),
+            ],
+            options={
+                'verbose_name': 'Daily visit stat',
+                'verbose_name_plural': 'Daily visit stats',
+                'ordering': ['-day'],
+                'constraints': [models.UniqueConstraint(fields=('day', 'location_name', 'visitor_type'), name='uniq_visit_stat_day_location_type')],
+            },
+        ),
+    ]
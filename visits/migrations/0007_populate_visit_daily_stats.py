@@ -0,0 +1,38 @@
+from django.db import migrations
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+
+
+def populate_daily_stats(apps, schema_editor):
+    Visit = apps.get_model('visits', 'Visit')
+    VisitDailyStat = apps.get_model('visits', 'VisitDailyStat')
+    rows = (
+        Visit.objects.annotate(day=TruncDate('visited_at'))
+        .values('day', 'location_name', 'visitor_type')
+        .annotate(total=Count('id'))
+        .order_by()
+    )
+    VisitDailyStat.objects.bulk_create([
+        VisitDailyStat(
+            day=row['day'],
+            location_name=row['location_name'],
+            visitor_type=row['visitor_type'],
+            count=row['total'],
+        )
+        for row in rows
+    ])
+
+
+def clear_daily_stats(apps, schema_editor):
+    apps.get_model('visits', 'VisitDailyStat').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('visits', '0006_visitdailystat'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_daily_stats, clear_daily_stats),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0013_remove_active_expired_status'),
+        ('visits', '0007_populate_visit_daily_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GuestTokenRedemption',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nonce', models.CharField(max_length=32, unique=True, verbose_name='Nonce')),
+                ('guest_name', models.CharField(blank=True, max_length=255, verbose_name='Guest name')),
+                ('expires_at', models.DateTimeField(verbose_name='Expires at')),
+                ('redeemed_at', models.DateTimeField(auto_now_add=True, verbose_name='Redeemed at')),
+                ('booking', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='guest_redemptions', to='bookings.booking', verbose_name='Booking')),
+            ],
+            options={
+                'verbose_name': 'Guest token redemption',
+                'verbose_name_plural': 'Guest token redemptions',
+                'ordering': ['-redeemed_at'],
+            },
+        ),
+    ]
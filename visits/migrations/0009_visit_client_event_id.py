@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:12
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('visits', '0008_guesttokenredemption'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='visit',
+            name='client_event_id',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True, verbose_name='Client event ID'),
+        ),
+        migrations.AlterField(
+            model_name='visit',
+            name='visited_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='Visited at'),
+        ),
+    ]
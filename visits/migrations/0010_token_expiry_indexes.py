@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0013_remove_active_expired_status'),
+        ('services', '0011_service_addons_label_service_addons_label_ar_and_more'),
+        ('visits', '0009_visit_client_event_id'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='accesstoken',
+            index=models.Index(fields=['expires_at'], name='idx_token_expires'),
+        ),
+        migrations.AddIndex(
+            model_name='guesttokenredemption',
+            index=models.Index(fields=['expires_at'], name='idx_guest_redemption_expires'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:30
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def populate_visit_user(apps, schema_editor):
+    Visit = apps.get_model('visits', 'Visit')
+    Booking = apps.get_model('bookings', 'Booking')
+    Visit.objects.filter(user__isnull=True).update(
+        user_id=Subquery(Booking.objects.filter(pk=OuterRef('booking_id')).values('user_id')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0013_remove_active_expired_status'),
+        ('visits', '0010_token_expiry_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='visit',
+            name='user',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='visits', to=settings.AUTH_USER_MODEL, verbose_name='Owner'),
+        ),
+        migrations.RunPython(populate_visit_user, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='visit',
+            index=models.Index(fields=['user', '-visited_at', '-id'], name='idx_visit_user_time'),
+        ),
+    ]
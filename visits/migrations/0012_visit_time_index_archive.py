@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:34
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0013_remove_active_expired_status'),
+        ('visits', '0011_visit_user_history_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VisitArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(help_text='First day of the archived month', verbose_name='Month')),
+                ('path', models.CharField(max_length=500, verbose_name='File')),
+                ('visit_count', models.PositiveIntegerField(default=0, verbose_name='Visits')),
+                ('archived_at', models.DateTimeField(auto_now_add=True, verbose_name='Archived at')),
+            ],
+            options={
+                'verbose_name': 'Visit archive',
+                'verbose_name_plural': 'Visit archives',
+                'ordering': ['-month'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='visit',
+            index=models.Index(fields=['-visited_at'], name='idx_visit_time'),
+        ),
+    ]
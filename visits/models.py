@@ -1,8 +1,9 @@
 import secrets
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models import F, Sum, Q
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
-from datetime import timedelta
+from datetime import datetime, time, timedelta
 
 
 class AccessToken(models.Model):
@@ -55,6 +56,10 @@ class AccessToken(models.Model):
         ordering = ['-created_at']
         verbose_name = _('Access token')
         verbose_name_plural = _('Access tokens')
+        indexes = [
+            # purge_expired_tokens
+            models.Index(fields=['expires_at'], name='idx_token_expires'),
+        ]
 
     def __str__(self):
         unit = self.storage_unit or self.booking.storage_unit
@@ -88,6 +93,56 @@ class AccessToken(models.Model):
         self.save(update_fields=['is_used', 'used_at'])
 
 
+class GuestTokenRedemption(models.Model):
+    """Погашение одноразового гостевого QR (подписанный токен, visits.tokens).
+
+    Сами токены в БД не хранятся — здесь только nonce уже использованных.
+    """
+
+    nonce = models.CharField(max_length=32, unique=True, verbose_name=_('Nonce'))
+    booking = models.ForeignKey(
+        'bookings.Booking',
+        on_delete=models.CASCADE,
+        related_name='guest_redemptions',
+        verbose_name=_('Booking')
+    )
+    guest_name = models.CharField(max_length=255, blank=True, verbose_name=_('Guest name'))
+    expires_at = models.DateTimeField(verbose_name=_('Expires at'))
+    redeemed_at = models.DateTimeField(auto_now_add=True, verbose_name=_('Redeemed at'))
+
+    class Meta:
+        ordering = ['-redeemed_at']
+        verbose_name = _('Guest token redemption')
+        verbose_name_plural = _('Guest token redemptions')
+        indexes = [
+            models.Index(fields=['expires_at'], name='idx_guest_redemption_expires'),
+        ]
+
+    def __str__(self):
+        return f"{self.guest_name or '—'} — {self.nonce}"
+
+
+def local_midnight(day):
+    """Начало локального дня (TIME_ZONE) как aware datetime."""
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+class VisitQuerySet(models.QuerySet):
+
+    def between(self, date_from=None, date_to=None):
+        """Визиты за локальные дни [date_from, date_to] диапазоном по visited_at.
+
+        `visited_at__date` оборачивает колонку в функцию и не использует
+        индекс; полуинтервал [полночь date_from, полночь date_to + 1) — использует.
+        """
+        qs = self
+        if date_from:
+            qs = qs.filter(visited_at__gte=local_midnight(date_from))
+        if date_to:
+            qs = qs.filter(visited_at__lt=local_midnight(date_to + timedelta(days=1)))
+        return qs
+
+
 class Visit(models.Model):
     """Запись посещения"""
 
@@ -109,6 +164,16 @@ class Visit(models.Model):
         related_name='visits',
         verbose_name=_('Access token')
     )
+    # Владелец брони — копия booking.user для индекса истории (user, visited_at)
+    user = models.ForeignKey(
+        'accounts.User',
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        editable=False,
+        related_name='visits',
+        verbose_name=_('Owner')
+    )
 
     visitor_type = models.CharField(
         max_length=10,
@@ -153,29 +218,240 @@ class Visit(models.Model):
         help_text=_('Snapshot of manager name at time of visit')
     )
 
-    visited_at = models.DateTimeField(auto_now_add=True, verbose_name=_('Visited at'))
+    # default, а не auto_now_add — офлайн-сканер присылает время скана с устройства
+    visited_at = models.DateTimeField(default=timezone.now, verbose_name=_('Visited at'))
     notes = models.TextField(blank=True, verbose_name=_('Notes'))
 
+    # Ключ идемпотентности события офлайн-сканера (ScanBatchView)
+    client_event_id = models.CharField(
+        max_length=64,
+        null=True,
+        blank=True,
+        unique=True,
+        verbose_name=_('Client event ID')
+    )
+
+    objects = VisitQuerySet.as_manager()
+
+    # Снепшот-колонки, которых хватает для истории посещений
+    HISTORY_COLUMNS = ('id', 'unit_code', 'location_name', 'visitor_type', 'visitor_name', 'visited_at')
+
     class Meta:
         ordering = ['-visited_at']
         verbose_name = _('Visit')
         verbose_name_plural = _('Visits')
+        indexes = [
+            # Курсорная история: WHERE user_id = … ORDER BY visited_at DESC, id DESC
+            models.Index(fields=['user', '-visited_at', '-id'], name='idx_visit_user_time'),
+            # Диапазоны по дням (between) и лента бэкофиса
+            models.Index(fields=['-visited_at'], name='idx_visit_time'),
+        ]
 
     def __str__(self):
         return f"{self.unit_code or '—'} — {self.visited_at.strftime('%Y-%m-%d %H:%M')}"
 
+    def fill_snapshot(self):
+        """Зафиксировать снепшоты юнита/локации/менеджера на момент визита."""
+        if self.user_id is None and self.booking_id:
+            self.user_id = self.booking.user_id
+        if not self.unit_code:
+            unit = None
+            if self.access_token and self.access_token.storage_unit:
+                unit = self.access_token.storage_unit
+            elif self.booking and self.booking.storage_unit:
+                unit = self.booking.storage_unit
+            if unit:
+                self.unit_code = unit.full_code
+                self.location_name = unit.location_name
+        if not self.scanned_by_name and self.scanned_by:
+            self.scanned_by_name = self.scanned_by.get_full_name() or self.scanned_by.email
+
     def save(self, *args, **kwargs):
-        if not self.pk:
-            # Зафиксировать снепшоты при создании
-            if not self.unit_code:
-                unit = None
-                if self.access_token and self.access_token.storage_unit:
-                    unit = self.access_token.storage_unit
-                elif self.booking and self.booking.storage_unit:
-                    unit = self.booking.storage_unit
-                if unit:
-                    self.unit_code = unit.full_code
-                    self.location_name = unit.section.location.name
-            if not self.scanned_by_name and self.scanned_by:
-                self.scanned_by_name = self.scanned_by.get_full_name() or self.scanned_by.email
-        super().save(*args, **kwargs)
\ No newline at end of file
+        is_new = self.pk is None
+        if is_new:
+            self.fill_snapshot()
+        super().save(*args, **kwargs)
+        if is_new:
+            VisitDailyStat.record(self)
+            from accounts.models import User
+            from dashboard.services import bump_cabinet_version
+            User.note_visit(self.booking.user_id, self.visited_at)
+            bump_cabinet_version(self.booking.user_id)
+
+    @classmethod
+    def bulk_record(cls, visits):
+        """bulk_create с тем же, что делает save() для новых визитов:
+        снепшоты, дневные счётчики, last_visit_at владельцев, версия кабинета."""
+        from accounts.models import User
+        from dashboard.services import bump_cabinet_version
+
+        for visit in visits:
+            visit.fill_snapshot()
+        created = cls.objects.bulk_create(visits)
+
+        VisitDailyStat.record_many(created)
+        last_by_user = {}
+        for visit in created:
+            user_id = visit.booking.user_id
+            if user_id not in last_by_user or last_by_user[user_id] < visit.visited_at:
+                last_by_user[user_id] = visit.visited_at
+        for user_id, visited_at in last_by_user.items():
+            User.note_visit(user_id, visited_at)
+        bump_cabinet_version(*last_by_user)
+        return created
+
+
+class VisitDailyStat(models.Model):
+    """Счётчик посещений за день (day, location, visitor_type).
+
+    Инкрементируется при создании Visit — графики и статистика backoffice
+    читают отсюда вместо group-by по сырым визитам. Пересобирается командой
+    rebuild_visit_stats.
+    """
+
+    day = models.DateField(verbose_name=_('Day'))
+    location_name = models.CharField(
+        max_length=255,
+        blank=True,
+        verbose_name=_('Location'),
+        help_text=_('Location name snapshot, as stored on Visit')
+    )
+    visitor_type = models.CharField(
+        max_length=10,
+        choices=Visit.VisitorType.choices,
+        verbose_name=_('Visitor type')
+    )
+    count = models.PositiveIntegerField(default=0, verbose_name=_('Visits'))
+
+    class Meta:
+        ordering = ['-day']
+        verbose_name = _('Daily visit stat')
+        verbose_name_plural = _('Daily visit stats')
+        constraints = [
+            models.UniqueConstraint(
+                fields=['day', 'location_name', 'visitor_type'],
+                name='uniq_visit_stat_day_location_type',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.day} — {self.location_name or '—'} — {self.visitor_type}: {self.count}"
+
+    @staticmethod
+    def _key(visit):
+        return {
+            'day': timezone.localdate(visit.visited_at),
+            'location_name': visit.location_name,
+            'visitor_type': visit.visitor_type,
+        }
+
+    @classmethod
+    def record(cls, visit, amount=1):
+        """Прибавить визит к счётчику его дня (по локальной дате Asia/Dubai)."""
+        cls._bump(cls._key(visit), amount)
+
+    @classmethod
+    def record_many(cls, visits):
+        """То же для пачки визитов — один UPDATE на (день, локация, тип)."""
+        totals = {}
+        for visit in visits:
+            key = tuple(cls._key(visit).items())
+            totals[key] = totals.get(key, 0) + 1
+        for key, amount in totals.items():
+            cls._bump(dict(key), amount)
+
+    @classmethod
+    def _bump(cls, key, amount):
+        if cls.objects.filter(**key).update(count=F('count') + amount):
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(count=amount, **key)
+        except IntegrityError:
+            # Параллельный скан успел создать строку — просто инкрементируем
+            cls.objects.filter(**key).update(count=F('count') + amount)
+
+    @classmethod
+    def counts_by_day(cls, date_from, date_to):
+        """{date: total} за диапазон (включительно). Пустые дни отсутствуют."""
+        return dict(
+            cls.objects.filter(day__gte=date_from, day__lte=date_to)
+            .values('day').annotate(total=Sum('count'))
+            .values_list('day', 'total')
+        )
+
+    @classmethod
+    def totals(cls, date_from, date_to):
+        """Сумма визитов за диапазон: total / owners / guests."""
+        result = cls.objects.filter(day__gte=date_from, day__lte=date_to).aggregate(
+            total=Sum('count'),
+            owners=Sum('count', filter=Q(visitor_type=Visit.VisitorType.OWNER)),
+            guests=Sum('count', filter=Q(visitor_type=Visit.VisitorType.GUEST)),
+        )
+        return {key: value or 0 for key, value in result.items()}
+
+    @classmethod
+    def rebuild(cls, date_from=None, date_to=None):
+        """Пересчитать счётчики из сырых Visit за диапазон (или за всё время)."""
+        from django.db.models import Count
+        from django.db.models.functions import TruncDate
+
+        # Сырые визиты архивных месяцев удалены — их счётчики не трогаем
+        archived_until = VisitArchive.archived_until()
+        if archived_until and (date_from is None or date_from < archived_until):
+            date_from = archived_until
+
+        stats = cls.objects.all()
+        if date_from:
+            stats = stats.filter(day__gte=date_from)
+        if date_to:
+            stats = stats.filter(day__lte=date_to)
+        visits = Visit.objects.between(date_from, date_to)
+
+        rows = (
+            visits.annotate(day=TruncDate('visited_at'))
+            .values('day', 'location_name', 'visitor_type')
+            .annotate(total=Count('id'))
+            .order_by()
+        )
+        with transaction.atomic():
+            stats.delete()
+            created = cls.objects.bulk_create([
+                cls(
+                    day=row['day'],
+                    location_name=row['location_name'],
+                    visitor_type=row['visitor_type'],
+                    count=row['total'],
+                )
+                for row in rows
+            ])
+        return len(created)
+
+
+class VisitArchive(models.Model):
+    """Закрытый месяц визитов, выгруженный в сжатый файл (archive_visits).
+
+    Сырые Visit этого месяца удалены из БД; дневные счётчики VisitDailyStat
+    остаются, так что графики за архивные месяцы не меняются.
+    """
+
+    month = models.DateField(verbose_name=_('Month'), help_text=_('First day of the archived month'))
+    path = models.CharField(max_length=500, verbose_name=_('File'))
+    visit_count = models.PositiveIntegerField(default=0, verbose_name=_('Visits'))
+    archived_at = models.DateTimeField(auto_now_add=True, verbose_name=_('Archived at'))
+
+    class Meta:
+        ordering = ['-month']
+        verbose_name = _('Visit archive')
+        verbose_name_plural = _('Visit archives')
+
+    def __str__(self):
+        return f"{self.month:%Y-%m} — {self.visit_count}"
+
+    @classmethod
+    def archived_until(cls):
+        """Первый день после последнего архивного месяца (None — архива нет)."""
+        last = cls.objects.order_by('-month').values_list('month', flat=True).first()
+        if last is None:
+            return None
+        return (last.replace(day=28) + timedelta(days=4)).replace(day=1)
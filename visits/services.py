@@ -0,0 +1,256 @@
+"""Пакетная загрузка сканов офлайн-сканера, снапшот для предпроверки
+и курсорная история посещений."""
+import base64
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.translation import gettext as _
+
+from bookings.models import Booking
+from .models import GuestTokenRedemption, Visit
+from .tokens import ExpiredQRToken, InvalidQRToken, read_qr_token
+
+MAX_BATCH_EVENTS = 500
+
+# Часы устройства могут спешить — небольшой допуск в будущее
+CLIENT_CLOCK_SKEW = timedelta(minutes=5)
+
+# Самый старый скан, который примем из очереди сканера. Токен проверяется на
+# момент скана, поэтому без нижней границы задним числом прошёл бы любой
+# истёкший токен. Должно быть меньше окна purge_expired_tokens --keep-hours:
+# иначе гостевой код погасили бы повторно после удаления его redemption.
+MAX_OFFLINE_AGE = timedelta(hours=12)
+
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 200
+
+CREATED = 'created'
+DUPLICATE = 'duplicate'
+REJECTED = 'rejected'
+
+
+def ingest_scan_events(events, scanned_by):
+    """Проверить и записать пачку сканов. Возвращает результаты в порядке events.
+
+    Каждое событие: {id, token, scanned_at, guest_name}. `id` — ключ
+    идемпотентности: повторная отправка того же события вернёт `duplicate`
+    с id уже созданного визита. Принимаются только подписанные токены —
+    их срок проверяется на момент скана (`scanned_at`), а не загрузки.
+    """
+    try:
+        return _ingest(events, scanned_by)
+    except IntegrityError:
+        # Параллельная загрузка тех же событий/гостевых кодов — перечитать и повторить
+        return _ingest(events, scanned_by)
+
+
+def _ingest(events, scanned_by):
+    now = timezone.now()
+    results = [None] * len(events)
+    pending = []  # (index, event_id, claims, scanned_at, guest_name)
+    seen_ids = set()
+
+    for index, event in enumerate(events):
+        event_id = str(event.get('id') or '').strip() if isinstance(event, dict) else ''
+
+        def reject(message):
+            results[index] = {'id': event_id, 'status': REJECTED, 'error': message}
+
+        if not event_id or len(event_id) > 64:
+            reject(_('Event id is required.'))
+            continue
+        if event_id in seen_ids:
+            reject(_('Duplicate event id in batch.'))
+            continue
+        seen_ids.add(event_id)
+
+        scanned_at = _parse_scanned_at(event.get('scanned_at'), now)
+        if scanned_at is None:
+            reject(_('Invalid scan time.'))
+            continue
+        if scanned_at < now - MAX_OFFLINE_AGE:
+            reject(_('Scan is too old to upload.'))
+            continue
+
+        try:
+            claims = read_qr_token(str(event.get('token') or '').strip(), now=scanned_at)
+        except ExpiredQRToken:
+            reject(_('Token has expired.'))
+            continue
+        except InvalidQRToken:
+            reject(_('Invalid token.'))
+            continue
+
+        guest_name = str(event.get('guest_name') or '').strip()[:255]
+        if claims.token_type == Visit.VisitorType.GUEST and not guest_name:
+            reject(_('Guest name is required.'))
+            continue
+
+        pending.append((index, event_id, claims, scanned_at, guest_name))
+
+    # Уже принятые ранее события — идемпотентный ответ
+    existing = dict(
+        Visit.objects.filter(client_event_id__in=[p[1] for p in pending])
+        .values_list('client_event_id', 'pk')
+    )
+    bookings = Booking.objects.select_related(
+        'user', 'storage_unit',
+    ).in_bulk({p[2].booking_id for p in pending})
+    nonces = {p[2].nonce for p in pending if p[2].nonce}
+    redeemed = set(
+        GuestTokenRedemption.objects.filter(nonce__in=nonces).values_list('nonce', flat=True)
+    )
+
+    to_create = []  # (index, event_id, visit)
+    redemptions = []
+    for index, event_id, claims, scanned_at, guest_name in pending:
+        if event_id in existing:
+            results[index] = {'id': event_id, 'status': DUPLICATE, 'visit_id': existing[event_id]}
+            continue
+
+        booking = bookings.get(claims.booking_id)
+        if booking is None:
+            results[index] = {'id': event_id, 'status': REJECTED, 'error': _('Invalid token.')}
+            continue
+
+        is_guest = claims.token_type == Visit.VisitorType.GUEST
+        if is_guest:
+            if claims.nonce in redeemed:
+                results[index] = {
+                    'id': event_id, 'status': REJECTED,
+                    'error': _('Guest token has already been used.'),
+                }
+                continue
+            redeemed.add(claims.nonce)
+            redemptions.append(GuestTokenRedemption(
+                nonce=claims.nonce,
+                booking=booking,
+                guest_name=guest_name,
+                expires_at=claims.expires_at,
+            ))
+
+        to_create.append((index, event_id, Visit(
+            booking=booking,
+            visitor_type=claims.token_type,
+            visitor_name=guest_name if is_guest else booking.user.get_full_name(),
+            scanned_by=scanned_by,
+            visited_at=scanned_at,
+            client_event_id=event_id,
+        )))
+
+    with transaction.atomic():
+        GuestTokenRedemption.objects.bulk_create(redemptions)
+        created = Visit.bulk_record([visit for _i, _e, visit in to_create])
+
+        from notifications.services import notify_visit_by_id, send_later
+        for visit in created:
+            send_later(notify_visit_by_id, visit.pk)
+
+    for index, event_id, visit in to_create:
+        results[index] = {
+            'id': event_id, 'status': CREATED,
+            'visit_id': visit.pk, 'unit': visit.unit_code,
+        }
+    return results
+
+
+def _parse_scanned_at(value, now):
+    """ISO-время скана с устройства; без значения — время загрузки."""
+    if not value:
+        return now
+    scanned_at = parse_datetime(str(value))
+    if scanned_at is None:
+        return None
+    if timezone.is_naive(scanned_at):
+        scanned_at = timezone.make_aware(scanned_at)
+    if scanned_at > now + CLIENT_CLOCK_SKEW:
+        return None
+    return min(scanned_at, now)
+
+
+def scanner_snapshot(now=None):
+    """Актуальные брони и погашенные гостевые коды для предпроверки на сканере.
+
+    Подпись токена сканер проверить не может (ключ только на сервере), но
+    payload читается без ключа: сканер сверяет booking_id и срок с этим
+    списком, пока сеть недоступна, и досылает сканы пачкой.
+    """
+    now = now or timezone.now()
+    today = timezone.localdate(now)
+    bookings = (
+        Booking.objects.active(today)
+        .filter(storage_unit__isnull=False)
+        .values(
+            'pk', 'storage_unit_id', 'unit_codes', 'end_date',
+            'user__first_name', 'user__last_name', 'user__email',
+        )
+        .order_by('pk')
+    )
+    return {
+        'generated_at': now.isoformat(),
+        'bookings': [
+            {
+                'booking_id': row['pk'],
+                'unit_id': row['storage_unit_id'],
+                'unit': row['unit_codes'],
+                'end_date': row['end_date'].isoformat(),
+                'owner_name': f"{row['user__first_name']} {row['user__last_name']}".strip()
+                or row['user__email'],
+            }
+            for row in bookings
+        ],
+        'redeemed_guest_nonces': list(
+            GuestTokenRedemption.objects.filter(expires_at__gt=now)
+            .values_list('nonce', flat=True)
+        ),
+    }
+
+
+class InvalidHistoryCursor(ValueError):
+    """Курсор истории не разбирается."""
+
+
+def encode_history_cursor(visited_at, visit_id):
+    raw = f'{visited_at.isoformat()}|{visit_id}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_history_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        visited_at, visit_id = raw.split('|')
+        visited_at = parse_datetime(visited_at)
+        visit_id = int(visit_id)
+    except (ValueError, UnicodeDecodeError):
+        raise InvalidHistoryCursor(cursor)
+    if visited_at is None:
+        raise InvalidHistoryCursor(cursor)
+    return visited_at, visit_id
+
+
+def visit_history_page(user, cursor=None, limit=HISTORY_PAGE_SIZE, booking_id=None):
+    """Страница истории посещений владельца: (rows, next_cursor).
+
+    Keyset по (visited_at, id) вместо OFFSET — индекс idx_visit_user_time
+    отдаёт любую страницу за одинаковое время. Читаются только снапшот-колонки
+    визита, без join брони/юнита/локации. next_cursor = None на последней странице.
+    """
+    limit = max(1, min(limit, HISTORY_MAX_PAGE_SIZE))
+    qs = Visit.objects.filter(user=user)
+    if booking_id:
+        qs = qs.filter(booking_id=booking_id)
+    if cursor:
+        visited_at, visit_id = decode_history_cursor(cursor)
+        qs = qs.filter(
+            Q(visited_at__lt=visited_at) | Q(visited_at=visited_at, id__lt=visit_id)
+        )
+
+    rows = list(qs.order_by('-visited_at', '-id').values(*Visit.HISTORY_COLUMNS)[:limit + 1])
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_history_cursor(rows[-1]['visited_at'], rows[-1]['id'])
+    return rows, next_cursor
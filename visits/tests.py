@@ -1,3 +1,722 @@
-from django.test import TestCase
+from decimal import Decimal
+from unittest.mock import patch
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
 
-# Create your tests here.
+from django.core.management import call_command
+from django.test import TestCase, Client
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import User
+from bookings.models import Booking
+from services.models import (
+    Service, Tariff, TariffPeriod, TariffPriceTier, Section, StorageUnit,
+)
+from locations.models import Location
+from visits.models import AccessToken, GuestTokenRedemption, Visit, VisitDailyStat
+from visits.tokens import ExpiredQRToken, InvalidQRToken, make_qr_token, read_qr_token
+
+
+class VisitTestMixin:
+    """Shared setup: staff manager + paid booking on a unit."""
+
+    def create_base(self):
+        self.manager = User.objects.create_user(
+            email='manager@foxbox.ae', password='managerpass123',
+            first_name='Manager', last_name='User',
+        )
+        self.manager.is_staff = True
+        self.manager.save(update_fields=['is_staff'])
+
+        self.user = User.objects.create_user(
+            email='owner@example.com', password='testpass123',
+            first_name='Owner', last_name='User',
+        )
+
+        self.service = Service.objects.create(
+            service_type=Service.ServiceType.AUTO, name='Auto Storage',
+        )
+        self.location = Location.objects.create(
+            name='Dubai', location_type=Location.LocationType.AUTO_STORAGE,
+            street='Test Street', building='1',
+            latitude=Decimal('25.0000000'), longitude=Decimal('55.0000000'),
+        )
+        self.tariff = Tariff.objects.create(
+            service=self.service, location=self.location,
+            name='VIP Parking', name_en='VIP Parking',
+            deposit_aed=Decimal('200.00'),
+        )
+        self.period = TariffPeriod.objects.create(
+            tariff=self.tariff, name='1 Month', name_en='1 Month',
+            duration_type=TariffPeriod.DurationType.MONTHS, duration_value=1,
+        )
+        TariffPriceTier.objects.create(
+            period=self.period, min_units=1, max_units=None,
+            price_per_unit_aed=Decimal('500.00'),
+        )
+        self.section = Section.objects.create(
+            location=self.location, service=self.service, name='A',
+        )
+        self.unit = StorageUnit.objects.create(section=self.section, unit_number='01')
+
+        self.booking = Booking.objects.create(
+            user=self.user, tariff=self.tariff, period=self.period,
+            start_date=timezone.now().date(),
+            price_aed=Decimal('500.00'), unit_price_aed=Decimal('500.00'),
+            addons_aed=Decimal('0.00'), deposit_aed=Decimal('200.00'),
+            total_aed=Decimal('700.00'),
+        )
+        self.booking.mark_as_paid('pi_test')
+        self.booking.refresh_from_db()
+
+        self.client = Client()
+        self.client.force_login(self.manager)
+
+    def create_visit(self, visitor_type=Visit.VisitorType.OWNER, **kwargs):
+        return Visit.objects.create(
+            booking=self.booking,
+            visitor_type=visitor_type,
+            scanned_by=self.manager,
+            **kwargs,
+        )
+
+
+class VisitDailyStatTest(VisitTestMixin, TestCase):
+    """Дневные счётчики визитов обновляются при создании Visit."""
+
+    def setUp(self):
+        self.create_base()
+
+    def test_visit_creation_increments_counter(self):
+        self.create_visit()
+        self.create_visit()
+        self.create_visit(visitor_type=Visit.VisitorType.GUEST, visitor_name='Guest')
+
+        today = timezone.localdate()
+        self.assertEqual(
+            VisitDailyStat.objects.get(day=today, visitor_type='owner').count, 2,
+        )
+        self.assertEqual(
+            VisitDailyStat.objects.get(day=today, visitor_type='guest').count, 1,
+        )
+        self.assertEqual(
+            VisitDailyStat.objects.get(day=today, visitor_type='owner').location_name,
+            'Dubai',
+        )
+
+    def test_resaving_visit_does_not_increment(self):
+        visit = self.create_visit()
+        visit.notes = 'checked'
+        visit.save()
+        self.assertEqual(VisitDailyStat.totals(timezone.localdate(), timezone.localdate())['total'], 1)
+
+    def test_totals_and_counts_by_day(self):
+        today = timezone.localdate()
+        self.create_visit()
+        self.create_visit(visitor_type=Visit.VisitorType.GUEST)
+        VisitDailyStat.objects.create(
+            day=today - timedelta(days=3), location_name='Dubai',
+            visitor_type='owner', count=5,
+        )
+
+        self.assertEqual(
+            VisitDailyStat.totals(today - timedelta(days=6), today),
+            {'total': 7, 'owners': 6, 'guests': 1},
+        )
+        self.assertEqual(
+            VisitDailyStat.counts_by_day(today - timedelta(days=6), today),
+            {today: 2, today - timedelta(days=3): 5},
+        )
+        self.assertEqual(
+            VisitDailyStat.totals(today - timedelta(days=1), today - timedelta(days=1)),
+            {'total': 0, 'owners': 0, 'guests': 0},
+        )
+
+    def test_rebuild_command_repairs_drift(self):
+        self.create_visit()
+        self.create_visit()
+        today = timezone.localdate()
+        VisitDailyStat.objects.filter(day=today).update(count=42)
+        VisitDailyStat.objects.create(
+            day=today - timedelta(days=1), location_name='Ghost',
+            visitor_type='guest', count=3,
+        )
+
+        call_command('rebuild_visit_stats', stdout=StringIO())
+
+        self.assertEqual(list(VisitDailyStat.objects.values_list('day', 'count')), [(today, 2)])
+
+    def test_rebuild_respects_date_range(self):
+        self.create_visit()
+        today = timezone.localdate()
+        old = VisitDailyStat.objects.create(
+            day=today - timedelta(days=10), location_name='Dubai',
+            visitor_type='owner', count=3,
+        )
+        VisitDailyStat.objects.filter(day=today).update(count=9)
+
+        VisitDailyStat.rebuild(today, today)
+
+        self.assertEqual(VisitDailyStat.objects.get(day=today).count, 1)
+        old.refresh_from_db()
+        self.assertEqual(old.count, 3)
+
+    def test_scan_updates_counter(self):
+        token = AccessToken.objects.create(
+            booking=self.booking, token_type=AccessToken.TokenType.OWNER,
+        )
+        resp = self.client.post(reverse('visit-scan'), {'token': token.token})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(VisitDailyStat.totals(timezone.localdate(), timezone.localdate())['owners'], 1)
+
+    def test_backoffice_visit_list_reads_counters(self):
+        self.create_visit()
+        self.create_visit(visitor_type=Visit.VisitorType.GUEST)
+        resp = self.client.get(reverse('backoffice:visit_list'))
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.context['visit_stats']['total'], 2)
+        self.assertEqual(resp.context['visit_stats']['owners'], 1)
+        self.assertEqual(resp.context['visit_stats']['guests'], 1)
+
+    def test_backoffice_dashboard_week_chart(self):
+        self.create_visit()
+        resp = self.client.get(reverse('backoffice:dashboard'))
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.context['stats']['today_visits'], 1)
+        self.assertEqual(resp.context['visit_week_total'], 1)
+        self.assertEqual(resp.context['visit_chart'][-1]['count'], 1)
+
+
+class ScanFastPathTest(VisitTestMixin, TestCase):
+    """ScanQRView: один SELECT токена, запись в транзакции, уведомление после коммита."""
+
+    # Бюджет латентности скана на воротах (p99, мс)
+    P99_BUDGET_MS = 250
+
+    def setUp(self):
+        from visits.views import SCAN_LATENCY
+
+        self.create_base()
+        self.histogram = SCAN_LATENCY
+        self.histogram.reset()
+        self.url = reverse('visit-scan')
+
+    def _owner_token(self):
+        return AccessToken.objects.create(
+            booking=self.booking, token_type=AccessToken.TokenType.OWNER,
+        )
+
+    def test_owner_scan_query_budget(self):
+        token = self._owner_token()
+        self.client.post(self.url, {'token': token.token})  # прогрев сессии
+
+        token = self._owner_token()
+        # session + user, token со снепшот-связями, savepoint, INSERT visit,
+        # UPDATE счётчика дня, UPDATE last_visit_at, версия кабинета, release savepoint
+        with self.assertNumQueries(9):
+            resp = self.client.post(self.url, {'token': token.token})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()['visit']['unit'], self.unit.full_code)
+
+        visit = Visit.objects.get(pk=resp.json()['visit']['id'])
+        self.assertEqual(visit.unit_code, self.unit.full_code)
+        self.assertEqual(visit.location_name, 'Dubai')
+        self.assertEqual(visit.scanned_by_name, 'Manager User')
+
+    @patch('notifications.services.notify_visit')
+    def test_notification_sent_only_after_commit(self, mock_notify):
+        token = self._owner_token()
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            resp = self.client.post(self.url, {'token': token.token})
+        self.assertEqual(resp.status_code, 200)
+        mock_notify.assert_not_called()
+
+        for callback in callbacks:
+            callback()
+        mock_notify.assert_called_once()
+        self.assertEqual(mock_notify.call_args[0][0].pk, resp.json()['visit']['id'])
+
+    def test_guest_token_is_claimed_once(self):
+        token = AccessToken.objects.create(
+            booking=self.booking, token_type=AccessToken.TokenType.GUEST,
+        )
+        resp = self.client.post(self.url, {'token': token.token, 'guest_name': 'Ann'})
+        self.assertEqual(resp.status_code, 200)
+        token.refresh_from_db()
+        self.assertTrue(token.is_used)
+        self.assertEqual(token.guest_name, 'Ann')
+
+        resp = self.client.post(self.url, {'token': token.token, 'guest_name': 'Bob'})
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(Visit.objects.filter(visitor_type='guest').count(), 1)
+
+    def test_p99_latency_within_budget(self):
+        for _ in range(50):
+            resp = self.client.post(self.url, {'token': self._owner_token().token})
+            self.assertEqual(resp.status_code, 200)
+
+        snapshot = self.histogram.snapshot()
+        self.assertEqual(snapshot['count'], 50)
+        self.assertLessEqual(snapshot['p99_ms'], self.P99_BUDGET_MS)
+
+        resp = self.client.get(reverse('visit-scan-metrics'))
+        self.assertEqual(resp.json()['scan']['count'], 50)
+
+
+class SignedQRTokenTest(VisitTestMixin, TestCase):
+    """Подписанные QR: выпуск без записи в БД, проверка по HMAC, одноразовые гостевые."""
+
+    def setUp(self):
+        self.create_base()
+        self.booking.storage_unit = self.unit
+        self.booking.save(update_fields=['storage_unit'])
+        self.owner_client = Client()
+        self.owner_client.force_login(self.user)
+        self.scan_url = reverse('visit-scan')
+
+    def test_generate_owner_token_writes_nothing(self):
+        resp = self.owner_client.post(reverse('visit-generate-qr'), {'booking_id': self.booking.pk})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(AccessToken.objects.count(), 0)
+
+        with self.assertNumQueries(0):
+            claims = read_qr_token(resp.json()['token'])
+        self.assertEqual(claims.booking_id, self.booking.pk)
+        self.assertEqual(claims.unit_id, self.unit.pk)
+        self.assertEqual(claims.token_type, 'owner')
+        self.assertIsNone(claims.nonce)
+
+    def test_tampered_token_is_rejected(self):
+        token, _ = make_qr_token(self.booking, 'owner')
+        tampered = token[:-2] + ('AA' if not token.endswith('AA') else 'BB')
+        with self.assertRaises(InvalidQRToken):
+            read_qr_token(tampered)
+
+        resp = self.client.post(self.scan_url, {'token': tampered})
+        self.assertEqual(resp.status_code, 404)
+        self.assertFalse(Visit.objects.exists())
+
+    def test_expired_token_is_rejected(self):
+        token, _ = make_qr_token(self.booking, 'owner', now=timezone.now() - timedelta(minutes=16))
+        with self.assertRaises(ExpiredQRToken):
+            read_qr_token(token)
+
+        resp = self.client.post(self.scan_url, {'token': token})
+        self.assertEqual(resp.status_code, 400)
+        self.assertFalse(Visit.objects.exists())
+
+    def test_owner_scan_reads_booking_once(self):
+        token, _ = make_qr_token(self.booking, 'owner')
+        self.client.post(self.scan_url, {'token': token})  # прогрев сессии и счётчика дня
+
+        token, _ = make_qr_token(self.booking, 'owner')
+        # session + user, бронь со снепшот-связями, savepoint, INSERT visit,
+        # UPDATE счётчика дня, UPDATE last_visit_at, версия кабинета, release savepoint
+        with self.assertNumQueries(9):
+            resp = self.client.post(self.scan_url, {'token': token})
+        self.assertEqual(resp.status_code, 200)
+
+        visit = Visit.objects.get(pk=resp.json()['visit']['id'])
+        self.assertIsNone(visit.access_token)
+        self.assertEqual(visit.unit_code, self.unit.full_code)
+        self.assertEqual(visit.visitor_name, 'Owner User')
+
+    def test_guest_token_single_use(self):
+        resp = self.owner_client.post(reverse('visit-generate-guest'), {'booking_id': self.booking.pk})
+        token = resp.json()['token']
+        self.assertEqual(AccessToken.objects.count(), 0)
+
+        resp = self.client.post(self.scan_url, {'token': token})
+        self.assertEqual(resp.status_code, 400)
+        self.assertTrue(resp.json()['require_guest_name'])
+
+        resp = self.client.post(self.scan_url, {'token': token, 'guest_name': 'Ann'})
+        self.assertEqual(resp.status_code, 200)
+        redemption = GuestTokenRedemption.objects.get()
+        self.assertEqual(redemption.guest_name, 'Ann')
+        self.assertEqual(redemption.booking, self.booking)
+
+        resp = self.client.post(self.scan_url, {'token': token, 'guest_name': 'Bob'})
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(Visit.objects.filter(visitor_type='guest').count(), 1)
+
+
+class ScanBatchTest(VisitTestMixin, TestCase):
+    """Офлайн-сканер: пакетная загрузка с идемпотентностью и снапшот броней."""
+
+    def setUp(self):
+        self.create_base()
+        self.booking.storage_unit = self.unit
+        self.booking.save(update_fields=['storage_unit'])
+        self.url = reverse('visit-scan-batch')
+
+    def _post(self, events):
+        return self.client.post(self.url, {'events': events}, content_type='application/json')
+
+    def _owner_event(self, event_id, scanned_at=None, issued_at=None):
+        token, _ = make_qr_token(self.booking, 'owner', now=issued_at)
+        event = {'id': event_id, 'token': token}
+        if scanned_at:
+            event['scanned_at'] = scanned_at.isoformat()
+        return event
+
+    def test_batch_creates_visits_at_client_time(self):
+        scanned_at = timezone.now() - timedelta(minutes=3)
+        guest_token, _ = make_qr_token(self.booking, 'guest')
+        resp = self._post([
+            self._owner_event('e1', scanned_at=scanned_at),
+            self._owner_event('e2'),
+            {'id': 'e3', 'token': guest_token, 'guest_name': 'Ann'},
+        ])
+        self.assertEqual(resp.status_code, 200)
+        results = resp.json()['results']
+        self.assertEqual([r['status'] for r in results], ['created'] * 3)
+        self.assertEqual(results[0]['unit'], self.unit.full_code)
+
+        visit = Visit.objects.get(client_event_id='e1')
+        self.assertEqual(visit.visited_at, scanned_at)
+        self.assertEqual(visit.location_name, 'Dubai')
+        self.assertEqual(visit.scanned_by_name, 'Manager User')
+        self.assertTrue(GuestTokenRedemption.objects.filter(guest_name='Ann').exists())
+
+        today = timezone.localdate()
+        self.assertEqual(VisitDailyStat.totals(today, today), {'total': 3, 'owners': 2, 'guests': 1})
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.last_visit_at, Visit.objects.latest('visited_at').visited_at)
+
+    def test_resent_events_are_duplicates(self):
+        events = [self._owner_event('e1'), self._owner_event('e2')]
+        first = self._post(events).json()['results']
+        second = self._post(events).json()['results']
+
+        self.assertEqual([r['status'] for r in second], ['duplicate', 'duplicate'])
+        self.assertEqual([r['visit_id'] for r in second], [r['visit_id'] for r in first])
+        self.assertEqual(Visit.objects.count(), 2)
+        self.assertEqual(VisitDailyStat.totals(timezone.localdate(), timezone.localdate())['total'], 2)
+
+    def test_token_checked_against_scan_time(self):
+        now = timezone.now()
+        resp = self._post([
+            # выпущен 20 минут назад, отсканирован через 5 минут после выпуска
+            self._owner_event('ok', issued_at=now - timedelta(minutes=20), scanned_at=now - timedelta(minutes=15)),
+            # отсканирован уже после истечения
+            self._owner_event('late', issued_at=now - timedelta(minutes=20), scanned_at=now - timedelta(minutes=1)),
+        ])
+        self.assertEqual([r['status'] for r in resp.json()['results']], ['created', 'rejected'])
+
+    def test_backdated_scan_rejected(self):
+        from visits.services import MAX_OFFLINE_AGE
+
+        now = timezone.now()
+        issued_at = now - MAX_OFFLINE_AGE - timedelta(days=2)
+        guest_token, _ = make_qr_token(self.booking, 'guest', now=issued_at)
+        resp = self._post([
+            # Гостевой код истёк давно, redemption уже мог удалить purge_expired_tokens
+            {'id': 'old', 'token': guest_token, 'guest_name': 'Ann',
+             'scanned_at': (issued_at + timedelta(minutes=1)).isoformat()},
+            self._owner_event('edge', issued_at=now - MAX_OFFLINE_AGE + timedelta(minutes=2),
+                              scanned_at=now - MAX_OFFLINE_AGE + timedelta(minutes=3)),
+        ])
+        results = resp.json()['results']
+        self.assertEqual([r['status'] for r in results], ['rejected', 'created'])
+        self.assertEqual(results[0]['error'], 'Scan is too old to upload.')
+        self.assertFalse(GuestTokenRedemption.objects.exists())
+
+    def test_invalid_events_are_rejected_individually(self):
+        guest_token, _ = make_qr_token(self.booking, 'guest')
+        resp = self._post([
+            {'id': 'bad', 'token': 'not-a-token'},
+            {'id': 'noname', 'token': guest_token},
+            {'id': 'g1', 'token': guest_token, 'guest_name': 'Ann'},
+            {'id': 'g2', 'token': guest_token, 'guest_name': 'Bob'},
+            self._owner_event('future', scanned_at=timezone.now() + timedelta(hours=1)),
+            {'token': 'no-id'},
+            self._owner_event('good'),
+        ])
+        self.assertEqual(
+            [r['status'] for r in resp.json()['results']],
+            ['rejected', 'rejected', 'created', 'rejected', 'rejected', 'rejected', 'created'],
+        )
+        self.assertEqual(Visit.objects.count(), 2)
+
+    def test_query_count_does_not_grow_with_batch(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        def run(prefix, size):
+            with CaptureQueriesContext(connection) as ctx:
+                self._post([self._owner_event(f'{prefix}{i}') for i in range(size)])
+            return len(ctx.captured_queries)
+
+        run('warm', 1)
+        self.assertEqual(run('a', 2), run('b', 20))
+
+    def test_non_staff_forbidden(self):
+        owner_client = Client()
+        owner_client.force_login(self.user)
+        resp = owner_client.post(self.url, {'events': []}, content_type='application/json')
+        self.assertEqual(resp.status_code, 403)
+        self.assertEqual(owner_client.get(reverse('visit-scan-snapshot')).status_code, 403)
+
+    def test_snapshot_lists_active_bookings_and_redeemed_guests(self):
+        guest_token, _ = make_qr_token(self.booking, 'guest')
+        self._post([{'id': 'g', 'token': guest_token, 'guest_name': 'Ann'}])
+
+        resp = self.client.get(reverse('visit-scan-snapshot'))
+        self.assertEqual(resp.status_code, 200)
+        data = resp.json()
+        self.assertEqual([b['booking_id'] for b in data['bookings']], [self.booking.pk])
+        self.assertEqual(data['bookings'][0]['owner_name'], 'Owner User')
+        self.assertEqual(data['redeemed_guest_nonces'], [read_qr_token(guest_token).nonce])
+
+    def test_scanner_pages_include_offline_queue(self):
+        for url in (reverse('backoffice:scanner'), reverse('visit-scan-page')):
+            resp = self.client.get(url)
+            self.assertEqual(resp.status_code, 200)
+            self.assertContains(resp, self.url)
+
+
+class PurgeExpiredTokensTest(VisitTestMixin, TestCase):
+    """purge_expired_tokens удаляет просроченное пачками, действующее не трогает."""
+
+    def setUp(self):
+        self.create_base()
+
+    def test_purges_expired_rows_in_batches(self):
+        from accounts.models import TelegramLinkToken
+
+        old = timezone.now() - timedelta(days=3)
+        expired = [
+            AccessToken.objects.create(booking=self.booking, expires_at=old)
+            for _ in range(5)
+        ]
+        live = AccessToken.objects.create(booking=self.booking)
+        visit = self.create_visit(access_token=expired[0])
+        GuestTokenRedemption.objects.create(nonce='old', booking=self.booking, expires_at=old)
+        GuestTokenRedemption.objects.create(
+            nonce='new', booking=self.booking, expires_at=timezone.now() + timedelta(hours=1),
+        )
+        TelegramLinkToken.objects.create(user=self.user, token='tg-old', expires_at=old)
+        recent = TelegramLinkToken.objects.create(
+            user=self.manager, token='tg-recent', expires_at=timezone.now() - timedelta(hours=1),
+        )
+
+        out = StringIO()
+        call_command('purge_expired_tokens', '--dry-run', stdout=out)
+        self.assertIn('Would delete 5 access token(s)', out.getvalue())
+        self.assertEqual(AccessToken.objects.count(), 6)
+
+        out = StringIO()
+        call_command('purge_expired_tokens', '--batch-size', '2', stdout=out)
+        self.assertIn('Deleted 5 access token(s)', out.getvalue())
+        self.assertEqual(list(AccessToken.objects.all()), [live])
+        self.assertEqual(list(GuestTokenRedemption.objects.values_list('nonce', flat=True)), ['new'])
+        # истёк меньше суток назад — остаётся
+        self.assertEqual(list(TelegramLinkToken.objects.all()), [recent])
+        # визит остаётся, ссылка на токен обнуляется
+        visit.refresh_from_db()
+        self.assertIsNone(visit.access_token)
+
+    def test_keep_window_must_cover_offline_scans(self):
+        from django.core.management.base import CommandError
+
+        with self.assertRaises(CommandError):
+            call_command('purge_expired_tokens', '--keep-hours', '1', stdout=StringIO())
+
+    def test_lookups_stay_on_indexes_with_large_history(self):
+        """Бенчмарк: 20k исторических строк — точечные поиски идут по индексам."""
+        import time
+
+        past = timezone.now() - timedelta(days=30)
+        GuestTokenRedemption.objects.bulk_create([
+            GuestTokenRedemption(nonce=f'n{i:06d}', booking=self.booking, expires_at=past)
+            for i in range(20000)
+        ])
+        AccessToken.objects.bulk_create([
+            AccessToken(booking=self.booking, token=f't{i:06d}', expires_at=past)
+            for i in range(20000)
+        ])
+
+        lookups = [
+            GuestTokenRedemption.objects.filter(nonce='n019999'),
+            AccessToken.objects.filter(token='t019999'),
+            AccessToken.objects.filter(expires_at__lt=past - timedelta(days=1)).values('pk')[:1000],
+        ]
+        for qs in lookups:
+            self.assertIn('INDEX', qs.explain().upper())
+
+        started = time.perf_counter()
+        for _ in range(100):
+            GuestTokenRedemption.objects.filter(nonce='n019999').exists()
+        self.assertLess((time.perf_counter() - started) * 1000 / 100, 20)
+
+
+class VisitHistoryCursorTest(VisitTestMixin, TestCase):
+    """История посещений: keyset-курсор, только снапшот-колонки."""
+
+    def setUp(self):
+        self.create_base()
+        self.owner_client = Client()
+        self.owner_client.force_login(self.user)
+        base = timezone.now() - timedelta(days=1)
+        # Два визита на одну секунду — курсор должен различать их по id
+        self.visits = Visit.bulk_record([
+            Visit(booking=self.booking, scanned_by=self.manager,
+                  visited_at=base + timedelta(minutes=i // 2))
+            for i in range(7)
+        ])
+
+    def _page(self, **params):
+        resp = self.owner_client.get(reverse('visit-history'), params)
+        self.assertEqual(resp.status_code, 200)
+        return resp.json()
+
+    def test_visit_owner_copied_from_booking(self):
+        self.assertEqual(self.create_visit().user, self.user)
+        self.assertFalse(Visit.objects.filter(user__isnull=True).exists())
+
+    def test_pages_cover_history_without_gaps(self):
+        seen = []
+        cursor = None
+        while True:
+            params = {'limit': 3}
+            if cursor:
+                params['cursor'] = cursor
+            data = self._page(**params)
+            seen += [row['id'] for row in data['visits']]
+            cursor = data['next_cursor']
+            if not cursor:
+                break
+        expected = list(
+            Visit.objects.order_by('-visited_at', '-id').values_list('id', flat=True)
+        )
+        self.assertEqual(seen, expected)
+        self.assertEqual(data['visits'][-1]['unit'], 'DUB-A-01')
+
+    def test_page_reads_only_visit_columns(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        with CaptureQueriesContext(connection) as ctx:
+            self._page(limit=3)
+        history_sql = [q['sql'] for q in ctx.captured_queries if 'visits_visit' in q['sql']]
+        self.assertEqual(len(history_sql), 1)
+        self.assertNotIn('JOIN', history_sql[0].upper())
+
+    def test_other_users_visits_hidden(self):
+        other = User.objects.create_user(email='other@example.com', password='x12345678')
+        client = Client()
+        client.force_login(other)
+        data = client.get(reverse('visit-history')).json()
+        self.assertEqual(data['visits'], [])
+        self.assertIsNone(data['next_cursor'])
+
+    def test_invalid_cursor_rejected(self):
+        resp = self.owner_client.get(reverse('visit-history'), {'cursor': 'garbage!'})
+        self.assertEqual(resp.status_code, 400)
+
+    def test_cabinet_history_pages_by_cursor(self):
+        Visit.bulk_record([
+            Visit(booking=self.booking, scanned_by=self.manager)
+            for _ in range(60)
+        ])
+        resp = self.owner_client.get(reverse('cabinet-history'))
+        self.assertEqual(len(resp.context['visits']), 50)
+        cursor = resp.context['next_cursor']
+        self.assertContains(resp, 'Older visits')
+
+        resp = self.owner_client.get(reverse('cabinet-history'), {'cursor': cursor})
+        self.assertEqual(len(resp.context['visits']), 17)
+        self.assertIsNone(resp.context['next_cursor'])
+
+    def test_history_uses_owner_index(self):
+        self.assertIn(
+            'idx_visit_user_time',
+            Visit.objects.filter(user=self.user).order_by('-visited_at', '-id')[:50].explain(),
+        )
+
+
+class VisitRangeAndArchiveTest(VisitTestMixin, TestCase):
+    """Диапазоны по локальным дням и выгрузка закрытых месяцев в архив."""
+
+    def setUp(self):
+        self.create_base()
+
+    def test_between_uses_local_day_bounds(self):
+        from visits.models import local_midnight
+
+        day = timezone.localdate() - timedelta(days=2)
+        start = local_midnight(day)
+        inside = [
+            self.create_visit(visited_at=start),
+            self.create_visit(visited_at=start + timedelta(hours=23, minutes=59)),
+        ]
+        self.create_visit(visited_at=start - timedelta(seconds=1))
+        self.create_visit(visited_at=start + timedelta(days=1))
+
+        self.assertEqual(
+            set(Visit.objects.between(day, day)), set(inside),
+        )
+        self.assertEqual(Visit.objects.between(date_from=day).count(), 3)
+        sql = str(Visit.objects.between(day, day).query).upper()
+        self.assertNotIn('DJANGO_DATETIME_CAST_DATE', sql)
+        self.assertIn('IDX_VISIT_TIME', Visit.objects.between(day, day).explain().upper())
+
+    def test_archive_moves_closed_months_and_keeps_stats(self):
+        import gzip
+        import json
+        import tempfile
+        from django.test import override_settings
+        from visits.models import VisitArchive
+
+        old_day = timezone.localdate().replace(day=1) - timedelta(days=400)
+        old_visits = [
+            self.create_visit(visited_at=timezone.now() - timedelta(days=400 + i))
+            for i in range(3)
+        ]
+        recent = self.create_visit()
+        old_total = VisitDailyStat.totals(old_day - timedelta(days=40), old_day + timedelta(days=40))
+
+        with tempfile.TemporaryDirectory() as tmp, override_settings(VISIT_ARCHIVE_DIR=Path(tmp)):
+            out = StringIO()
+            call_command('archive_visits', '--dry-run', stdout=out)
+            self.assertIn('Would archive', out.getvalue())
+            self.assertEqual(Visit.objects.count(), 4)
+
+            call_command('archive_visits', '--batch-size', '2', stdout=StringIO())
+
+            self.assertEqual(list(Visit.objects.all()), [recent])
+            archived = []
+            for archive in VisitArchive.objects.all():
+                with gzip.open(archive.path, 'rt', encoding='utf-8') as fh:
+                    archived += [json.loads(line) for line in fh]
+            self.assertEqual(sorted(r['id'] for r in archived), sorted(v.pk for v in old_visits))
+            self.assertEqual(archived[0]['unit_code'], 'DUB-A-01')
+
+        # Счётчики архивных дней остаются и переживают rebuild
+        VisitDailyStat.rebuild()
+        self.assertEqual(
+            VisitDailyStat.totals(old_day - timedelta(days=40), old_day + timedelta(days=40)),
+            old_total,
+        )
+        self.assertEqual(VisitDailyStat.totals(timezone.localdate(), timezone.localdate())['total'], 1)
+
+    def test_archive_keeps_last_visit_for_user_stats(self):
+        import tempfile
+        from django.test import override_settings
+
+        visit = self.create_visit(visited_at=timezone.now() - timedelta(days=500))
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.last_visit_at, visit.visited_at)
+
+        with tempfile.TemporaryDirectory() as tmp, override_settings(VISIT_ARCHIVE_DIR=Path(tmp)):
+            call_command('archive_visits', '--keep-months', '1', stdout=StringIO())
+        self.assertFalse(Visit.objects.exists())
+
+        # Полный save брони и сверка счётчиков не обнуляют архивный визит
+        self.booking.save()
+        call_command('reconcile_user_stats', stdout=StringIO())
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.last_visit_at, visit.visited_at)
@@ -0,0 +1,73 @@
+"""Подписанные QR-токены доступа: проверяются по HMAC, без обращения к БД.
+
+Формат — django.core.signing поверх компактного JSON-списка
+[booking_id, unit_id, type, expires_ts(, nonce)]. Владельческий токен
+живёт 15 минут и ничего не пишет в БД; гостевой — 24 часа и одноразовый,
+погашение фиксируется в GuestTokenRedemption по nonce.
+"""
+import secrets
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.core import signing
+from django.utils import timezone
+
+QR_SALT = 'visits.qr'
+
+OWNER_TTL = timedelta(minutes=15)
+GUEST_TTL = timedelta(hours=24)
+
+_TYPE_CODES = {'owner': 'o', 'guest': 'g'}
+_CODE_TYPES = {code: token_type for token_type, code in _TYPE_CODES.items()}
+
+QRClaims = namedtuple('QRClaims', 'booking_id unit_id token_type expires_at nonce')
+
+
+class InvalidQRToken(Exception):
+    """Подпись не сходится или формат не наш (например, старый AccessToken)."""
+
+
+class ExpiredQRToken(InvalidQRToken):
+    """Подпись верна, но срок действия истёк."""
+
+
+def make_qr_token(booking, token_type, storage_unit=None, now=None):
+    """Выпустить токен для брони. Возвращает (token, claims)."""
+    now = now or timezone.now()
+    ttl = GUEST_TTL if token_type == 'guest' else OWNER_TTL
+    expires_ts = int((now + ttl).timestamp())
+    unit_id = storage_unit.pk if storage_unit else booking.storage_unit_id
+
+    payload = [booking.pk, unit_id or 0, _TYPE_CODES[token_type], expires_ts]
+    nonce = None
+    if token_type == 'guest':
+        nonce = secrets.token_hex(8)
+        payload.append(nonce)
+
+    token = signing.dumps(payload, salt=QR_SALT)
+    return token, _claims(payload)
+
+
+def read_qr_token(value, now=None):
+    """Проверить подпись и срок. InvalidQRToken / ExpiredQRToken при ошибке."""
+    try:
+        payload = signing.loads(value, salt=QR_SALT)
+    except signing.BadSignature:
+        raise InvalidQRToken(value)
+    if not isinstance(payload, list) or len(payload) < 4 or payload[2] not in _CODE_TYPES:
+        raise InvalidQRToken(value)
+
+    claims = _claims(payload)
+    if (now or timezone.now()) >= claims.expires_at:
+        raise ExpiredQRToken(value)
+    return claims
+
+
+def _claims(payload):
+    return QRClaims(
+        booking_id=payload[0],
+        unit_id=payload[1] or None,
+        token_type=_CODE_TYPES[payload[2]],
+        expires_at=datetime.fromtimestamp(payload[3], tz=dt_timezone.utc),
+        nonce=payload[4] if len(payload) > 4 else None,
+    )
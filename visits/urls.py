@@ -5,6 +5,9 @@ urlpatterns = [
     path('generate/', views.GenerateQRTokenView.as_view(), name='visit-generate-qr'),
     path('generate-guest/', views.GenerateGuestTokenView.as_view(), name='visit-generate-guest'),
     path('scan/', views.ScanQRView.as_view(), name='visit-scan'),
+    path('scan/batch/', views.ScanBatchView.as_view(), name='visit-scan-batch'),
+    path('scan/snapshot/', views.ScanSnapshotView.as_view(), name='visit-scan-snapshot'),
+    path('scan/metrics/', views.ScanMetricsView.as_view(), name='visit-scan-metrics'),
     path('scan/page/', views.ScanPageView.as_view(), name='visit-scan-page'),
     path('history/', views.VisitHistoryView.as_view(), name='visit-history'),
 ]
\ No newline at end of file
@@ -1,4 +1,4 @@
-import secrets
+import json
 from django.views import View
 from django.http import JsonResponse
 from django.shortcuts import get_object_or_404
@@ -8,19 +8,29 @@ from django.utils import timezone
 from django.views.generic import TemplateView
 from django.contrib.admin.views.decorators import staff_member_required
 from django.utils.decorators import method_decorator
-
-from .models import AccessToken, Visit
+from django.db import IntegrityError, transaction
+
+from core.metrics import histogram
+
+from .models import AccessToken, GuestTokenRedemption, Visit
+from .services import (
+    HISTORY_PAGE_SIZE, MAX_BATCH_EVENTS, InvalidHistoryCursor,
+    ingest_scan_events, scanner_snapshot, visit_history_page,
+)
+from .tokens import (
+    GUEST_TTL, OWNER_TTL, ExpiredQRToken, InvalidQRToken, make_qr_token, read_qr_token,
+)
 from bookings.models import Booking
 
 
 class GenerateQRTokenView(LoginRequiredMixin, View):
-    """Генерация или получение существующего QR токена для владельца"""
+    """Выпуск QR токена владельца — подписанный, в БД не пишется"""
 
     def post(self, request):
         booking_id = request.POST.get('booking_id')
 
         booking = get_object_or_404(
-            Booking,
+            Booking.objects.select_related('storage_unit'),
             pk=booking_id,
             user=request.user,
             status=Booking.Status.PAID
@@ -32,45 +42,27 @@ class GenerateQRTokenView(LoginRequiredMixin, View):
                 'error': _('No storage unit assigned.')
             }, status=400)
 
-        # Поискать существующий валидный токен
-        existing_token = AccessToken.objects.filter(
-            booking=booking,
-            token_type=AccessToken.TokenType.OWNER,
-            expires_at__gt=timezone.now()
-        ).first()
-
-        if existing_token:
-            token = existing_token
-            # Рассчитать оставшееся время в минутах
-            remaining = (token.expires_at - timezone.now()).total_seconds() / 60
-            expires_in = max(1, int(remaining))
-        else:
-            # Создать новый токен
-            token = AccessToken.objects.create(
-                booking=booking,
-                token_type=AccessToken.TokenType.OWNER
-            )
-            expires_in = 15
+        token, claims = make_qr_token(booking, AccessToken.TokenType.OWNER)
 
         return JsonResponse({
             'success': True,
-            'token': token.token,
+            'token': token,
             'unit_number': booking.storage_unit.unit_number,
             'full_code': booking.storage_unit.full_code,
-            'expires_in': expires_in,
-            'expires_at': token.expires_at.isoformat(),
-            'is_new': not existing_token
+            'expires_in': int(OWNER_TTL.total_seconds() // 60),
+            'expires_at': claims.expires_at.isoformat(),
+            'is_new': True
         })
 
 
 class GenerateGuestTokenView(LoginRequiredMixin, View):
-    """Генерация или получение существующего гостевого QR токена"""
+    """Выпуск одноразового гостевого QR токена (подписанный, погашается при скане)"""
 
     def post(self, request):
         booking_id = request.POST.get('booking_id')
 
         booking = get_object_or_404(
-            Booking,
+            Booking.objects.select_related('storage_unit'),
             pk=booking_id,
             user=request.user,
             status=Booking.Status.PAID
@@ -82,171 +74,277 @@ class GenerateGuestTokenView(LoginRequiredMixin, View):
                 'error': _('No storage unit assigned.')
             }, status=400)
 
-        # Поискать существующий валидный неиспользованный гостевой токен
-        existing_token = AccessToken.objects.filter(
-            booking=booking,
-            token_type=AccessToken.TokenType.GUEST,
-            expires_at__gt=timezone.now(),
-            is_used=False
-        ).first()
-
-        if existing_token:
-            token = existing_token
-            remaining = (token.expires_at - timezone.now()).total_seconds() / 3600
-            expires_in = max(1, int(remaining))
-        else:
-            # Создать гостевой токен (без имени — его введёт менеджер)
-            token = AccessToken.objects.create(
-                booking=booking,
-                token_type=AccessToken.TokenType.GUEST
-            )
-            expires_in = 24
+        # Имя гостя в токен не кладём — его введёт менеджер при скане
+        token, claims = make_qr_token(booking, AccessToken.TokenType.GUEST)
 
         # Ссылка для гостя
-        guest_link = request.build_absolute_uri(f'/visit/guest/{token.token}/')
+        guest_link = request.build_absolute_uri(f'/visit/guest/{token}/')
 
         return JsonResponse({
             'success': True,
-            'token': token.token,
+            'token': token,
             'unit_number': booking.storage_unit.unit_number,
             'full_code': booking.storage_unit.full_code,
             'guest_link': guest_link,
-            'expires_in': expires_in,
-            'expires_at': token.expires_at.isoformat(),
-            'is_new': not existing_token
+            'expires_in': int(GUEST_TTL.total_seconds() // 3600),
+            'expires_at': claims.expires_at.isoformat(),
+            'is_new': True
         })
 
 
+# Гистограмма латентности скана на воротах склада (см. ScanMetricsView)
+SCAN_LATENCY = histogram('visits.scan')
+
+
 class ScanQRView(View):
-    """Сканирование QR менеджером (staff only)"""
+    """Сканирование QR менеджером (staff only).
+
+    Подписанный токен (visits.tokens) проверяется без БД; бронь читается
+    одним SELECT со всем, что нужно снепшоту визита. Гостевой токен
+    погашается записью GuestTokenRedemption в той же транзакции, что и
+    Visit. Старые токены-строки AccessToken принимаются, пока не истекут.
+    Уведомление владельцу — после коммита в фоне.
+    """
 
     def post(self, request):
+        with SCAN_LATENCY.time():
+            return self._scan(request)
+
+    @staticmethod
+    def _error(message, status=400, **extra):
+        return JsonResponse({'success': False, 'error': message, **extra}, status=status)
+
+    def _scan(self, request):
         # Проверка что это staff
         if not request.user.is_authenticated or not request.user.is_staff:
-            return JsonResponse({
-                'success': False,
-                'error': _('Access denied.')
-            }, status=403)
+            return self._error(_('Access denied.'), status=403)
 
         token_value = request.POST.get('token', '').strip()
         guest_name = request.POST.get('guest_name', '').strip()
 
         if not token_value:
-            return JsonResponse({
-                'success': False,
-                'error': _('Token is required.')
-            }, status=400)
+            return self._error(_('Token is required.'))
+
+        try:
+            claims = read_qr_token(token_value)
+        except ExpiredQRToken:
+            return self._error(_('Token has expired.'))
+        except InvalidQRToken:
+            # Не наша подпись — возможно, токен старого формата из БД
+            return self._scan_legacy(request, token_value, guest_name)
+
+        return self._scan_signed(request, claims, guest_name)
+
+    def _scan_signed(self, request, claims, guest_name):
+        booking = Booking.objects.select_related(
+            'user', 'storage_unit',
+        ).filter(pk=claims.booking_id).first()
+        if booking is None:
+            return self._error(_('Invalid token.'), status=404)
+
+        is_guest = claims.token_type == AccessToken.TokenType.GUEST
+        if is_guest:
+            if GuestTokenRedemption.objects.filter(nonce=claims.nonce).exists():
+                return self._error(_('Guest token has already been used.'))
+            if not guest_name:
+                return self._error(
+                    _('Guest name is required.'),
+                    require_guest_name=True,
+                    unit=booking.storage_unit.full_code if booking.storage_unit else '',
+                )
+
+        with transaction.atomic():
+            if is_guest:
+                # unique(nonce) — параллельный скан того же кода упадёт здесь
+                try:
+                    with transaction.atomic():
+                        GuestTokenRedemption.objects.create(
+                            nonce=claims.nonce,
+                            booking=booking,
+                            guest_name=guest_name,
+                            expires_at=claims.expires_at,
+                        )
+                except IntegrityError:
+                    return self._error(_('Guest token has already been used.'))
+
+            visit = Visit.objects.create(
+                booking=booking,
+                visitor_type=claims.token_type,
+                visitor_name=guest_name if is_guest else booking.user.get_full_name(),
+                scanned_by=request.user
+            )
+            self._notify_later(visit)
+
+        return self._granted(visit, booking)
 
-        # Найти токен
+    def _scan_legacy(self, request, token_value, guest_name):
+        # Найти токен — сразу с юнитами/локацией для снепшота Visit
         try:
             token = AccessToken.objects.select_related(
-                'booking', 'booking__user', 'booking__storage_unit'
+                'booking__user',
+                'booking__storage_unit',
+                'storage_unit',
             ).get(token=token_value)
         except AccessToken.DoesNotExist:
-            return JsonResponse({
-                'success': False,
-                'error': _('Invalid token.')
-            }, status=404)
+            return self._error(_('Invalid token.'), status=404)
 
         # Проверить валидность
         if token.is_expired:
-            return JsonResponse({
-                'success': False,
-                'error': _('Token has expired.')
-            }, status=400)
+            return self._error(_('Token has expired.'))
 
-        if token.is_used and token.token_type == AccessToken.TokenType.GUEST:
-            return JsonResponse({
-                'success': False,
-                'error': _('Guest token has already been used.')
-            }, status=400)
+        is_guest = token.token_type == AccessToken.TokenType.GUEST
+        if is_guest and token.is_used:
+            return self._error(_('Guest token has already been used.'))
 
         # Для гостевого токена требуем имя гостя
-        if token.token_type == AccessToken.TokenType.GUEST:
-            if not guest_name:
-                return JsonResponse({
-                    'success': False,
-                    'error': _('Guest name is required.'),
-                    'require_guest_name': True,
-                    'unit': token.booking.storage_unit.full_code if token.booking.storage_unit else ''
-                }, status=400)
-
-            # Сохранить имя гостя в токен
-            token.guest_name = guest_name
-            token.save(update_fields=['guest_name'])
-
-
-
-        # Определить имя посетителя
-        if token.token_type == AccessToken.TokenType.OWNER:
-            visitor_name = token.booking.user.get_full_name()
-        else:
-            visitor_name = guest_name
-
-        # Создать запись посещения
-        visit = Visit.objects.create(
-            booking=token.booking,
-            access_token=token,
-            visitor_type=token.token_type,
-            visitor_name=visitor_name,
-            scanned_by=request.user
-        )
-
-        # Отметить гостевой токен как использованный
-        if token.token_type == AccessToken.TokenType.GUEST:
-            token.mark_as_used()
+        if is_guest and not guest_name:
+            return self._error(
+                _('Guest name is required.'),
+                require_guest_name=True,
+                unit=token.booking.storage_unit.full_code if token.booking.storage_unit else '',
+            )
 
+        with transaction.atomic():
+            if is_guest:
+                # Имя гостя + погашение одним условным UPDATE: второй менеджер,
+                # сканирующий тот же код параллельно, получит 0 строк
+                now = timezone.now()
+                claimed = AccessToken.objects.filter(pk=token.pk, is_used=False).update(
+                    guest_name=guest_name, is_used=True, used_at=now,
+                )
+                if not claimed:
+                    return self._error(_('Guest token has already been used.'))
+                token.guest_name, token.is_used, token.used_at = guest_name, True, now
+
+            visit = Visit.objects.create(
+                booking=token.booking,
+                access_token=token,
+                visitor_type=token.token_type,
+                visitor_name=guest_name if is_guest else token.booking.user.get_full_name(),
+                scanned_by=request.user
+            )
+            self._notify_later(visit)
 
-        # Отправить уведомление владельцу
-        try:
-            from notifications.services import notify_visit
-            notify_visit(visit)
-        except Exception as e:
-            import logging
-            logging.getLogger(__name__).error(f"Notification error: {e}")
+        return self._granted(visit, token.booking)
 
+    @staticmethod
+    def _notify_later(visit):
+        # Уведомить владельца после коммита, не задерживая ответ менеджеру
+        from notifications.services import notify_visit_by_id, send_later
+        send_later(notify_visit_by_id, visit.pk)
 
+    @staticmethod
+    def _granted(visit, booking):
         return JsonResponse({
             'success': True,
             'message': _('Access granted.'),
             'visit': {
                 'id': visit.id,
-                'unit': token.booking.storage_unit.full_code if token.booking.storage_unit else '',
+                'unit': visit.unit_code,
                 'visitor_type': visit.visitor_type,
                 'visitor_name': visit.visitor_name,
-                'owner_name': token.booking.user.get_full_name(),
-                'owner_email': token.booking.user.email,
+                'owner_name': booking.user.get_full_name(),
+                'owner_email': booking.user.email,
                 'visited_at': visit.visited_at.isoformat()
             }
         })
 
 
-class VisitHistoryView(LoginRequiredMixin, View):
-    """История посещений пользователя (API)"""
+class ScanBatchView(View):
+    """Пакетная загрузка сканов с офлайн-сканера (staff only, JSON).
+
+    Тело: {"events": [{"id", "token", "scanned_at", "guest_name"}, ...]}.
+    Ответ — результат по каждому событию в том же порядке.
+    """
+
+    def post(self, request):
+        if not request.user.is_authenticated or not request.user.is_staff:
+            return JsonResponse({
+                'success': False,
+                'error': _('Access denied.')
+            }, status=403)
+
+        try:
+            events = json.loads(request.body or b'{}').get('events')
+        except (ValueError, AttributeError):
+            events = None
+        if not isinstance(events, list):
+            return JsonResponse({
+                'success': False,
+                'error': _('Expected a JSON object with an "events" list.')
+            }, status=400)
+        if len(events) > MAX_BATCH_EVENTS:
+            return JsonResponse({
+                'success': False,
+                'error': _('Too many events in one batch.')
+            }, status=400)
+
+        results = ingest_scan_events(events, request.user)
+        return JsonResponse({'success': True, 'results': results})
+
+
+class ScanSnapshotView(View):
+    """Снапшот действующих броней для предпроверки на офлайн-сканере (staff only)."""
 
     def get(self, request):
-        booking_id = request.GET.get('booking_id')
+        if not request.user.is_authenticated or not request.user.is_staff:
+            return JsonResponse({
+                'success': False,
+                'error': _('Access denied.')
+            }, status=403)
 
-        visits_qs = Visit.objects.filter(
-            booking__user=request.user
-        ).select_related('booking__storage_unit')
+        response = JsonResponse({'success': True, **scanner_snapshot()})
+        response['Cache-Control'] = 'no-store'
+        response['Content-Disposition'] = 'attachment; filename="scanner-snapshot.json"'
+        return response
 
-        if booking_id:
-            visits_qs = visits_qs.filter(booking_id=booking_id)
 
-        visits = []
-        for visit in visits_qs[:50]:
-            visits.append({
-                'id': visit.id,
-                'unit': visit.booking.storage_unit.full_code if visit.booking.storage_unit else '',
-                'visitor_type': visit.visitor_type,
-                'visitor_name': visit.visitor_name,
-                'visited_at': visit.visited_at.isoformat()
-            })
+@method_decorator(staff_member_required, name='dispatch')
+class ScanMetricsView(View):
+    """Гистограмма латентности ScanQRView (staff only, JSON)."""
+
+    def get(self, request):
+        return JsonResponse({'success': True, 'scan': SCAN_LATENCY.snapshot()})
+
+
+class VisitHistoryView(LoginRequiredMixin, View):
+    """История посещений пользователя (API, курсорная пагинация)"""
+
+    def get(self, request):
+        try:
+            limit = int(request.GET.get('limit') or HISTORY_PAGE_SIZE)
+        except ValueError:
+            limit = HISTORY_PAGE_SIZE
+
+        try:
+            rows, next_cursor = visit_history_page(
+                request.user,
+                cursor=request.GET.get('cursor') or None,
+                limit=limit,
+                booking_id=request.GET.get('booking_id') or None,
+            )
+        except InvalidHistoryCursor:
+            return JsonResponse({
+                'success': False,
+                'error': _('Invalid cursor.')
+            }, status=400)
+
+        visits = [
+            {
+                'id': row['id'],
+                'unit': row['unit_code'],
+                'location': row['location_name'],
+                'visitor_type': row['visitor_type'],
+                'visitor_name': row['visitor_name'],
+                'visited_at': row['visited_at'].isoformat(),
+            }
+            for row in rows
+        ]
 
         return JsonResponse({
             'success': True,
-            'visits': visits
+            'visits': visits,
+            'next_cursor': next_cursor,
         })
 
 